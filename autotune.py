@@ -0,0 +1,80 @@
+import asyncio
+from collections import deque
+
+
+class ResizableSemaphore:
+    """可以随时调整上限的信号量：调小上限时不会打断已经占用名额的任务，它们释放后才生效"""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, int(limit))
+        self.in_use = 0
+        self._waiters = deque()
+
+    async def acquire(self):
+        while self.in_use >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_use += 1
+
+    def release(self):
+        self.in_use -= 1
+        self._wake()
+
+    def resize(self, limit: int):
+        self.limit = max(1, int(limit))
+        self._wake()
+
+    def _wake(self):
+        # 唤醒所有等待者，由它们重新检查名额
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class AIMD:
+    """加性增、乘性减（AIMD）调节器：一切正常时每次增加 step，出现拥塞信号时乘以 factor，结果限制在 [minimum, maximum]。
+
+    每次决策（包括保持不变）都会连同原因打印出来。
+    """
+
+    def __init__(self, name: str, value: float, minimum: float, maximum: float,
+                 step: float = 1, factor: float = 0.5, integer: bool = True, unit: str = ""):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.step = step
+        self.factor = factor
+        self.integer = integer
+        self.unit = unit
+        self.value = self._clamp(value)
+
+    def _clamp(self, value: float):
+        value = min(self.maximum, max(self.minimum, value))
+        return int(value) if self.integer else round(value, 2)
+
+    def _log(self, old, reason: str):
+        if old == self.value:
+            print(f"[autotune] {self.name} stays at {self.value:g}{self.unit}: {reason}")
+        else:
+            print(f"[autotune] {self.name} {old:g}{self.unit} -> {self.value:g}{self.unit}: {reason}")
+
+    def increase(self, reason: str) -> bool:
+        old = self.value
+        self.value = self._clamp(self.value + self.step)
+        self._log(old, reason if self.value != old else f"{reason} (at maximum)")
+        return self.value != old
+
+    def decrease(self, reason: str) -> bool:
+        old = self.value
+        self.value = self._clamp(self.value * self.factor)
+        self._log(old, reason if self.value != old else f"{reason} (at minimum)")
+        return self.value != old
+
+    def hold(self, reason: str):
+        self._log(self.value, reason)
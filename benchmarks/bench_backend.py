@@ -0,0 +1,176 @@
+"""对比 native 下载后端与 yutto 后端的耗时。
+
+native 后端使用本地 HTTP 替身服务，提供假的 playurl 和 DASH 视频流/音频流（可限制每个连接的速度，模拟 CDN），
+不访问真实的B站接口；需要 aiohttp 和 ffmpeg：
+
+    python benchmarks/bench_backend.py --videos 10 --size 20 --rate 5
+
+--segment_connections 1 关闭分段下载，可对比单连接与多连接分段下载（每个连接都受 --rate 限速）。
+
+yutto 无法指向本地服务，因此只测量每个视频启动一次 yutto 进程的固定开销（解释器启动、导入）；
+指定 --bvid 时再用两个后端分别下载同一个真实视频进行对比（需要网络，yutto 需在 PATH 中）：
+
+    python benchmarks/bench_backend.py --bvid BV1xx411c7mD --quality 80
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+
+import download_engine
+import dash_downloader
+
+
+def make_app(size: int, rate: float) -> web.Application:
+    """替身服务：/video/{n} 和 /audio/{n} 返回 size 字节的数据（支持 Range），每个连接限速 rate 字节/秒（0 表示不限速）"""
+    chunk = b"\0" * (64 * 1024)
+
+    async def stream(request):
+        total = size if request.match_info["kind"] == "video" else max(1, size // 8)
+        start, end = 0, total - 1
+        if request.http_range.start is not None or request.http_range.stop is not None:
+            start = request.http_range.start or 0
+            end = min(total, request.http_range.stop or total) - 1
+            response = web.StreamResponse(status=206, headers={
+                "Content-Length": str(end - start + 1),
+                "Content-Range": f"bytes {start}-{end}/{total}",
+            })
+        else:
+            response = web.StreamResponse(headers={"Content-Length": str(total)})
+        await response.prepare(request)
+        sent = 0
+        length = end - start + 1
+        started = time.monotonic()
+        while sent < length:
+            data = chunk[:min(len(chunk), length - sent)]
+            await response.write(data)
+            sent += len(data)
+            if rate > 0:
+                ahead = sent / rate - (time.monotonic() - started)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/{kind:video|audio}/{n}", stream)
+    return app
+
+
+def fake_playurl(base: str, n: int) -> dict:
+    return {
+        "quality": 80,
+        "dash": {
+            "video": [{"id": 80, "codecid": 7, "bandwidth": 1, "baseUrl": f"{base}/video/{n}", "backupUrl": []}],
+            "audio": [{"id": 30280, "bandwidth": 1, "baseUrl": f"{base}/audio/{n}", "backupUrl": []}],
+        },
+    }
+
+
+async def bench_native(videos: int, size: int, rate: float, concurrency: int, connections: int, segment_size: int, segment_connections: int) -> float:
+    runner = web.AppRunner(make_app(size, rate))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    base = f"http://127.0.0.1:{port}"
+
+    async def resolver(bvid, cid):
+        return fake_playurl(base, cid)
+
+    downloader = dash_downloader.DashDownloader(
+        resolver=resolver, connections=connections,
+        segment_size=segment_size, segment_connections=segment_connections
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    output_dir = tempfile.mkdtemp(prefix="bench_backend_")
+
+    async def one(n):
+        async with semaphore:
+            await downloader.download_part("BVbench", n, 80, os.path.join(output_dir, f"{n}.mp4"))
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(n) for n in range(videos)))
+        return time.perf_counter() - started
+    finally:
+        await downloader.close()
+        await runner.cleanup()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def bench_yutto_startup(videos: int) -> float:
+    """启动 videos 次 yutto 进程的耗时，即 yutto 后端每个视频的固定开销"""
+    started = time.perf_counter()
+    for _ in range(videos):
+        subprocess.run(["yutto", "--version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - started
+
+
+async def bench_real(bvid: str, quality: str) -> dict:
+    """用两个后端分别下载同一个真实视频"""
+    download_engine.api_limiter.set_rate(0)
+    download_engine.cdn_limiter.set_rate(0)
+    video_info = await download_engine.get_video_info(bvid, "", "", "")
+    url = f"https://www.bilibili.com/video/{bvid}"
+    results = {}
+    for backend in download_engine.DOWNLOAD_BACKENDS:
+        download_engine.download_backend = backend
+        output_dir = tempfile.mkdtemp(prefix=f"bench_{backend}_")
+        try:
+            started = time.perf_counter()
+            await download_engine.download_video(url, output_dir, quality, "", video_info)
+            results[backend] = time.perf_counter() - started
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+    await download_engine.close_download_backend()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the native download backend against yutto")
+    parser.add_argument("--videos", type=int, default=10, help="Number of fake videos (default: 10)")
+    parser.add_argument("--size", type=float, default=20, help="Video stream size in MiB (default: 20)")
+    parser.add_argument("--rate", type=float, default=5, help="Per-connection speed in MiB/s, 0 for unlimited (default: 5)")
+    parser.add_argument("--concurrency", type=int, default=2, help="Videos downloaded at the same time (default: 2)")
+    parser.add_argument("--connections", type=int, default=16, help="HTTP connection pool size (default: 16)")
+    parser.add_argument("--segment_size", type=float, default=8, help="Ranged download segment size in MiB (default: 8)")
+    parser.add_argument("--segment_connections", type=int, default=4,
+                        help="Segments of one stream downloaded at the same time, 1 disables ranged downloads (default: 4)")
+    parser.add_argument("--bvid", type=str, help="Also download this real video with both backends")
+    parser.add_argument("--quality", type=str, default="80", help="Quality for --bvid (default: 80)")
+    args = parser.parse_args()
+
+    if shutil.which("ffmpeg") is None:
+        sys.exit("ffmpeg not found in PATH")
+
+    size = int(args.size * 1024 * 1024)
+    elapsed = asyncio.run(bench_native(
+        args.videos, size, args.rate * 1024 * 1024, args.concurrency, args.connections,
+        int(args.segment_size * 1024 * 1024), args.segment_connections
+    ))
+    total = args.videos * (size + max(1, size // 8))
+    print(f"native ({args.segment_connections} connection(s) per stream): {args.videos} videos, {total / 1024 / 1024:.1f} MiB in {elapsed:.2f}s "
+          f"({total / 1024 / 1024 / elapsed:.1f} MiB/s, {elapsed / args.videos:.2f}s/video)")
+
+    if shutil.which("yutto"):
+        startup = bench_yutto_startup(args.videos)
+        print(f"yutto: process start-up alone takes {startup:.2f}s for {args.videos} videos ({startup / args.videos:.2f}s/video)")
+    else:
+        print("yutto: not found in PATH, skipped")
+
+    if args.bvid:
+        for backend, seconds in asyncio.run(bench_real(args.bvid, args.quality)).items():
+            print(f"{args.bvid} via {backend}: {seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""对比顺序翻页与并发翻页获取视频列表的耗时。
+
+使用模拟的 user.User（每次请求固定延迟），不访问真实的B站接口：
+
+    python benchmarks/bench_listing.py --videos 5000 --latency 0.2 --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import download_engine
+
+
+class MockUser:
+    """模拟 bilibili_api.user.User 的分页接口"""
+
+    videos = 0
+    latency = 0.0
+    requests = 0
+
+    def __init__(self, uid: int, credential=None):
+        self.uid = uid
+
+    async def get_videos(self, pn: int = 1, ps: int = 30, **kwargs) -> dict:
+        MockUser.requests += 1
+        await asyncio.sleep(MockUser.latency)
+        start = (pn - 1) * ps
+        end = min(start + ps, MockUser.videos)
+        vlist = [{"bvid": f"BV{MockUser.videos - k:010d}"} for k in range(start, end)]
+        return {"list": {"vlist": vlist}, "page": {"pn": pn, "ps": ps, "count": MockUser.videos}}
+
+
+async def sequential_listing(uid: int) -> list:
+    """旧的实现：逐页请求直到空页"""
+    u = download_engine.user.User(uid=uid)
+    page = 1
+    video_urls = []
+    while True:
+        res = await u.get_videos(pn=page)
+        if not res["list"]["vlist"]:
+            break
+        video_urls += [f"https://www.bilibili.com/video/{v['bvid']}" for v in res["list"]["vlist"]]
+        page += 1
+    return video_urls
+
+
+def run(label: str, coro) -> list:
+    MockUser.requests = 0
+    start = time.perf_counter()
+    result = asyncio.run(coro)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {elapsed:8.2f}s  {MockUser.requests:5d} requests  {len(result)} videos")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark paginated video listing against a mock API")
+    parser.add_argument("--videos", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per mocked API request")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    MockUser.videos = args.videos
+    MockUser.latency = args.latency
+    download_engine.user.User = MockUser
+    # 只比较翻页方式本身，不受 API 限速影响
+    download_engine.api_limiter.set_rate(0)
+
+    sequential = run("sequential", sequential_listing(0))
+    concurrent = run(f"concurrent (x{args.concurrency})", download_engine.fetch_video_list(0, args.concurrency))
+    assert sequential == [v["url"] for v in concurrent], "listing order differs"
+
+
+if __name__ == "__main__":
+    main()
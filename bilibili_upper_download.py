@@ -1,379 +1,22 @@
-import asyncio
 import argparse
-import subprocess
-import csv
-import os
-from bilibili_api import user, sync
-import toml
-from pathlib import Path
-from copy import deepcopy
-
-import tempfile
-import shutil
-
-
-def truncate_long_values(d, max_length=500):
-    """
-    递归遍历字典，若某个非字典元素的字符串长度超过 max_length，则去掉该元素。
-    参数:
-        d (dict): 输入字典
-        max_length (int): 字符串最大长度限制，默认为50
-    返回:
-        dict: 处理后的字典
-    """
-    result = {}
-    for key, value in d.items():
-        if isinstance(value, dict):
-            # 如果值是字典，递归调用
-            result[key] = truncate_long_values(value, max_length)
-        else:
-            # 如果值不是字典，转成字符串检查长度
-            str_value = str(value)
-            if len(str_value) <= max_length or key=="title" or key=="duration" or key=="pages":
-                result[key] = value  # 长度不超过限制，保留原值
-            # 超过长度则跳过，不加入结果
-    return result
-
-
-def extract_and_convert_time(input_str):
-    # 提取字符串中的所有数字
-    num_str = ''.join(char for char in input_str if char.isdigit())
-    # 转换为整数（秒数）
-    try:
-        seconds = int(num_str)
-    except ValueError:
-        return "输入无效，无法提取数字"
-    # 计算时间单位
-    days = seconds // (24 * 3600)
-    remaining_seconds = seconds % (24 * 3600)
-    hours = remaining_seconds // 3600
-    remaining_seconds %= 3600
-    minutes = remaining_seconds // 60
-    secs = remaining_seconds % 60
-    # 构建结果字符串
-    result = ""
-    if days > 0:
-        result += f"{days}d"
-    if hours > 0 or days > 0:  # 即使hours为0，如果有天数也要显示
-        result += f"{hours}h"
-    if minutes > 0 or hours > 0 or days > 0:  # 即使minutes为0，如果有小时或天数也要显示
-        result += f"{minutes}m"
-    result += f"{secs}s"
-    return result
-
-def read_toml_config(file_path: str = os.path.join(os.getcwd(), "config.toml")) -> dict:
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            config_data = toml.load(f)
-        return config_data
-    except FileNotFoundError:
-        print(f"Error: Config file not found at {file_path}")
-        raise
-    except toml.TomlDecodeError as e:
-        print(f"Error: Invalid TOML format in {file_path}: {e}")
-        raise
-    except Exception as e:
-        print(f"Unexpected error reading {file_path}: {e}")
-        raise
-
-# async def get_video_info(bvid: str, SESSDATA: str, BILI_JCT: str, BUVID3: str) -> dict:
-#     from bilibili_api import video, Credential
-#     #credential = Credential(sessdata=SESSDATA, bili_jct=BILI_JCT, buvid3=BUVID3)
-#     credential = Credential(sessdata='', bili_jct='', buvid3='')
-#     v = video.Video(bvid=bvid, credential=credential)
-#     info = await v.get_info()
-#     return info
-
-async def get_video_info(bvid: str, SESSDATA: str, BILI_JCT: str, BUVID3: str) -> dict:
-    from bilibili_api import video, Credential
-    import asyncio
-    
-    #credential = Credential(sessdata=SESSDATA, bili_jct=BILI_JCT, buvid3=BUVID3)
-    credential = Credential(sessdata='', bili_jct='', buvid3='')
-    v = video.Video(bvid=bvid, credential=credential)
-    
-    for attempt in range(5):  # 尝试5次
-        try:
-            info = await v.get_info()
-            return truncate_long_values(info)
-        except Exception as e:
-            error_msg = str(e)
-            # 如果错误信息包含“稿件不可见”，立即返回带默认值的字典
-            if "稿件不可见" in error_msg:
-                return {"title": "稿件不可见", "duration": 0, "pages": []}
-            # 如果不是最后一次尝试，等待1秒后重试
-            if attempt < 4:
-                await asyncio.sleep(1)  # 等待1秒
-                continue
-            # 如果是最后一次尝试仍然失败，返回带默认值的字典
-            return {"title": "get_video_info失败", "duration": 0, "pages": []}
-
-
-async def get_user_name(uid: int) -> str:
-    u = user.User(uid)
-    user_info = sync(u.get_user_info())
-    return user_info["name"]
-
-def get_file_names(output_dir: str, video_info: dict) -> list:
-    """获取视频文件名"""
-    filenames=[]
-    title = video_info['title']
-    if len( video_info['pages'])==1:
-        return [os.path.join(output_dir, f"{title}.mp4")]
-    # 如果有分P，添加P数
-    for pages in video_info['pages']:
-        filenames.append(os.path.join(output_dir, title, f"{pages['part']}.mp4")) 
-    return filenames
-
-async def get_user_video_urls(uid: int, output_dir: str, updatefile: bool = False) -> list:
-    """获取指定用户的所有视频URL，并处理CSV文件"""
-    csv_path = Path(output_dir) / "video_urls.csv"
-    video_urls = []
-
-    if csv_path.exists():
-        print(f"Reading video URLs from {csv_path}")
-        # 读取现有CSV文件
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            video_urls = list(reader)
-        
-        # 检查是否所有视频都已下载
-        all_downloaded = all(v['downloaded'] == 'True' for v in video_urls)
-        if all_downloaded and updatefile:
-            # 询问用户是否需要更新
-            update = input("All videos appear to be downloaded. Do you want to check for updates? (y/n): ")
-            if update.lower() == 'y':
-                # 重新抓取视频列表
-                u = user.User(uid=uid)
-                page = 1
-                new_video_urls = []
-                
-                while True:
-                    try:
-                        res = await u.get_videos(pn=page)
-                        if not res["list"]["vlist"]:
-                            break
-                        for video_item in res["list"]["vlist"]:
-                            new_video_urls.append({
-                                'url': f"https://www.bilibili.com/video/{video_item['bvid']}",
-                                'title': '',
-                                'duration': '',
-                                'downloaded': 'False',
-                                'file_path': ''
-                            })
-                        page += 1
-                    except Exception as e:
-                        print(f"Error fetching video list page {page}: {e}")
-                        break
-                
-                # 找出新视频（不在原有列表中的URL）
-                existing_urls = {v['url'] for v in video_urls}
-                new_videos = [v for v in new_video_urls if v['url'] not in existing_urls]
-                
-                if new_videos:
-                    video_urls.extend(new_videos)
-                    print(f"Found {len(new_videos)} new videos to add to the list.")
-                    save_to_csv(video_urls, csv_path)
-                else:
-                    print("No new videos found.")
-        
-        return video_urls
-
-    # 如果没有CSV文件，获取视频列表
-    u = user.User(uid=uid)
-    page = 1
-    
-    while True:
-        try:
-            res = await u.get_videos(pn=page)
-            if not res["list"]["vlist"]:
-                break
-            for video_item in res["list"]["vlist"]:
-                video_urls.append({
-                    'url': f"https://www.bilibili.com/video/{video_item['bvid']}",
-                    'title': '',
-                    'duration': '',
-                    'downloaded': 'False',
-                    'file_path': ''
-                })
-            page += 1
-        except Exception as e:
-            print(f"Error fetching video list page {page}: {e}")
-            break
-    
-    # 保存初始CSV文件
-    save_to_csv(video_urls, csv_path)
-    return video_urls
-
-
-
-def save_to_csv(video_urls: list, csv_path: Path):
-    """保存视频信息到CSV文件"""
-    video_urls_temp = deepcopy(video_urls)
-    for item in video_urls_temp:
-        for key in item:
-            item[key] = str(item[key])
-    fieldnames = ['url', 'title', 'duration', 'downloaded', 'file_path','info']
-    # 创建临时文件
-    with tempfile.NamedTemporaryFile(mode='w', encoding='utf-8', newline='', delete=False) as temp_file:
-        try:
-            writer = csv.DictWriter(temp_file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(video_urls_temp)
-            temp_file.flush()  # 确保内容写入磁盘
-            # 只有当写入成功时才替换原文件
-            shutil.move(temp_file.name, csv_path)
-        except Exception as e:
-            # 如果发生错误，删除临时文件并抛出异常
-            temp_file.close()
-            Path(temp_file.name).unlink()
-            raise e
-
-
-def download_video(url: str, output_dir: str, quality: str, sessdata: str, video_info: dict, timeout: int) -> str:
-    if timeout>60*40:
-        timeout = 60*40
-    """使用yutto下载单个视频并返回文件路径"""
-    if (len(video_info['pages'])==0):
-        return []
-    if (len(video_info['pages'])>1):
-        command = [
-            "yutto",
-            "--sessdata", str(sessdata),
-            "-d", str(output_dir),
-            "-q", str(quality),
-            "-b",
-            "-p", "1~-1",
-            "--download-interval", "2",
-            "--save-cover",
-            url
-        ]
-    else:
-        command = [
-            "yutto",
-            "--sessdata", str(sessdata),
-            "-d", str(output_dir),
-            "-q", str(quality),
-            "-p", "1~-1",
-            "--download-interval", "2",
-            "--save-cover",
-            url
-        ]
-    subprocess.run(command, check=True, timeout=timeout)
-    # 假设下载的文件名基于URL的bvid
-    bvid = url.split("/")[-1]
-    # file_path = os.path.join(output_dir, f"{title}.mp4")  # 可能需要根据实际情况调整
-    filepaths = get_file_names(output_dir, video_info)
-    print(f"Successfully downloaded: {url}")
-    return filepaths
-
-
-
-async def download_all_videos(arg_dict: dict, progress_callback=None):
-    uid = arg_dict["uid"]
-    output_dir = arg_dict["output_dir"]
-    quality = arg_dict["video_quality"]
-
-    up_name = await get_user_name(uid)
-    output_dir = os.path.join(output_dir, up_name)
-    os.makedirs(output_dir, exist_ok=True)
-
-    if progress_callback:
-        progress_callback(f"Fetching video list for UID: {uid} (UP: {up_name})\n")
-    
-    print(f"Fetching video list for UID: {uid}")
-    video_urls = await get_user_video_urls(uid, output_dir, updatefile=True)
-    
-    csv_path = Path(output_dir) / "video_urls.csv"
-    
-
-    if not video_urls:
-        print("No videos found for this user.")
-        if progress_callback:
-            progress_callback("No videos found for this user.\n")
-        return
-    
-    total_videos = len(video_urls)
-
-    if progress_callback:
-        progress_callback(f"Found {total_videos} videos\n")
-    
-    print(f"Found {total_videos} videos")
-
-    log_file = os.path.join(os.path.dirname(__file__), "download_errors.log")
-
-    for i, video in enumerate(video_urls, 1):
-        url = video['url']
-        if video['downloaded'] == 'True':
-            print(f"Skipping already downloaded video {i}/{total_videos}: {video['title']}")
-            continue
-
-        bvid = url.split("/")[-1]
-        # video_info = await get_video_info(
-        #     bvid=bvid,
-        #     SESSDATA=arg_dict["SESSDATA"],
-        #     BILI_JCT=arg_dict["BILI_JCT"],
-        #     BUVID3=arg_dict["BUVID3"]
-        # )
-        video_info = await get_video_info(
-            bvid=bvid,
-            SESSDATA="",
-            BILI_JCT="",
-            BUVID3=""
-        )
-        
-        if (len(video_info['pages']) <1):
-            print(f"Skipping disappeared video {i}/{total_videos}: {video['url']}")
-            continue
-
-        # 更新视频信息
-        video['title'] = video_info['title']
-        # video['duration'] = str(video_info['duration'])
-        video['duration'] = extract_and_convert_time(str(video_info['duration']))
-        video['info'] = str(video_info)
-        save_to_csv(video_urls, csv_path)
-
-        print(f"Downloading video {i}/{total_videos}")
-        print(f"视频名称：{video_info['title']}，视频时长：{video['duration']}")
-        if progress_callback:
-            progress_callback(f"Downloading video {i}/{total_videos}: {video_info['title']} (Duration: {video['duration']})\n")
+import asyncio
+from download_engine import (
+    DownloadEngine, DEFAULT_SETTINGS, DEFAULT_WATCH_INTERVAL, DEFAULT_MIN_FREE_SPACE, DEFAULT_STALL_TIMEOUT,
+    DOWNLOAD_BACKENDS, read_toml_config
+)
 
-        estimated_time = 5 + video_info['duration'] * 2
-        max_attempts = 5
-        success = False
-        attempt = 0
 
-        while attempt < max_attempts and not success:
-            attempt += 1
-            try:
-                if progress_callback:
-                    progress_callback(f"Attempt {attempt}/{max_attempts} for video {i}/{total_videos}\n")
-                print(f"Download attempt #{attempt}")
-                file_path = download_video(url, output_dir, quality, arg_dict["SESSDATA"], title=video_info,timeout=estimated_time)
-                video['downloaded'] = 'True'
-                video['file_path'] = str(file_path)
-                save_to_csv(video_urls, csv_path)
-                success = True
-            except subprocess.TimeoutExpired:
-                print(f"Timeout for {url}, will retry...")
-                if progress_callback:
-                    progress_callback(f"Timeout for {url}, retrying...\n")
-            except subprocess.CalledProcessError as e:
-                print(f"Error downloading {url}: {e}, will retry...")
-                if progress_callback:
-                    progress_callback(f"Error downloading {url}: {e}, retrying...\n")
-            except Exception as e:
-                print(f"Unexpected error downloading {url}: {e}, will retry...")
-                if progress_callback:
-                    progress_callback(f"Unexpected error downloading {url}: {e}, retrying...\n")
+def resolve_uploaders(arg_dict: dict, toml_args: dict) -> list:
+    """确定要下载的UP主：命令行 --uid 优先，其次是 config.toml 中的 [[uploaders]]，最后是 [basic] uid"""
+    uids = arg_dict.get("uid")
+    if uids and isinstance(uids, (list, tuple)):
+        return [{"uid": uid} for uid in uids]
+    if toml_args.get("uploaders"):
+        return [dict(uploader) for uploader in toml_args["uploaders"] if uploader.get("uid")]
+    if uids:
+        return [{"uid": uids}]
+    return []
 
-        if not success:
-            video['downloaded'] = 'False'
-            save_to_csv(video_urls, csv_path)
-            if progress_callback:
-                progress_callback(f"Failed to download {url} after {max_attempts} attempts.\n")
-            with open(log_file, "a", encoding="utf-8") as lf:
-                lf.write(f"Failed to download {url} after {max_attempts} attempts.\n")
 
 def parse_arguments():
     """解析命令行参数"""
@@ -383,8 +26,10 @@ def parse_arguments():
     parser.add_argument(
         "-u", "--uid",
         type=int,
-        required=True,
-        help="Bilibili user UID"
+        nargs="+",
+        required=False,
+        help="Bilibili user UID(s); several UIDs are downloaded through one shared queue "
+             "(default: [[uploaders]] or [basic] uid in config.toml)"
     )
     parser.add_argument(
         "-o", "--output_dir",
@@ -400,18 +45,78 @@ def parse_arguments():
                  "80","74","64","32","16"],
         help="Video quality (default: 127 - 8K)"
     )
+    parser.add_argument(
+        "-j", "--concurrency",
+        type=int,
+        required=False,
+        help="Number of videos to download at the same time (default: 1)"
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        required=False,
+        help="Number of upcoming videos whose info is fetched ahead of the downloads (default: 4)"
+    )
+    parser.add_argument(
+        "--list_concurrency",
+        type=int,
+        required=False,
+        help="Number of video list pages fetched at the same time (default: 4)"
+    )
+    parser.add_argument(
+        "-s", "--sync",
+        action="store_true",
+        default=None,
+        help="Check for new uploads since the last run without prompting (for scheduled runs)"
+    )
+    parser.add_argument(
+        "-w", "--watch",
+        action="store_true",
+        default=None,
+        help="Keep running and check the uploaders for new videos periodically"
+    )
+    parser.add_argument(
+        "--watch_interval",
+        type=float,
+        required=False,
+        help=f"Seconds between checks for new videos in watch mode (default: {DEFAULT_WATCH_INTERVAL})"
+    )
+    parser.add_argument(
+        "--autotune",
+        action="store_true",
+        default=None,
+        help="Adjust the number of concurrent downloads (between min_concurrency and max_concurrency) "
+             "and the API rate automatically"
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        required=False,
+        help="Upper bound for --autotune (default: 8)"
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=list(DOWNLOAD_BACKENDS),
+        required=False,
+        help="Download backend: yutto (one yutto process per video) or native (in-process DASH downloader, needs aiohttp and ffmpeg) (default: yutto)"
+    )
+    parser.add_argument(
+        "--min_free_space",
+        type=float,
+        required=False,
+        help=f"Pause the download queue while less than this many GiB of disk space would be left (default: {DEFAULT_MIN_FREE_SPACE})"
+    )
+    parser.add_argument(
+        "--stall_timeout",
+        type=float,
+        required=False,
+        help=f"Restart a download after this many seconds without progress (default: {DEFAULT_STALL_TIMEOUT})"
+    )
     return parser.parse_args()
-
 def main():
-    arg_dict = {
-        "uid": 0,
-        "output_dir": "~/Downloads",
-        "video_quality": "",
-        "SESSDATA": "",
-        "BILI_JCT": "",
-        "BUVID3": "",
-    }
     """程序入口"""
+    arg_dict = dict(DEFAULT_SETTINGS)
 
     toml_args = read_toml_config()
     args = parse_arguments()
@@ -425,7 +130,20 @@ def main():
         if key in args and args[key] != "" and args[key] is not None:
             arg_dict[key] = args[key]
 
-    asyncio.run(download_all_videos(arg_dict))
+    uploaders = resolve_uploaders(arg_dict, toml_args)
+    if not uploaders:
+        print("Error: no uploader given, use --uid or add [[uploaders]] to config.toml")
+        return
+
+    engine = DownloadEngine(arg_dict)
+    engine.configure(toml_args["basic"])
+    if arg_dict["watch"]:
+        try:
+            asyncio.run(engine.run_console(uploaders, watch=True))
+        except KeyboardInterrupt:
+            print("Watch mode stopped.")
+    else:
+        asyncio.run(engine.run_console(uploaders))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
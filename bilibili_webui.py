@@ -1,8 +1,9 @@
 import gradio as gr
 import asyncio
-import subprocess
 import os
-from bilibili_upper_download import read_toml_config, get_user_name, get_user_video_urls, get_video_info, download_video
+from download_engine import DownloadEngine
+from log_buffer import webui_log
+from events import describe, UploaderListed, JobStarted, JobMerged, RunFinished
 
 # Language dictionaries
 TEXTS = {
@@ -61,176 +62,69 @@ TEXTS = {
 }
 
 async def run_download(uid, output_dir, video_quality, sessdata, bili_jct, buvid3):
+    """通过下载引擎下载UP主的所有视频，把引擎发布的事件转换为界面上各个字段的值"""
     quality_value = video_quality.split(" ")[0]
-    
-    arg_dict = {
-        "uid": int(uid),
-        "output_dir": str(output_dir if output_dir else "~/Downloads"),
-        "video_quality": str(quality_value),
-        "SESSDATA": sessdata,
-        "BILI_JCT": bili_jct,
-        "BUVID3": buvid3,
-    }
 
     try:
-        toml_args = read_toml_config()
-        for key in arg_dict:
-            if key in toml_args["basic"] and toml_args["basic"][key] != "" and toml_args["basic"][key] is not None:
-                arg_dict[key] = toml_args["basic"][key]
+        engine = DownloadEngine.from_config({
+            "output_dir": output_dir,
+            "video_quality": quality_value,
+            "SESSDATA": sessdata,
+            "BILI_JCT": bili_jct,
+            "BUVID3": buvid3,
+        })
     except Exception as e:
         yield {"log": f"Error loading TOML config: {e}\n", "up_name": "", "total_videos": "", "current_video": "", "duration": "", "progress": 0, "downloaded_videos": []}
         return
 
-    up_name = await get_user_name(int(uid))
-    video_urls = await get_user_video_urls(int(uid))
-    total_videos = len(video_urls)
-
-    output_dir = os.path.expanduser(os.path.join(arg_dict["output_dir"], up_name))
-    os.makedirs(output_dir, exist_ok=True)
+    # 日志只保留最近的若干行，更早的写入磁盘（默认 logs/bilibili_webui.log）
+    log = webui_log("bilibili_webui", engine.config)
     downloaded_videos = []  # 存储视频路径
-
-    yield {
-        "log": f"Fetching video list for UID: {uid} (UP: {up_name})\nFound {total_videos} videos to download\n",
-        "up_name": up_name,
-        "total_videos": str(total_videos),
-        "current_video": "",
-        "duration": "",
-        "progress": 0,
-        "downloaded_videos": downloaded_videos
-    }
-
-    if not video_urls:
-        yield {
-            "log": "No videos found for this user.\n",
-            "up_name": up_name,
-            "total_videos": "0",
-            "current_video": "",
-            "duration": "",
-            "progress": 0,
-            "downloaded_videos": downloaded_videos
-        }
-        return
-
-    log_file = os.path.join(os.path.dirname(__file__), "download_errors.log")
-    for i, url in enumerate(video_urls, 1):
-        print(f"Downloading video {i}/{len(video_urls)}")
-        bvid = url.split("/")[-1]
-        video_info = await get_video_info(bvid, arg_dict["SESSDATA"], arg_dict["BILI_JCT"], arg_dict["BUVID3"])
-        current_video = video_info["title"]
-        duration = str(video_info["duration"]) + "s"
-        progress = round((i / total_videos) * 100, 2)
-        
-        yield {
-            "log": f"Starting download {i}/{total_videos}: {current_video}\n",
-            "up_name": up_name,
-            "total_videos": str(total_videos),
-            "current_video": current_video,
-            "duration": duration,
-            "progress": progress,
-            "downloaded_videos": downloaded_videos
-        }
-
-        estimated_time = 5 + video_info["duration"] * 2
-        max_attempts = 5
-        success = False
-        attempt = 0
-
-        while attempt < max_attempts and not success:
-            attempt += 1
-            try:
-                yield {
-                    "log": f"Attempt {attempt}/{max_attempts} for video {i}/{total_videos}: {current_video}\n",
-                    "up_name": up_name,
-                    "total_videos": str(total_videos),
-                    "current_video": current_video,
-                    "duration": duration,
-                    "progress": progress,
-                    "downloaded_videos": downloaded_videos
-                }
-                download_video(url, output_dir, arg_dict["video_quality"], arg_dict["SESSDATA"], title=current_video, timeout=estimated_time)
-                success = True
-                video_path = os.path.abspath(os.path.join(output_dir, f"{current_video}.mp4"))
-                downloaded_videos.append(video_path)
-                progress = round((i / total_videos) * 100, 2)
-                yield {
-                    "log": f"Successfully downloaded {i}/{total_videos}: {current_video}\nVideo saved at: {video_path}\n",
-                    "up_name": up_name,
-                    "total_videos": str(total_videos),
-                    "current_video": current_video,
-                    "duration": duration,
-                    "progress": progress,
-                    "downloaded_videos": downloaded_videos
-                }
-            except subprocess.TimeoutExpired:
-                yield {
-                    "log": f"Timeout on attempt {attempt}/{max_attempts} for {url}, retrying...\n",
-                    "up_name": up_name,
-                    "total_videos": str(total_videos),
-                    "current_video": current_video,
-                    "duration": duration,
-                    "progress": progress,
-                    "downloaded_videos": downloaded_videos
-                }
-            except subprocess.CalledProcessError as e:
-                yield {
-                    "log": f"Error on attempt {attempt}/{max_attempts} for {url}: {e}, retrying...\n",
-                    "up_name": up_name,
-                    "total_videos": str(total_videos),
-                    "current_video": current_video,
-                    "duration": duration,
-                    "progress": progress,
-                    "downloaded_videos": downloaded_videos
-                }
-            except Exception as e:
-                yield {
-                    "log": f"Unexpected error on attempt {attempt}/{max_attempts} for {url}: {e}, retrying...\n",
-                    "up_name": up_name,
-                    "total_videos": str(total_videos),
-                    "current_video": current_video,
-                    "duration": duration,
-                    "progress": progress,
-                    "downloaded_videos": downloaded_videos
-                }
-
-        if not success:
-            error_msg = f"Failed to download {url} after {max_attempts} attempts.\n"
-            with open(log_file, "a", encoding="utf-8") as lf:
-                lf.write(error_msg)
-            yield {
-                "log": error_msg,
-                "up_name": up_name,
-                "total_videos": str(total_videos),
-                "current_video": current_video,
-                "duration": duration,
-                "progress": progress,
-                "downloaded_videos": downloaded_videos
-            }
-
-    yield {
-        "log": "Download completed successfully!\n",
-        "up_name": up_name,
-        "total_videos": str(total_videos),
-        "current_video": "",
-        "duration": "",
-        "progress": 100,
-        "downloaded_videos": downloaded_videos
-    }
+    state = {"log": "", "up_name": "", "total_videos": "", "current_video": "", "duration": "", "progress": 0, "downloaded_videos": downloaded_videos}
+    events = engine.events([{"uid": int(uid)}])
+    try:
+        async for event in events:
+            message = describe(event, "en")
+            if not message:
+                continue
+            log.append(message, getattr(event, "title", ""))
+            state["log"] = log.text()
+            if isinstance(event, UploaderListed):
+                state.update(up_name=event.up_name, total_videos=str(event.total))
+            elif isinstance(event, JobStarted):
+                state.update(
+                    current_video=event.title, duration=event.duration,
+                    progress=round(event.index / event.total * 100, 2) if event.total else 0
+                )
+            elif isinstance(event, JobMerged):
+                downloaded_videos.extend(os.path.abspath(path) for path in event.file_paths)
+            elif isinstance(event, RunFinished):
+                state.update(current_video="", duration="", progress=100)
+            yield dict(state)
+    finally:
+        # 关闭引擎的事件流：取消并等待下载结束（结束 yutto 子进程）
+        await events.aclose()
 
 def download_wrapper(uid, output_dir, video_quality, sessdata, bili_jct, buvid3):
     async def run_generator():
-        async for result in run_download(uid, output_dir, video_quality, sessdata, bili_jct, buvid3):
-            # 限制下拉菜单显示最近 50 个视频
-            video_options = [os.path.basename(path) for path in result["downloaded_videos"][-50:]]
-            yield (
-                result["log"],
-                result["up_name"],
-                result["total_videos"],
-                result["current_video"],
-                result["duration"],
-                result["progress"],
-                gr.update(choices=video_options),
-                result["downloaded_videos"]
-            )
+        updates = run_download(uid, output_dir, video_quality, sessdata, bili_jct, buvid3)
+        try:
+            async for result in updates:
+                # 限制下拉菜单显示最近 50 个视频
+                video_options = [os.path.basename(path) for path in result["downloaded_videos"][-50:]]
+                yield (
+                    result["log"],
+                    result["up_name"],
+                    result["total_videos"],
+                    result["current_video"],
+                    result["duration"],
+                    result["progress"],
+                    gr.update(choices=video_options),
+                    result["downloaded_videos"]
+                )
+        finally:
+            await updates.aclose()
+
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     gen = run_generator()
@@ -242,6 +136,9 @@ def download_wrapper(uid, output_dir, video_quality, sessdata, bili_jct, buvid3)
     except StopAsyncIteration:
         pass
     finally:
+        # 页面停止接收时结束生成器，取消正在进行的下载，等所有任务结束后再关闭事件循环
+        loop.run_until_complete(gen.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
         loop.close()
 
 async def load_video_with_timeout(video_path, timeout=5):
@@ -0,0 +1,387 @@
+import asyncio
+import json
+import os
+import subprocess
+import time
+import weakref
+from pathlib import Path
+from urllib.parse import urlparse
+
+import aiohttp
+
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Referer": "https://www.bilibili.com",
+}
+# 同一 codec 优先级与 yutto 默认的 avc 一致，其次 hevc、av1
+_CODEC_PRIORITY = {7: 0, 12: 1, 13: 2}
+_MIB = 1024 * 1024
+
+
+class StreamStalled(Exception):
+    """视频流连续 stall_timeout 秒没有收到任何数据"""
+
+
+def _stream_urls(stream: dict) -> list:
+    """视频流的主地址和备用地址"""
+    urls = [stream.get("baseUrl") or stream.get("base_url")]
+    urls += stream.get("backupUrl") or stream.get("backup_url") or []
+    return [url for url in urls if url]
+
+
+def select_streams(playurl: dict, quality: int) -> tuple:
+    """从 playurl 接口的返回中选择视频流和音频流，返回 (视频流地址列表, 音频流地址列表)
+
+    视频取不超过 quality 的最高画质，同画质优先 avc；音频取码率最高的一路（包括杜比和 Hi-Res）。
+    没有音频流时音频地址列表为空。
+    """
+    dash = playurl.get("dash")
+    if not dash:
+        raise RuntimeError(f"playurl 未返回 DASH 视频流 (quality={playurl.get('quality')})")
+    videos = dash.get("video") or []
+    if not videos:
+        raise RuntimeError("playurl 未返回视频流")
+    allowed = [v for v in videos if v.get("id", 0) <= quality] or videos
+    best_id = max(v.get("id", 0) for v in allowed)
+    video = min(
+        (v for v in allowed if v.get("id", 0) == best_id),
+        key=lambda v: (_CODEC_PRIORITY.get(v.get("codecid"), len(_CODEC_PRIORITY)), -v.get("bandwidth", 0)),
+    )
+
+    audios = list(dash.get("audio") or [])
+    audios += (dash.get("dolby") or {}).get("audio") or []
+    flac = (dash.get("flac") or {}).get("audio")
+    if flac:
+        audios.append(flac)
+    audio = max(audios, key=lambda a: a.get("bandwidth", 0)) if audios else None
+    return _stream_urls(video), _stream_urls(audio) if audio else []
+
+
+def stream_identity(url: str, size: int) -> str:
+    """视频流的标识：CDN 地址的路径加文件大小。
+
+    地址中的查询参数（有效期、签名）每次获取 playurl 都会变化，主地址和备用地址的域名也不同，
+    路径和大小不变时才认为是同一个文件，可以续传。
+    """
+    return f"{urlparse(url).path}#{size}"
+
+
+def load_partial(sidecar: Path, identity: str):
+    """读取未完成下载的记录，返回分段列表；记录不存在、已损坏或对应的是另一个文件时返回None"""
+    try:
+        with open(sidecar, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable partial download record {sidecar}: {e}")
+        return None
+    if state.get("identity") != identity:
+        return None
+    return state.get("segments")
+
+
+def save_partial(sidecar: Path, identity: str, segments: list):
+    """保存已下载的分段进度（先写临时文件再替换）"""
+    temp_path = Path(f"{sidecar}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"identity": identity, "segments": segments}, f, separators=(",", ":"))
+    os.replace(temp_path, sidecar)
+
+
+class Progress:
+    """一次下载中所有视频流的字节进度，供看门狗和进度输出使用"""
+
+    def __init__(self):
+        self.done = 0
+        self.total = 0
+        # 续传时已有的字节数，计算速度时不计入
+        self.resumed = 0
+        self.updated = time.monotonic()
+
+    def add(self, size: int):
+        self.done += size
+        self.updated = time.monotonic()
+
+
+class DashDownloader:
+    """进程内的异步 DASH 下载器：解析 playurl，通过共享的 HTTP 连接池并发下载视频流和音频流，再用 ffmpeg 合并。
+
+    resolver(bvid, cid) 返回 playurl 接口的数据，默认通过 bilibili_api 获取；测试时可以换成本地的替身服务。
+    """
+
+    def __init__(self, sessdata: str = "", resolver=None, connections: int = 16,
+                 chunk_size: int = 256 * 1024, ffmpeg: str = "ffmpeg", headers: dict = None,
+                 segment_size: int = 8 * _MIB, segment_connections: int = 4, segment_retries: int = 5,
+                 bandwidth=None, meter=None):
+        self.sessdata = sessdata
+        self.resolver = resolver or self._resolve_playurl
+        self.connections = max(1, int(connections))
+        self.chunk_size = chunk_size
+        # 大于 segment_size 的视频流按 Range 分段，每路视频流最多 segment_connections 个连接同时下载
+        self.segment_size = max(self.chunk_size, int(segment_size))
+        self.segment_connections = max(1, int(segment_connections))
+        self.segment_retries = max(1, int(segment_retries))
+        # 续传记录的保存间隔（秒）
+        self.checkpoint_interval = 2.0
+        # bandwidth: 所有下载共用的带宽限速器（rate_limit.TokenBucket，按字节计）；meter: 实际速度统计（rate_limit.ThroughputMeter）
+        self.bandwidth = bandwidth
+        self.meter = meter
+        self.ffmpeg = ffmpeg
+        self.headers = dict(DEFAULT_HEADERS, **(headers or {}))
+        self._session = None
+
+    async def _resolve_playurl(self, bvid: str, cid: int) -> dict:
+        from bilibili_api import video, Credential
+        v = video.Video(bvid=bvid, credential=Credential(sessdata=self.sessdata))
+        return await v.get_download_url(cid=cid)
+
+    def session(self) -> aiohttp.ClientSession:
+        """所有视频共用的 HTTP 会话（连接池），首次使用时创建"""
+        if self._session is None or self._session.closed:
+            cookies = {"SESSDATA": self.sessdata} if self.sessdata else None
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                cookies=cookies,
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=30),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def probe(self, urls: list) -> tuple:
+        """请求视频流的第一个字节，返回 (可用的地址, 总大小, 是否支持 Range)，主地址失败时依次尝试备用地址"""
+        last_error = None
+        for url in urls:
+            try:
+                async with self.session().get(url, headers={"Range": "bytes=0-0"}) as response:
+                    response.raise_for_status()
+                    content_range = response.headers.get("Content-Range", "")
+                    if response.status == 206 and "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+                        return url, int(content_range.rsplit("/", 1)[1]), True
+                    return url, response.content_length or 0, False
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+        raise last_error
+
+    async def fetch(self, urls: list, path: Path, progress: Progress):
+        """下载单个视频流到 path：支持 Range 时分段下载（可续传），否则单连接下载"""
+        url, size, ranged = await self.probe(urls)
+        if ranged and size > 0:
+            # 探测成功的地址排在最前面，分段重试时再轮换其他地址
+            urls = [url] + [u for u in urls if u != url]
+            return await self.fetch_ranged(urls, size, path, progress)
+        await self.fetch_single(urls, path, progress)
+
+    async def fetch_ranged(self, urls: list, size: int, path: Path, progress: Progress):
+        """将视频流按 segment_size 分段，多个连接并发下载，按偏移写入预先分配好大小的文件。
+
+        各分段的进度保存在 path 旁的 .json 记录中，下载中断（失败、卡住、取消或进程退出）后，
+        下次下载同一个视频流时从记录的位置继续。下载完成后记录保留到合并成功为止，合并失败重试时无需重新下载。
+        """
+        sidecar = Path(f"{path}.json")
+        identity = stream_identity(urls[0], size)
+        segments = None
+        if path.exists() and path.stat().st_size == size:
+            segments = load_partial(sidecar, identity)
+        if segments is None:
+            segments = [[start, min(start + self.segment_size, size) - 1, 0]
+                        for start in range(0, size, self.segment_size)]
+            with open(path, "wb") as f:
+                f.truncate(size)
+        else:
+            resumed = sum(segment[2] for segment in segments)
+            progress.done += resumed
+            progress.resumed += resumed
+            print(f"Resuming {path.name} from {resumed / _MIB:.2f} MiB / {size / _MIB:.2f} MiB")
+        progress.total += size
+
+        semaphore = asyncio.Semaphore(self.segment_connections)
+        with open(path, "r+b") as f:
+            def checkpoint():
+                # 先把数据写入文件，再记录进度，记录中的字节一定已经在文件里
+                f.flush()
+                save_partial(sidecar, identity, segments)
+
+            tasks = [asyncio.ensure_future(self.fetch_segment(urls, segment, f, progress, semaphore))
+                     for segment in segments if segment[0] + segment[2] <= segment[1]]
+            checkpoint()
+            try:
+                pending = set(tasks)
+                while pending:
+                    done, pending = await asyncio.wait(pending, timeout=self.checkpoint_interval)
+                    for task in done:
+                        task.result()
+                    checkpoint()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                checkpoint()
+
+    async def fetch_segment(self, urls: list, segment: list, f, progress: Progress, semaphore: asyncio.Semaphore):
+        """下载一个分段 [起始偏移, 结束偏移, 已下载字节数]；失败时从已下载的位置继续，并轮换备用地址"""
+        start, end = segment[0], segment[1]
+        async with semaphore:
+            for attempt in range(1, self.segment_retries + 1):
+                url = urls[(attempt - 1) % len(urls)]
+                try:
+                    async with self.session().get(url, headers={"Range": f"bytes={start + segment[2]}-{end}"}) as response:
+                        response.raise_for_status()
+                        if response.status != 206:
+                            raise aiohttp.ClientPayloadError(f"Range request ignored by {url}")
+                        async for chunk in response.content.iter_chunked(self.chunk_size):
+                            chunk = chunk[:end + 1 - start - segment[2]]
+                            # 写入之间没有 await，各分段共用同一个文件对象不会交错
+                            f.seek(start + segment[2])
+                            f.write(chunk)
+                            segment[2] += len(chunk)
+                            progress.add(len(chunk))
+                            await self._account(len(chunk))
+                    if start + segment[2] > end:
+                        return
+                    raise aiohttp.ClientPayloadError(f"Segment {start}-{end} ended early at {start + segment[2]}")
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if attempt == self.segment_retries:
+                        raise
+                    print(f"Segment {start}-{end} failed ({e}), retry {attempt}/{self.segment_retries - 1}")
+                    await asyncio.sleep(min(8, 2 ** (attempt - 1)))
+
+    async def fetch_single(self, urls: list, path: Path, progress: Progress):
+        """单连接下载视频流到 path，主地址失败时依次尝试备用地址"""
+        last_error = None
+        for url in urls:
+            written = length = 0
+            try:
+                async with self.session().get(url) as response:
+                    response.raise_for_status()
+                    length = response.content_length or 0
+                    progress.total += length
+                    with open(path, "wb") as f:
+                        async for chunk in response.content.iter_chunked(self.chunk_size):
+                            f.write(chunk)
+                            written += len(chunk)
+                            progress.add(len(chunk))
+                            await self._account(len(chunk))
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+            # 换下一个地址时从头下载，撤回本次的进度
+            progress.done -= written
+            progress.total -= length
+        raise last_error
+
+    async def _account(self, size: int):
+        """统计实际速度，并按带宽上限等待"""
+        if self.meter is not None:
+            self.meter.add(size)
+        if self.bandwidth is not None:
+            await self.bandwidth.acquire(size)
+
+    async def mux(self, video_path: Path, audio_path: Path, output_path: Path):
+        """用 ffmpeg 将视频流和音频流合并为 mp4（不重新编码）"""
+        command = [self.ffmpeg, "-y", "-loglevel", "error", "-i", str(video_path)]
+        if audio_path is not None:
+            command += ["-i", str(audio_path)]
+        command += ["-c", "copy", str(output_path)]
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+        )
+        output, _ = await process.communicate()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(
+                process.returncode, command,
+                output=f"ffmpeg exited with code {process.returncode}: " + output.decode("utf-8", errors="replace")
+            )
+
+    async def download_part(self, bvid: str, cid: int, quality: int, output_path,
+                            on_output=None, stall_timeout: float = None) -> str:
+        """下载一个分P并合并为 output_path，返回文件路径
+
+        视频流和音频流同时下载，临时文件为 output_path 旁的 .m4s 文件，下载失败时保留，下次从中断处继续；
+        连续 stall_timeout 秒没有收到数据时抛出 StreamStalled。
+        """
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        playurl = await self.resolver(bvid, cid)
+        video_urls, audio_urls = select_streams(playurl, int(quality))
+
+        stem = output_path.with_suffix("")
+        video_path = Path(f"{stem}-video.m4s")
+        audio_path = Path(f"{stem}-audio.m4s") if audio_urls else None
+        progress = Progress()
+        fetches = [asyncio.ensure_future(self.fetch(video_urls, video_path, progress))]
+        if audio_path is not None:
+            fetches.append(asyncio.ensure_future(self.fetch(audio_urls, audio_path, progress)))
+        try:
+            await self._watch(fetches, progress, on_output, stall_timeout)
+        finally:
+            for task in fetches:
+                task.cancel()
+            # 等待各视频流保存好续传记录
+            await asyncio.gather(*fetches, return_exceptions=True)
+        await self.mux(video_path, audio_path, output_path)
+        for path in (video_path, audio_path):
+            if path is not None:
+                path.unlink(missing_ok=True)
+                Path(f"{path}.json").unlink(missing_ok=True)
+        if on_output:
+            on_output(f"INFO 合并完成 {output_path}", "stdout")
+        return str(output_path)
+
+    async def _watch(self, fetches: list, progress: Progress, on_output, stall_timeout: float):
+        """等待所有视频流下载完成，每秒输出一次进度，并检查是否卡住"""
+        started = time.monotonic()
+        pending = set(fetches)
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=1.0)
+            for task in done:
+                # 任何一路失败都立即结束本次下载
+                task.result()
+            if on_output:
+                elapsed = max(time.monotonic() - started, 1e-6)
+                on_output(
+                    f"{progress.done / _MIB:.2f} MiB/ {progress.total / _MIB:.2f} MiB "
+                    f"{(progress.done - progress.resumed) / elapsed / _MIB:.2f} MiB/s",
+                    "stdout",
+                )
+            if stall_timeout and time.monotonic() - progress.updated > stall_timeout:
+                raise StreamStalled(f"no data received for {stall_timeout:.0f}s")
+
+    async def download_cover(self, url: str, path):
+        """下载封面图片，失败时忽略"""
+        if not url:
+            return
+        try:
+            async with self.session().get(url) as response:
+                response.raise_for_status()
+                Path(path).write_bytes(await response.read())
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            print(f"Error downloading cover {url}: {e}")
+
+
+# 每个事件循环各用一个下载器：aiohttp 会话不能跨事件循环使用，而各个 webui 在不同线程中运行各自的事件循环
+_downloaders = weakref.WeakKeyDictionary()
+
+
+def get_downloader(sessdata: str = "", **options) -> DashDownloader:
+    """返回当前事件循环共用的下载器，同一事件循环中的所有下载共用一个连接池"""
+    loop = asyncio.get_running_loop()
+    downloader = _downloaders.get(loop)
+    if downloader is None or downloader.sessdata != sessdata:
+        if downloader is not None:
+            asyncio.ensure_future(downloader.close())
+        downloader = DashDownloader(sessdata=sessdata, **options)
+        _downloaders[loop] = downloader
+    return downloader
+
+
+async def close_downloader():
+    """关闭当前事件循环的下载器及其连接池，在一批下载结束时调用"""
+    downloader = _downloaders.pop(asyncio.get_running_loop(), None)
+    if downloader is not None:
+        await downloader.close()
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import shutil
+import time
+
+
+# 各画质视频流的大致码率（bit/s），用于在下载前估算文件大小；取偏高的值，宁可多预留空间
+QUALITY_BITRATES = {
+    127: 40_000_000,  # 8K
+    126: 25_000_000,  # 杜比视界
+    125: 25_000_000,  # HDR
+    120: 20_000_000,  # 4K
+    116: 8_000_000,   # 1080P 60帧
+    112: 6_000_000,   # 1080P 高码率
+    100: 6_000_000,   # 智能修复
+    80: 4_000_000,    # 1080P
+    74: 3_000_000,    # 720P 60帧
+    64: 2_000_000,    # 720P
+    32: 1_000_000,    # 480P
+    16: 600_000,      # 360P
+}
+AUDIO_BITRATE = 320_000
+_GIB = 1024 ** 3
+
+
+def estimate_size(duration: float, quality) -> int:
+    """按时长（秒）和画质估算视频大小（字节），视频最高只有较低画质时实际会更小"""
+    try:
+        quality = int(quality)
+    except (TypeError, ValueError):
+        quality = 127
+    bitrate = QUALITY_BITRATES.get(quality)
+    if bitrate is None:
+        # 未知画质按不超过它的最高画质估算
+        lower = [q for q in QUALITY_BITRATES if q <= quality]
+        bitrate = QUALITY_BITRATES[max(lower)] if lower else max(QUALITY_BITRATES.values())
+    return int(max(0.0, float(duration or 0)) * (bitrate + AUDIO_BITRATE) / 8)
+
+
+def format_size(size: float) -> str:
+    if abs(size) >= _GIB:
+        return f"{size / _GIB:.1f} GiB"
+    return f"{size / 1024 / 1024:.0f} MiB"
+
+
+class DiskSpaceGuard:
+    """磁盘空间准入控制：下载开始前按估算大小预留空间。
+
+    同一磁盘上已预留的空间从剩余空间中扣除，剩余空间减去预留后会低于 min_free 时暂停，
+    每 check_interval 秒重新检查一次，空间足够后继续（正在进行的下载完成后预留会释放）。
+    估算大小偏高，该磁盘上没有其他预留且剩余空间仍高于 min_free 时直接放行，预留量以剩余空间为上限，
+    一个超出估算的长视频不会让队列一直等待。
+    """
+
+    def __init__(self, min_free: int = 5 * _GIB, check_interval: float = 30.0):
+        self.min_free = max(0, int(min_free))
+        self.check_interval = check_interval
+        # 每个磁盘（st_dev）已预留的字节数
+        self._reserved = {}
+        # 暂停中的磁盘及开始暂停的时间
+        self._paused = {}
+
+    @staticmethod
+    def _device(path: str) -> int:
+        return os.stat(path).st_dev
+
+    def free(self, path: str) -> int:
+        """磁盘剩余空间减去已预留的空间"""
+        return shutil.disk_usage(path).free - self._reserved.get(self._device(path), 0)
+
+    def low_space(self, path: str) -> bool:
+        """剩余空间是否已低于水位线"""
+        return self.free(path) < self.min_free
+
+    async def admit(self, path: str, size: int, label: str = "") -> tuple:
+        """等待磁盘空间足够后预留 size 字节，返回预留凭据，下载结束后交给 release()"""
+        device = self._device(path)
+        while True:
+            available = self.free(path)
+            if available - size >= self.min_free:
+                break
+            if not self._reserved.get(device) and available >= self.min_free:
+                size = available - self.min_free
+                break
+            # 同一磁盘上多个等待的下载只打印一次
+            if device not in self._paused:
+                self._paused[device] = time.monotonic()
+                print(f"Disk space low at {path}: {format_size(available)} free after reservations, "
+                      f"{label or 'next download'} needs about {format_size(size)} plus {format_size(self.min_free)} reserve; "
+                      f"pausing new downloads, checking again every {self.check_interval:.0f}s")
+            await asyncio.sleep(self.check_interval)
+        paused_at = self._paused.pop(device, None)
+        if paused_at is not None:
+            print(f"Disk space available again at {path} after {time.monotonic() - paused_at:.0f}s, resuming downloads")
+        self._reserved[device] = self._reserved.get(device, 0) + size
+        return device, size
+
+    def release(self, reservation: tuple):
+        device, size = reservation
+        self._reserved[device] = max(0, self._reserved.get(device, 0) - size)
+
+    def paused(self) -> bool:
+        return bool(self._paused)
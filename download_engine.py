@@ -0,0 +1,1670 @@
+import asyncio
+import ast
+import subprocess
+import os
+import errno
+import random
+import re
+import signal
+import sys
+import time
+from bilibili_api import user
+import toml
+from html import unescape
+from pathlib import Path
+from collections import OrderedDict, deque
+from state_store import StateStore, open_state_store
+from metadata_cache import MetadataCache
+from rate_limit import TokenBucket, BandwidthSchedule, ThroughputMeter
+from autotune import AIMD, ResizableSemaphore
+from disk_space import DiskSpaceGuard, estimate_size
+from events import (
+    EventBus, Notice, UploaderListed, JobQueued, JobStarted, JobBytes, JobLog, JobMerged, JobFailed, RunFinished
+)
+
+
+
+def truncate_long_values(d, max_length=500):
+    """
+    递归遍历字典，若某个非字典元素的字符串长度超过 max_length，则去掉该元素。
+    参数:
+        d (dict): 输入字典
+        max_length (int): 字符串最大长度限制，默认为50
+    返回:
+        dict: 处理后的字典
+    """
+    result = {}
+    for key, value in d.items():
+        if isinstance(value, dict):
+            # 如果值是字典，递归调用
+            result[key] = truncate_long_values(value, max_length)
+        else:
+            # 如果值不是字典，转成字符串检查长度
+            str_value = str(value)
+            if len(str_value) <= max_length or key=="title" or key=="duration" or key=="pages":
+                result[key] = value  # 长度不超过限制，保留原值
+            # 超过长度则跳过，不加入结果
+    return result
+
+
+def extract_and_convert_time(input_str):
+    # 提取字符串中的所有数字
+    num_str = ''.join(char for char in input_str if char.isdigit())
+    # 转换为整数（秒数）
+    try:
+        seconds = int(num_str)
+    except ValueError:
+        return "输入无效，无法提取数字"
+    # 计算时间单位
+    days = seconds // (24 * 3600)
+    remaining_seconds = seconds % (24 * 3600)
+    hours = remaining_seconds // 3600
+    remaining_seconds %= 3600
+    minutes = remaining_seconds // 60
+    secs = remaining_seconds % 60
+    # 构建结果字符串
+    result = ""
+    if days > 0:
+        result += f"{days}d"
+    if hours > 0 or days > 0:  # 即使hours为0，如果有天数也要显示
+        result += f"{hours}h"
+    if minutes > 0 or hours > 0 or days > 0:  # 即使minutes为0，如果有小时或天数也要显示
+        result += f"{minutes}m"
+    result += f"{secs}s"
+    return result
+
+def read_toml_config(file_path: str = os.path.join(os.getcwd(), "config.toml")) -> dict:
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            config_data = toml.load(f)
+        return config_data
+    except FileNotFoundError:
+        print(f"Error: Config file not found at {file_path}")
+        raise
+    except toml.TomlDecodeError as e:
+        print(f"Error: Invalid TOML format in {file_path}: {e}")
+        raise
+    except Exception as e:
+        print(f"Unexpected error reading {file_path}: {e}")
+        raise
+
+# async def get_video_info(bvid: str, SESSDATA: str, BILI_JCT: str, BUVID3: str) -> dict:
+#     from bilibili_api import video, Credential
+#     #credential = Credential(sessdata=SESSDATA, bili_jct=BILI_JCT, buvid3=BUVID3)
+#     credential = Credential(sessdata='', bili_jct='', buvid3='')
+#     v = video.Video(bvid=bvid, credential=credential)
+#     info = await v.get_info()
+#     return info
+
+DEFAULT_INFO_CACHE_PATH = Path(__file__).parent / "video_info_cache.json"
+_info_cache = None
+
+
+def configure_info_cache(config: dict = None) -> MetadataCache:
+    """根据配置（config.toml 的 [basic]）创建视频详情缓存，CLI 和各个 webui 共用同一个缓存文件
+
+    info_cache_path: 缓存文件路径；info_cache_ttl: 有效期（秒）；info_cache_size: 最多缓存的视频数
+    """
+    global _info_cache
+    config = config or {}
+    path = Path(os.path.expanduser(str(config.get("info_cache_path") or DEFAULT_INFO_CACHE_PATH)))
+    ttl = float(config.get("info_cache_ttl") or 7 * 24 * 3600)
+    max_entries = int(config.get("info_cache_size") or 50000)
+    cache = _info_cache
+    if cache is not None and cache.path == path and cache.ttl == ttl and cache.max_entries == max_entries:
+        return cache
+    if cache is not None:
+        cache.flush()
+    _info_cache = MetadataCache(path, ttl=ttl, max_entries=max_entries)
+    return _info_cache
+
+
+def get_info_cache() -> MetadataCache:
+    return _info_cache if _info_cache is not None else configure_info_cache()
+
+
+# 进程内共享的限速器：api_limiter 用于所有 B站 API 请求，cdn_limiter 用于启动 yutto 下载（视频流来自 CDN）
+api_limiter = TokenBucket(rate=4, burst=8, name="api")
+cdn_limiter = TokenBucket(rate=1, burst=2, name="cdn")
+
+
+def configure_rate_limits(config: dict = None):
+    """根据配置设置限速：api_rate/api_burst 为每秒 API 请求数及突发上限，cdn_rate/cdn_burst 为每秒启动的下载数及突发上限，速率为0表示不限速"""
+    config = config or {}
+    for limiter, prefix in ((api_limiter, "api"), (cdn_limiter, "cdn")):
+        rate = config.get(f"{prefix}_rate")
+        burst = config.get(f"{prefix}_burst")
+        if rate is not None and rate != "":
+            limiter.set_rate(float(rate), float(burst) if burst not in (None, "") else None)
+        elif burst is not None and burst != "":
+            limiter.set_rate(limiter.rate, float(burst))
+
+
+# 下载后端："yutto" 为每个视频启动一个 yutto 进程，"native" 为进程内的异步 DASH 下载器（dash_downloader.py）
+DOWNLOAD_BACKENDS = ("yutto", "native")
+download_backend = "yutto"
+# native 后端的选项，传给 dash_downloader.DashDownloader
+native_options = {"connections": 16, "segment_size": 8 * 1024 * 1024, "segment_connections": 4}
+
+
+def configure_download_backend(config: dict = None):
+    """根据配置选择下载后端：backend 为 yutto 或 native。
+
+    native 后端的选项：native_connections 为 HTTP 连接池大小，
+    segment_size 为分段下载的分段大小（MiB），segment_connections 为每路视频流同时下载的分段数（1 表示不分段）。
+    """
+    global download_backend
+    config = config or {}
+    backend = config.get("backend")
+    if backend:
+        if backend not in DOWNLOAD_BACKENDS:
+            raise ValueError(f"Unknown download backend {backend!r}, expected one of {', '.join(DOWNLOAD_BACKENDS)}")
+        download_backend = backend
+    if config.get("native_connections"):
+        native_options["connections"] = max(1, int(config["native_connections"]))
+    if config.get("segment_size"):
+        native_options["segment_size"] = max(1, int(float(config["segment_size"]) * 1024 * 1024))
+    if config.get("segment_connections"):
+        native_options["segment_connections"] = max(1, int(config["segment_connections"]))
+
+
+# 所有下载共用的带宽上限（按字节计，0 表示不限速）和实际下载速度统计
+bandwidth_limiter = TokenBucket(rate=0, burst=1, name="bandwidth", unit="MiB", scale=1024 * 1024)
+throughput = ThroughputMeter()
+
+
+def configure_bandwidth(config: dict = None):
+    """根据配置设置带宽上限：bandwidth_limit 为默认上限（MiB/s，0 表示不限速），
+    bandwidth_schedule 为按时间段的上限，如 [{start = "09:00", end = "19:00", limit = 2}]。
+    上限每秒按当前时间重新计算，正在进行的下载无需重启即可生效。
+    只有 native 后端按上限限速，yutto 后端只统计速度，设置了上限时打印警告。
+    """
+    config = config or {}
+    if "bandwidth_limit" not in config and "bandwidth_schedule" not in config:
+        return
+    bandwidth_limiter.set_schedule(
+        BandwidthSchedule.from_config(config.get("bandwidth_limit") or 0, config.get("bandwidth_schedule") or ())
+    )
+    if download_backend != "native" and (config.get("bandwidth_limit") or config.get("bandwidth_schedule")):
+        print(f"Warning: bandwidth_limit / bandwidth_schedule only apply to the native backend, "
+              f"downloads with the {download_backend} backend are not throttled (set backend = \"native\" to enable them)")
+
+
+def meter_output(on_output=None):
+    """包装 on_output：从 yutto 的进度行中统计实际下载的字节数"""
+    last = [0]
+
+    def handle(line: str, stream_name: str):
+        downloaded = parse_progress_bytes(line)
+        if downloaded is not None:
+            # yutto 下载下一个文件时进度从0重新开始
+            if downloaded > last[0]:
+                throughput.add(downloaded - last[0])
+            last[0] = downloaded
+        if on_output:
+            on_output(line, stream_name)
+    return handle
+
+
+def throughput_text() -> str:
+    """当前所有下载的实际总速度，限速时附带上限，例如 1.95 MiB/s (limit 2.00 MiB/s)"""
+    rate = throughput.rate()
+    text = f"{rate / 1024 / 1024:.2f} MiB/s" if rate >= 1024 * 1024 else f"{rate / 1024:.2f} KiB/s"
+    if bandwidth_limiter.rate > 0:
+        text += f" (limit {bandwidth_limiter.format_rate(bandwidth_limiter.rate)})"
+    return text
+
+
+def configure_runtime(config: dict = None):
+    """应用 config.toml [basic] 中的进程级设置（视频详情缓存、限速、下载后端、带宽），CLI 和各个 webui 启动下载前调用"""
+    configure_info_cache(config)
+    configure_rate_limits(config)
+    configure_download_backend(config)
+    configure_bandwidth(config)
+
+
+# API 请求返回风控（412 等）的次数，供自动调节参考
+api_rate_limited_errors = 0
+
+
+def note_api_error(error: BaseException):
+    """记录一次失败的 API 请求，风控类错误计入 api_rate_limited_errors"""
+    global api_rate_limited_errors
+    if classify_error(error) == ERROR_RATE_LIMITED:
+        api_rate_limited_errors += 1
+
+
+def rate_limit_report() -> str:
+    lines = [limiter.report() for limiter in (api_limiter, cdn_limiter)]
+    lines.append(f"[bandwidth] {bandwidth_limiter.format_rate(bandwidth_limiter.rate)}, "
+                 f"{throughput.total / 1024 / 1024:.1f} MiB downloaded, total wait {bandwidth_limiter.total_wait:.1f}s")
+    return "\n".join(lines)
+
+
+async def get_video_info(bvid: str, SESSDATA: str, BILI_JCT: str, BUVID3: str) -> dict:
+    from bilibili_api import video, Credential
+    import asyncio
+    
+    cache = get_info_cache()
+    cached = cache.get(bvid)
+    if cached is not None:
+        return cached
+
+    #credential = Credential(sessdata=SESSDATA, bili_jct=BILI_JCT, buvid3=BUVID3)
+    credential = Credential(sessdata='', bili_jct='', buvid3='')
+    v = video.Video(bvid=bvid, credential=credential)
+    
+    for attempt in range(5):  # 尝试5次
+        try:
+            await api_limiter.acquire()
+            info = truncate_long_values(await v.get_info())
+            if cache.put(bvid, info):
+                await asyncio.to_thread(cache.flush)
+            return info
+        except Exception as e:
+            note_api_error(e)
+            error_msg = str(e)
+            # 如果错误信息包含“稿件不可见”，立即返回带默认值的字典
+            if "稿件不可见" in error_msg:
+                return {"title": "稿件不可见", "duration": 0, "pages": []}
+            # 如果不是最后一次尝试，等待1秒后重试
+            if attempt < 4:
+                await asyncio.sleep(1)  # 等待1秒
+                continue
+            # 如果是最后一次尝试仍然失败，返回带默认值的字典
+            return {"title": "get_video_info失败", "duration": 0, "pages": []}
+
+
+async def get_user_name(uid: int) -> str:
+    u = user.User(uid)
+    await api_limiter.acquire()
+    user_info = await u.get_user_info()
+    return user_info["name"]
+
+_FILENAME_ILLEGAL = re.compile(r'[\\/:*?"<>|]')
+_FILENAME_SPACES = re.compile(r"\s+")
+_FILENAME_NON_PRINTABLE = re.compile(r"[\x00-\x1f\x7f]")
+
+
+def repair_filename(name: str) -> str:
+    """与 yutto 相同的文件名清理：路径中不允许的字符转为全角，空白合并为一个空格，去掉不可打印字符"""
+    name = unescape(str(name))
+    name = _FILENAME_ILLEGAL.sub(lambda m: chr(ord(m.group(0)) + ord("？") - ord("?")), name)
+    name = _FILENAME_SPACES.sub(" ", name)
+    name = _FILENAME_NON_PRINTABLE.sub("", name).strip()
+    return name or "未命名文件"
+
+
+def part_records(output_dir: str, video_info: dict) -> list:
+    """根据视频详情生成每个分P的记录（page, cid, part, file_path, downloaded）
+
+    单P视频保存为 <output_dir>/<标题>.mp4，多P视频保存为 <output_dir>/<标题>/<分P名称>.mp4（与 yutto -b 一致），
+    标题和分P名称按 repair_filename 清理。
+    """
+    title = repair_filename(video_info['title'])
+    pages = video_info['pages']
+    records = []
+    for number, page in enumerate(pages, 1):
+        if len(pages) == 1:
+            file_path = os.path.join(output_dir, f"{title}.mp4")
+        else:
+            file_path = os.path.join(output_dir, title, f"{repair_filename(page.get('part', ''))}.mp4")
+        records.append({
+            'page': int(page.get('page') or number),
+            'cid': page.get('cid', ''),
+            'part': page.get('part', ''),
+            'file_path': file_path,
+            'downloaded': 'False',
+        })
+    return records
+
+
+def get_file_names(output_dir: str, video_info: dict, parts: list = None) -> list:
+    """获取视频文件名；parts 为状态库中的分P记录时以记录为准"""
+    if parts is None:
+        parts = part_records(output_dir, video_info)
+    return [part['file_path'] for part in parts]
+
+def parse_length(length: str) -> int:
+    """将视频列表中的时长（如 "12:34" 或 "1:02:03"）转换为秒数"""
+    seconds = 0
+    for part in str(length).split(":"):
+        if not part.strip().isdigit():
+            return 0
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def video_row_from_list_item(video_item: dict) -> dict:
+    """根据视频列表接口返回的条目生成状态记录，保留列表中已有的标题、时长、发布时间、封面和aid"""
+    return {
+        'url': f"https://www.bilibili.com/video/{video_item['bvid']}",
+        'title': video_item.get('title', ''),
+        'duration': extract_and_convert_time(str(parse_length(video_item['length']))) if video_item.get('length') else '',
+        'downloaded': 'False',
+        'file_path': '',
+        'aid': video_item.get('aid', ''),
+        'created': video_item.get('created', ''),
+        'cover': video_item.get('pic', ''),
+    }
+
+
+def stored_video_info(video: dict):
+    """读取上一次运行保存的视频详情，没有或已失效时返回None"""
+    if not video.get('info'):
+        return None
+    try:
+        video_info = ast.literal_eval(video['info'])
+    except (ValueError, SyntaxError):
+        return None
+    if not isinstance(video_info, dict) or not video_info.get('pages'):
+        return None
+    return video_info
+
+
+class VideoListIncomplete(Exception):
+    """重试后仍有视频列表页获取失败，不能把不完整的列表当作完整列表保存"""
+
+
+async def fetch_video_page(u: user.User, page: int, max_attempts: int = 3) -> dict:
+    """获取视频列表的某一页，失败时重试，max_attempts 次都失败时抛出最后一次的异常"""
+    for attempt in range(max_attempts):
+        try:
+            await api_limiter.acquire()
+            return await u.get_videos(pn=page)
+        except Exception as e:
+            note_api_error(e)
+            if attempt < max_attempts - 1:
+                await asyncio.sleep(1)
+                continue
+            print(f"Error fetching video list page {page}: {e}")
+            raise
+
+
+async def fetch_video_list(uid: int, concurrency: int = 4) -> list:
+    """获取用户的全部视频列表。
+
+    先请求第一页得到视频总数，再以最多 concurrency 个并发请求获取其余页，
+    结果按页码顺序合并（与B站返回的顺序一致，最新的在前）。
+    任何一页重试后仍获取失败时抛出 VideoListIncomplete，不返回不完整的列表。
+    """
+    u = user.User(uid=uid)
+    first = await fetch_video_page(u, 1)
+    vlists = [first["list"]["vlist"]]
+    count = first.get("page", {}).get("count")
+
+    if count is None:
+        # 接口未返回总数时退回逐页获取，直到空页为止
+        page = 2
+        while vlists[-1]:
+            res = await fetch_video_page(u, page)
+            vlists.append(res["list"]["vlist"])
+            page += 1
+    else:
+        page_size = first["page"].get("ps") or len(vlists[0]) or 1
+        total_pages = (count + page_size - 1) // page_size
+    
+    if count is not None and total_pages > 1:
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def fetch(page: int) -> list:
+            async with semaphore:
+                res = await fetch_video_page(u, page)
+                return res["list"]["vlist"] or []
+
+        pages = range(2, total_pages + 1)
+        results = await asyncio.gather(*(fetch(page) for page in pages), return_exceptions=True)
+        failed = [(page, result) for page, result in zip(pages, results) if isinstance(result, BaseException)]
+        if failed:
+            raise VideoListIncomplete(
+                f"Failed to fetch {len(failed)}/{total_pages} video list page(s) for UID {uid} "
+                f"(pages {', '.join(str(page) for page, _ in failed)}): {failed[0][1]}"
+            ) from failed[0][1]
+        vlists += results
+
+    video_urls = []
+    seen = set()
+    for vlist in vlists:
+        for video_item in vlist or []:
+            # 翻页期间UP主发布新视频会导致相邻两页出现重复条目
+            if video_item['bvid'] in seen:
+                continue
+            seen.add(video_item['bvid'])
+            video_urls.append(video_row_from_list_item(video_item))
+    return video_urls
+
+
+async def fetch_new_videos(uid: int, known_bvids: set) -> list:
+    """增量获取用户的新视频。
+
+    视频列表按发布时间从新到旧返回，逐页获取，某一页出现任何已知视频时停止翻页，
+    日常同步通常只需要一到两次请求。有页面获取失败时抛出异常，known_bvids 保持不变，下次同步会重新获取。
+    """
+    u = user.User(uid=uid)
+    page = 1
+    new_video_urls = []
+    seen = set()
+    while True:
+        res = await fetch_video_page(u, page)
+        vlist = res["list"]["vlist"]
+        if not vlist:
+            break
+        new_items = [v for v in vlist if v['bvid'] not in known_bvids]
+        for video_item in new_items:
+            if video_item['bvid'] in seen:
+                continue
+            seen.add(video_item['bvid'])
+            new_video_urls.append(video_row_from_list_item(video_item))
+        if len(new_items) < len(vlist):
+            # 本页已出现已知视频，更早的视频都已在列表中
+            break
+        page += 1
+    known_bvids.update(seen)
+    print(f"Incremental sync checked {page} page(s) for UID {uid}")
+    return new_video_urls
+
+
+async def get_user_video_urls(uid: int, output_dir: str, updatefile: bool = False, list_concurrency: int = 4, sync: bool = False, store: StateStore = None) -> list:
+    """获取指定用户的所有视频URL，并保存到状态数据库
+
+    sync 为 True 时不再询问用户，直接增量同步新发布的视频。
+    """
+    own_store = store is None
+    if own_store:
+        store = open_state_store(output_dir)
+    try:
+        return await _get_user_video_urls(uid, store, updatefile, list_concurrency, sync)
+    finally:
+        if own_store:
+            store.close()
+
+
+async def _get_user_video_urls(uid: int, store: StateStore, updatefile: bool, list_concurrency: int, sync: bool) -> list:
+    video_urls = store.load()
+
+    if video_urls:
+        print(f"Reading video URLs from {store.db_path}")
+
+        if sync:
+            known_bvids = {v['url'].split("/")[-1] for v in video_urls}
+            new_videos = await fetch_new_videos(uid, known_bvids)
+            if new_videos:
+                video_urls.extend(new_videos)
+                print(f"Found {len(new_videos)} new videos to add to the list.")
+                store.upsert_many(new_videos)
+            else:
+                print("No new videos found.")
+            return video_urls
+
+        # 检查是否所有视频都已下载
+        all_downloaded = all(v['downloaded'] == 'True' for v in video_urls)
+        if all_downloaded and updatefile:
+            # 询问用户是否需要更新
+            update = input("All videos appear to be downloaded. Do you want to check for updates? (y/n): ")
+            if update.lower() == 'y':
+                # 重新抓取视频列表
+                new_video_urls = await fetch_video_list(uid, list_concurrency)
+                
+                # 找出新视频（不在原有列表中的URL）
+                existing_urls = {v['url'] for v in video_urls}
+                new_videos = [v for v in new_video_urls if v['url'] not in existing_urls]
+                
+                if new_videos:
+                    video_urls.extend(new_videos)
+                    print(f"Found {len(new_videos)} new videos to add to the list.")
+                    store.upsert_many(new_videos)
+                else:
+                    print("No new videos found.")
+        
+        return video_urls
+
+    # 如果还没有记录，获取视频列表
+    video_urls = await fetch_video_list(uid, list_concurrency)
+    
+    # 保存初始列表
+    store.upsert_many(video_urls)
+    return video_urls
+
+
+async def _read_lines(stream: asyncio.StreamReader):
+    """逐行读取子进程输出；yutto 的进度条用 \\r 刷新，因此 \\r 也视为换行"""
+    buffer = b""
+    while True:
+        chunk = await stream.read(4096)
+        if not chunk:
+            break
+        buffer += chunk
+        parts = buffer.replace(b"\r", b"\n").split(b"\n")
+        buffer = parts.pop()
+        for part in parts:
+            if part.strip():
+                yield part.decode('utf-8', errors='replace')
+    if buffer.strip():
+        yield buffer.decode('utf-8', errors='replace')
+
+
+async def wait_all(tasks: list):
+    """等待 tasks 全部结束并取走它们的异常，等待期间再次被取消也继续等待，结束后再抛出 CancelledError
+
+    用于清理阶段：事件循环关闭时不会留下未结束的任务（例如正在结束子进程树的下载）。
+    """
+    cancelled = False
+    while not all(task.done() for task in tasks):
+        try:
+            await asyncio.wait(tasks)
+        except asyncio.CancelledError:
+            cancelled = True
+    for task in tasks:
+        if not task.cancelled():
+            task.exception()
+    if cancelled:
+        raise asyncio.CancelledError()
+
+
+async def gather_all(*aws):
+    """与 asyncio.gather 相同，但其中一个失败或本任务被取消时，先取消其余任务并等它们全部结束再抛出异常。
+
+    asyncio.gather 在第一个子任务被取消时就返回，不会等待其余子任务。
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await wait_all(tasks)
+
+
+def _kill_process_tree(process: asyncio.subprocess.Process):
+    """结束子进程及其启动的进程（如 yutto 调用的 ffmpeg）"""
+    if process.returncode is not None:
+        return
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+DEFAULT_STALL_TIMEOUT = 180
+
+_SIZE_UNITS = {
+    "B": 1,
+    "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4,
+    "KIB": 1024, "MIB": 1024 ** 2, "GIB": 1024 ** 3, "TIB": 1024 ** 4,
+}
+_PROGRESS_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*([KMGT]?i?B)\s*/\s*(\d+(?:\.\d+)?)\s*([KMGT]?i?B)', re.IGNORECASE)
+_SPEED_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*([KMGT]?i?B)/s', re.IGNORECASE)
+
+
+class DownloadStalled(subprocess.TimeoutExpired):
+    """在 stall_timeout 秒内下载没有任何进展"""
+
+    def __str__(self):
+        return f"No download progress for {self.timeout} seconds"
+
+
+def parse_size(number: str, unit: str) -> int:
+    """将 "18.82", "GiB" 这样的大小转换为字节数"""
+    return int(float(number) * _SIZE_UNITS.get(unit.upper(), 1))
+
+
+def parse_progress(line: str):
+    """从 yutto 进度行（如 "18.82 GiB/ 24.19 GiB 766.48 KiB/s"）中解析 (已下载字节数, 总字节数, 速度)，不是进度行时返回None"""
+    match = _PROGRESS_PATTERN.search(line)
+    if not match:
+        return None
+    speed = _SPEED_PATTERN.search(line, match.end())
+    return (
+        parse_size(match.group(1), match.group(2)),
+        parse_size(match.group(3), match.group(4)),
+        parse_size(speed.group(1), speed.group(2)) if speed else 0,
+    )
+
+
+def parse_progress_bytes(line: str):
+    """从 yutto 进度行中解析已下载字节数，不是进度行时返回None"""
+    progress = parse_progress(line)
+    return progress[0] if progress else None
+
+
+# 下载错误分类，每类错误使用不同的重试策略
+ERROR_TRANSIENT = "transient"        # 网络波动、超时、下载卡住
+ERROR_RATE_LIMITED = "rate_limited"  # 请求过于频繁、HTTP 412 风控
+ERROR_PERMANENT = "permanent"        # 稿件不可见、已删除，重试没有意义
+ERROR_LOCAL = "local"                # 本地磁盘空间不足、ffmpeg 合并失败等
+
+# base/cap: 退避时间的基数和上限（秒），第 n 次失败后等待 base*2^(n-1)（不超过 cap）并加上随机抖动
+RETRY_POLICIES = {
+    ERROR_TRANSIENT: {"max_attempts": 5, "base": 5, "cap": 120},
+    ERROR_RATE_LIMITED: {"max_attempts": 6, "base": 60, "cap": 1800},
+    ERROR_PERMANENT: {"max_attempts": 1, "base": 0, "cap": 0},
+    ERROR_LOCAL: {"max_attempts": 3, "base": 120, "cap": 1800},
+}
+
+# 状态码必须出现在 HTTP / 接口错误的上下文中，并排除小数（如 "412.50 MiB"）和路径（如 /archive/429/）
+_CODE_END = r"(?![\w./])"
+_ERROR_PATTERNS = [
+    (ERROR_LOCAL, re.compile(
+        r"no space left|disk quota|read-only file system|permission denied|磁盘已满|合并失败"
+        r"|ffmpeg[^\n]*(?:error|failed|not found|exited with)|(?:error|failed)[^\n]*ffmpeg"
+    )),
+    (ERROR_PERMANENT, re.compile(
+        r"稿件不可见|啥都木有|视频不见了|已失效|已被删除"
+        rf"|(?<![\w./-])-404{_CODE_END}|(?:错误代码|code)[\"']?\s*[:：=]\s*-404{_CODE_END}"
+    )),
+    (ERROR_RATE_LIMITED, re.compile(
+        r"too many requests|precondition failed|请求过于频繁|风控|请求被拦截"
+        rf"|(?:http(?: error)?|status(?: code)?|状态码)\s*[:：=]?\s*(?:412|429|509){_CODE_END}"
+        rf"|(?:错误代码|code)[\"']?\s*[:：=]\s*-?(?:412|429|509|799){_CODE_END}"
+        rf"|(?<![\w./-])-(?:412|509|799){_CODE_END}"
+    )),
+]
+
+_LOCAL_ERRNOS = tuple(getattr(errno, name) for name in ("ENOSPC", "EDQUOT", "EROFS", "EACCES") if hasattr(errno, name))
+
+
+def classify_error(error: BaseException) -> str:
+    """根据异常及子进程输出判断错误类别
+
+    子进程的错误只检查其输出和返回码，不检查命令行参数（输出目录等路径中可能含有数字）。
+    """
+    if isinstance(error, OSError) and error.errno in _LOCAL_ERRNOS:
+        return ERROR_LOCAL
+    if isinstance(error, (subprocess.CalledProcessError, subprocess.TimeoutExpired)):
+        text = f"{getattr(error, 'output', '') or ''}\n{getattr(error, 'stderr', '') or ''}"
+    else:
+        text = f"{error}\n{getattr(error, 'output', '') or ''}"
+    text = text.lower()
+    for error_class, pattern in _ERROR_PATTERNS:
+        if pattern.search(text):
+            return error_class
+    return ERROR_TRANSIENT
+
+
+def retry_delay(error_class: str, attempt: int) -> float:
+    """第 attempt 次失败后的重试等待时间：指数退避，取一半固定、一半随机，避免多个任务同时重试"""
+    policy = RETRY_POLICIES[error_class]
+    delay = min(policy["cap"], policy["base"] * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def probe_download_bytes(paths: list) -> int:
+    """统计一个视频正在下载的文件大小：给出的输出文件，以及同目录下 yutto 以其文件名命名的
+    .m4s 临时文件（<文件名>_video.m4s 等）；同一目录中其他视频的临时文件不计入"""
+    prefixes = {}
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        prefixes.setdefault(os.path.dirname(path), []).append(stem + "_")
+    total = 0
+    for path in paths:
+        try:
+            if os.path.isfile(path):
+                total += os.path.getsize(path)
+        except OSError:
+            continue
+    for directory, names in prefixes.items():
+        try:
+            with os.scandir(directory or ".") as entries:
+                for entry in entries:
+                    if entry.name.endswith(".m4s") and entry.name.startswith(tuple(names)) and entry.is_file():
+                        total += entry.stat().st_size
+        except OSError:
+            continue
+    return total
+
+
+async def run_command(command: list, timeout: float = None, on_output=None, stall_timeout: float = None, progress_paths: list = None) -> int:
+    """以异步子进程运行命令，不阻塞事件循环。
+
+    stdout/stderr 逐行交给 on_output(line, stream_name)，未提供时直接打印到终端。
+    设置 stall_timeout 时启用看门狗：从输出中解析已下载字节数，并定期检查 progress_paths
+    中文件的大小，连续 stall_timeout 秒都没有进展才结束进程并抛出 DownloadStalled，
+    进展正常的下载不受总时长限制。
+    超时抛出 subprocess.TimeoutExpired，返回码非0抛出 subprocess.CalledProcessError，
+    超时、卡住、出错或任务被取消时都会结束整个子进程树。
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=(os.name == "posix"),
+    )
+    progress = {"time": time.monotonic(), "output_bytes": None, "file_bytes": None}
+    # 保留最后的输出，附在异常上用于判断错误类别
+    output_tail = deque(maxlen=50)
+
+    def mark_progress(key: str, value: int):
+        if value != progress[key]:
+            progress[key] = value
+            progress["time"] = time.monotonic()
+
+    async def pump(stream: asyncio.StreamReader, name: str):
+        async for line in _read_lines(stream):
+            downloaded = parse_progress_bytes(line)
+            if downloaded is not None:
+                mark_progress("output_bytes", downloaded)
+            else:
+                output_tail.append(line)
+            if on_output:
+                on_output(line, name)
+            else:
+                print(line, file=sys.stderr if name == "stderr" else sys.stdout, flush=True)
+
+    async def watchdog():
+        interval = min(5.0, stall_timeout / 4)
+        while True:
+            await asyncio.sleep(interval)
+            if progress_paths:
+                mark_progress("file_bytes", await asyncio.to_thread(probe_download_bytes, progress_paths))
+            if time.monotonic() - progress["time"] >= stall_timeout:
+                return
+
+    main_task = asyncio.ensure_future(
+        gather_all(pump(process.stdout, "stdout"), pump(process.stderr, "stderr"), process.wait())
+    )
+    watchdog_task = asyncio.ensure_future(watchdog()) if stall_timeout else None
+    try:
+        done, _ = await asyncio.wait(
+            [task for task in (main_task, watchdog_task) if task is not None],
+            timeout=timeout,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if main_task in done:
+            main_task.result()
+        elif watchdog_task in done:
+            raise DownloadStalled(command, stall_timeout, output="\n".join(output_tail))
+        else:
+            raise subprocess.TimeoutExpired(command, timeout, output="\n".join(output_tail))
+    finally:
+        if watchdog_task is not None:
+            watchdog_task.cancel()
+        if process.returncode is None:
+            _kill_process_tree(process)
+            await wait_all([asyncio.ensure_future(process.wait())])
+        if not main_task.done():
+            main_task.cancel()
+        # 等读取输出的任务结束，事件循环关闭时不会留下未结束的任务
+        await wait_all([task for task in (main_task, watchdog_task) if task is not None])
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, output="\n".join(output_tail))
+    return process.returncode
+
+
+async def get_playurl(bvid: str, cid: int, sessdata: str = "") -> dict:
+    """获取分P的视频流地址（playurl），与其他 API 请求共用限速"""
+    from bilibili_api import video, Credential
+    await api_limiter.acquire()
+    v = video.Video(bvid=bvid, credential=Credential(sessdata=sessdata))
+    return await v.get_download_url(cid=cid)
+
+
+async def download_video_native(url: str, output_dir: str, quality: str, sessdata: str, video_info: dict, timeout: int = None, on_output=None, stall_timeout: float = DEFAULT_STALL_TIMEOUT, pages: list = None) -> list:
+    """使用进程内的 DASH 下载器下载单个视频并返回文件路径，参数和异常与 download_video 相同
+
+    同一事件循环中的所有下载共用一个 HTTP 连接池；分P依次下载，已存在的分P文件直接跳过。
+    """
+    import dash_downloader
+    if (len(video_info['pages'])==0):
+        return []
+    bvid = url.rstrip("/").split("/")[-1]
+    downloader = dash_downloader.get_downloader(
+        str(sessdata),
+        resolver=lambda bvid, cid: get_playurl(bvid, cid, str(sessdata)),
+        bandwidth=bandwidth_limiter,
+        meter=throughput,
+        **native_options
+    )
+    parts = select_parts(output_dir, video_info, pages)
+    filepaths = get_file_names(output_dir, video_info, parts)
+
+    async def download_pages():
+        for part in parts:
+            filepath = part['file_path']
+            if os.path.exists(filepath):
+                continue
+            await downloader.download_part(bvid, part['cid'], int(quality or 127), filepath, on_output=on_output, stall_timeout=stall_timeout)
+            await downloader.download_cover(video_info.get('pic'), f"{os.path.splitext(filepath)[0]}-poster.jpg")
+
+    await cdn_limiter.acquire()
+    try:
+        await asyncio.wait_for(download_pages(), timeout)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(url, timeout)
+    except dash_downloader.StreamStalled as e:
+        raise DownloadStalled(url, stall_timeout, output=str(e))
+    print(f"Successfully downloaded: {url}")
+    return filepaths
+
+
+async def close_download_backend():
+    """关闭 native 后端在当前事件循环中的连接池，一批下载结束时调用"""
+    if "dash_downloader" in sys.modules:
+        await sys.modules["dash_downloader"].close_downloader()
+
+
+def select_parts(output_dir: str, video_info: dict, pages: list = None) -> list:
+    """选出要下载的分P记录，pages 为分P序号列表，None 表示全部"""
+    parts = part_records(output_dir, video_info)
+    if pages is None:
+        return parts
+    pages = {int(page) for page in pages}
+    return [part for part in parts if part['page'] in pages]
+
+
+async def download_video(url: str, output_dir: str, quality: str, sessdata: str, video_info: dict, timeout: int = None, on_output=None, stall_timeout: float = DEFAULT_STALL_TIMEOUT, pages: list = None) -> list:
+    """使用yutto下载单个视频并返回文件路径（backend 为 native 时改用 download_video_native）
+
+    timeout 为总时长上限（默认不限制）；下载连续 stall_timeout 秒没有进展时才会被结束。
+    pages 为要下载的分P序号列表（默认全部），返回对应分P的文件路径。
+    """
+    if download_backend == "native":
+        return await download_video_native(url, output_dir, quality, sessdata, video_info, timeout=timeout, on_output=on_output, stall_timeout=stall_timeout, pages=pages)
+    if (len(video_info['pages'])==0):
+        return []
+    parts = select_parts(output_dir, video_info, pages)
+    if (len(video_info['pages'])>1):
+        command = [
+            "yutto",
+            "--sessdata", str(sessdata),
+            "-d", str(output_dir),
+            "-q", str(quality),
+            "-b",
+            "-p", "1~-1" if pages is None else ",".join(str(part['page']) for part in parts),
+            "--download-interval", "2",
+            "--save-cover",
+            url
+        ]
+    else:
+        command = [
+            "yutto",
+            "--sessdata", str(sessdata),
+            "-d", str(output_dir),
+            "-q", str(quality),
+            "-p", "1~-1",
+            "--download-interval", "2",
+            "--save-cover",
+            url
+        ]
+    # 看门狗只检查这个视频自己的临时文件和最终文件，同目录中并发下载的其他视频不会掩盖卡住的下载
+    filepaths = get_file_names(output_dir, video_info, parts)
+    await cdn_limiter.acquire()
+    # yutto 不支持限速，这里只统计实际速度；需要带宽上限时请使用 native 后端
+    await run_command(command, timeout=timeout, on_output=meter_output(on_output), stall_timeout=stall_timeout, progress_paths=filepaths)
+    # 假设下载的文件名基于URL的bvid
+    bvid = url.split("/")[-1]
+    # file_path = os.path.join(output_dir, f"{title}.mp4")  # 可能需要根据实际情况调整
+    print(f"Successfully downloaded: {url}")
+    return filepaths
+
+
+
+class FairQueue:
+    """按UP主轮询出队的队列：每个UP主一条子队列，依次从每条子队列各取一个，
+    视频很多的UP主不会让其他UP主一直等待。close() 之后队列取空时 get() 返回None。"""
+
+    def __init__(self):
+        self._queues = OrderedDict()
+        self._closed = False
+        self._changed = asyncio.Event()
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def put(self, key, item):
+        self._queues.setdefault(key, deque()).append(item)
+        self._changed.set()
+
+    def close(self):
+        self._closed = True
+        self._changed.set()
+
+    async def get(self):
+        while True:
+            if self._queues:
+                key, queue = next(iter(self._queues.items()))
+                item = queue.popleft()
+                # 轮到的UP主移到队尾，取空则移除
+                del self._queues[key]
+                if queue:
+                    self._queues[key] = queue
+                return item
+            if self._closed:
+                return None
+            self._changed.clear()
+            await self._changed.wait()
+
+
+async def prepare_uploader(uploader: dict, arg_dict: dict, bus: EventBus = None, interactive: bool = True):
+    """获取UP主名称和视频列表，返回下载任务；uploader 中的 output_dir / video_quality 会覆盖 arg_dict 中的设置"""
+    uid = int(uploader["uid"])
+    up_name = await get_user_name(uid)
+    output_dir = os.path.join(os.path.expanduser(str(uploader.get("output_dir") or arg_dict["output_dir"])), up_name)
+    os.makedirs(output_dir, exist_ok=True)
+
+    if bus:
+        bus.publish(Notice(uid, up_name, f"Fetching video list for UID: {uid} (UP: {up_name})"))
+    print(f"Fetching video list for UID: {uid} (UP: {up_name})")
+
+    store = open_state_store(output_dir)
+    try:
+        video_urls = await get_user_video_urls(
+            uid, output_dir, updatefile=interactive,
+            list_concurrency=max(1, int(arg_dict.get("list_concurrency") or 1)),
+            sync=bool(arg_dict.get("sync")),
+            store=store
+        )
+    except BaseException:
+        # 获取列表失败时不会返回任务，由这里关闭状态库（常驻运行时失败的UP主每次检查都会重试）
+        store.close()
+        raise
+    if bus:
+        bus.publish(UploaderListed(uid, up_name, len(video_urls), output_dir))
+    print(f"[{up_name}] Found {len(video_urls)} videos")
+    return {
+        "uid": uid,
+        "up_name": up_name,
+        "output_dir": output_dir,
+        "quality": str(uploader.get("video_quality") or arg_dict["video_quality"]),
+        "store": store,
+        "video_urls": video_urls,
+    }
+
+
+def finish_uploader(job: dict):
+    """关闭UP主的状态库，并保留一份 CSV，兼容依赖 video_urls.csv 的旧工具"""
+    job["store"].export_csv(Path(job["output_dir"]) / "video_urls.csv")
+    job["store"].close()
+
+
+async def resolve_video(job: dict, video: dict, index: int):
+    """获取单个视频信息并写回状态库，视频已失效时返回None
+
+    标题、时长等已由视频列表提供，这里只在需要分P列表时才请求视频详情；
+    上一次运行已保存过详情的视频（例如下载失败后重试）直接复用，不再请求接口。
+    """
+    total_videos = len(job["video_urls"])
+    video_info = stored_video_info(video)
+    if video_info is not None:
+        return video_info
+
+    url = video['url']
+    bvid = url.split("/")[-1]
+    # video_info = await get_video_info(
+    #     bvid=bvid,
+    #     SESSDATA=arg_dict["SESSDATA"],
+    #     BILI_JCT=arg_dict["BILI_JCT"],
+    #     BUVID3=arg_dict["BUVID3"]
+    # )
+    video_info = await get_video_info(
+        bvid=bvid,
+        SESSDATA="",
+        BILI_JCT="",
+        BUVID3=""
+    )
+    
+    if (len(video_info['pages']) <1):
+        print(f"[{job['up_name']}] Skipping disappeared video {index}/{total_videos}: {video['url']}")
+        return None
+
+    # 更新视频信息
+    video['title'] = video_info['title']
+    # video['duration'] = str(video_info['duration'])
+    video['duration'] = extract_and_convert_time(str(video_info['duration']))
+    video['info'] = str(video_info)
+    job["store"].upsert(video)
+    return video_info
+
+
+def record_video_result(job: dict, video: dict, ok: bool, file_paths: list = None):
+    """把视频的下载结果写入状态库，下载成功时同时追加到下载历史"""
+    video['downloaded'] = str(ok)
+    if ok:
+        video['file_path'] = str(file_paths)
+    job["store"].upsert(video)
+    if ok:
+        job["store"].add_history(video, file_paths[0] if file_paths else "")
+
+
+# 下载前保留的最小磁盘剩余空间（GiB）以及空间不足时重新检查的间隔（秒）
+DEFAULT_MIN_FREE_SPACE = 5
+DEFAULT_DISK_CHECK_INTERVAL = 60
+
+
+class DownloadScheduler:
+    """所有UP主共用的下载调度器。
+
+    待下载的视频按UP主轮询（FairQueue）交给 prefetch 个预取 worker 获取视频详情，
+    再由下载 worker 下载，全局同时最多下载 concurrency 个视频。
+    预取最多领先下载 prefetch 个视频；等待下载的视频（多P视频的每个分P各一个任务）同样按UP主轮询，
+    一个分P很多的视频不会让其他UP主一直等待。下载失败的视频按错误类别退避后重新入队，不占用 worker。
+    每次下载前按时长和画质估算大小并预留磁盘空间，空间不足 min_free_space 时暂停队列（见 DiskSpaceGuard）。
+    autotune 开启时同时下载数和 API 速率由 AIMD 自动调节（见 _autotune）。
+    调用 close() 表示不会再添加UP主，run() 在所有视频完成后返回。
+    下载进度以事件（见 events.py）发布到 bus，命令行和各个 webui 订阅后自行显示。
+    """
+
+    def __init__(self, arg_dict: dict, bus: EventBus = None):
+        self.arg_dict = arg_dict
+        self.bus = bus or EventBus()
+        # 本次运行成功和最终失败的任务数
+        self.downloaded = 0
+        self.failed = 0
+        self.concurrency = max(1, int(arg_dict.get("concurrency") or 1))
+        self.prefetch = max(1, int(arg_dict.get("prefetch") or 1))
+        self.stall_timeout = float(arg_dict.get("stall_timeout") or DEFAULT_STALL_TIMEOUT)
+        self.log_file = os.path.join(os.path.dirname(__file__), "download_errors.log")
+        # pending: 尚未获取视频详情的视频；ready: 已获取详情、等待下载的视频（包括到期的重试），都按UP主轮询
+        self.pending = FairQueue()
+        self.ready = FairQueue()
+        self.lookahead = asyncio.Semaphore(self.prefetch)
+        self.retry_tasks = set()
+        # outstanding: 已进入下载阶段但尚未成功或最终失败的视频数
+        self.outstanding = 0
+        self.prefetch_done = False
+        # 同时下载数的上限可以在运行中调整；开启自动调节时按最大值启动 worker，由 slots 限制实际并发
+        self.autotune = bool(arg_dict.get("autotune"))
+        self.autotune_interval = max(5.0, float(arg_dict.get("autotune_interval") or 30))
+        if self.autotune:
+            self.min_concurrency = max(1, int(arg_dict.get("min_concurrency") or 1))
+            self.max_concurrency = max(self.min_concurrency, int(arg_dict.get("max_concurrency") or self.concurrency))
+        else:
+            self.min_concurrency = self.max_concurrency = self.concurrency
+        self.workers = self.max_concurrency
+        self.slots = ResizableSemaphore(min(max(self.concurrency, self.min_concurrency), self.max_concurrency))
+        # 自动调节的统计窗口：下载尝试、成功、失败和风控次数
+        self.window = {"attempts": 0, "successes": 0, "failures": 0, "rate_limited": 0}
+        # 正在下载的视频数（占用名额但在等待队列或磁盘空间的 worker 不算）
+        self.active = 0
+        min_free_space = arg_dict.get("min_free_space")
+        self.disk = DiskSpaceGuard(
+            min_free=float(DEFAULT_MIN_FREE_SPACE if min_free_space is None else min_free_space) * 1024 ** 3,
+            check_interval=max(5.0, float(arg_dict.get("disk_check_interval") or DEFAULT_DISK_CHECK_INTERVAL))
+        )
+        # 正在进行的下载（供 abort_running 中止）以及被用户中止的下载
+        self.running = set()
+        self.aborted = set()
+
+    def abort_running(self):
+        """中止所有正在进行的下载尝试（webui 的中止按钮），被中止的下载立即重新排队，不计入重试次数"""
+        for task in list(self.running):
+            self.aborted.add(task)
+            task.cancel()
+
+    def _job_event(self, cls, item: dict, **fields):
+        """发布单个下载任务的事件"""
+        job, video, part = item["job"], item["video"], item.get("part")
+        self.bus.publish(cls(
+            job["uid"], job["up_name"], bvid=StateStore.bvid_of(video), index=item["index"],
+            total=len(job["video_urls"]), title=video.get('title', ''),
+            part=f"P{part['page']} {part['part']}" if part else "", **fields
+        ))
+
+    def add_uploader(self, job: dict):
+        """将UP主所有未下载的视频加入队列"""
+        self.add_videos(job, job["video_urls"])
+
+    def add_videos(self, job: dict, videos: list, start: int = 1):
+        """将UP主的部分视频加入队列，start 为 videos[0] 在 job["video_urls"] 中的序号（从1开始）"""
+        total = len(job["video_urls"])
+        for i, video in enumerate(videos, start):
+            if video['downloaded'] == 'True':
+                print(f"[{job['up_name']}] Skipping already downloaded video {i}/{total}: {video['title']}")
+                continue
+            item = {"job": job, "index": i, "video": video, "info": None, "attempt": 0}
+            self.pending.put(job["uid"], item)
+            self._job_event(JobQueued, item)
+
+    def close(self):
+        self.pending.close()
+
+    async def run(self):
+        print(f"Starting {self.slots.limit} download worker(s), prefetching up to {self.prefetch} video(s) ahead")
+        tuner = None
+        if self.autotune:
+            print(f"Autotune enabled: {self.min_concurrency}-{self.max_concurrency} workers, adjusted every {self.autotune_interval:.0f}s")
+            tuner = asyncio.ensure_future(self._autotune())
+        try:
+            # 被取消时等所有 worker 结束（正在进行的下载会结束子进程树）后再返回
+            await gather_all(self._run_prefetch(), *(self._download_worker() for _ in range(self.workers)))
+        finally:
+            if tuner is not None:
+                tuner.cancel()
+            for task in self.retry_tasks:
+                task.cancel()
+
+    def _finish_item(self):
+        self.outstanding -= 1
+        self._stop_if_idle()
+
+    def _stop_if_idle(self):
+        if self.prefetch_done and self.outstanding == 0:
+            # 没有待下载和待重试的视频，通知所有下载 worker 退出
+            self.ready.close()
+
+    async def _run_prefetch(self):
+        await gather_all(*(self._prefetch_worker() for _ in range(self.prefetch)))
+        self.prefetch_done = True
+        self._stop_if_idle()
+
+    async def _prefetch_worker(self):
+        while True:
+            # 先占用预取名额再出队，出队时才决定轮到哪个UP主，后加入的UP主也能及时排上
+            await self.lookahead.acquire()
+            item = await self.pending.get()
+            if item is None:
+                self.lookahead.release()
+                return
+            item["info"] = await self._resolve(item)
+            items = self._expand_parts(item) if item["info"] is not None else []
+            if not items:
+                self.lookahead.release()
+                continue
+            items[0]["prefetched"] = True
+            self.outstanding += len(items)
+            for part_item in items:
+                self._put_ready(part_item)
+
+    def _expand_parts(self, item: dict) -> list:
+        """多P视频拆成每个分P一个任务，各自下载、重试，已下载的分P直接跳过；单P视频保持一个任务"""
+        job, video, video_info = item["job"], item["video"], item["info"]
+        if len(video_info['pages']) < 2:
+            return [item]
+        bvid = StateStore.bvid_of(video)
+        job["store"].upsert_parts(bvid, part_records(job["output_dir"], video_info))
+        parts = job["store"].load_parts(bvid)
+        todo = [part for part in parts if part['downloaded'] != 'True']
+        state = {"parts": parts, "remaining": len(todo), "failed": 0}
+        if not todo:
+            self._finish_video(item, state)
+            return []
+        if len(todo) < len(parts):
+            print(f"[{job['up_name']}] Resuming {video_info['title']}: {len(parts) - len(todo)}/{len(parts)} parts already downloaded")
+        return [dict(item, part=part, state=state) for part in todo]
+
+    def _finish_part(self, item: dict, ok: bool):
+        """记录一个分P的最终结果，所有分P都有结果后更新视频的状态"""
+        part, state = item["part"], item["state"]
+        item["job"]["store"].set_part_downloaded(StateStore.bvid_of(item["video"]), part['page'], ok)
+        part['downloaded'] = str(ok)
+        state["remaining"] -= 1
+        if not ok:
+            state["failed"] += 1
+        if state["remaining"] == 0:
+            self._finish_video(item, state)
+
+    def _finish_video(self, item: dict, state: dict):
+        job, video = item["job"], item["video"]
+        if state["failed"]:
+            print(f"[{job['up_name']}] {state['failed']}/{len(state['parts'])} parts of {video['url']} failed, "
+                  f"the downloaded parts are kept and the rest will be retried on the next run")
+            video['downloaded'] = 'False'
+            job["store"].upsert(video)
+        else:
+            record_video_result(job, video, True, get_file_names(job["output_dir"], item["info"], state["parts"]))
+
+    async def _download_worker(self):
+        while True:
+            await self.slots.acquire()
+            try:
+                item = await self.ready.get()
+                if item is None:
+                    return
+                if item.pop("prefetched", False):
+                    self.lookahead.release()
+                # 磁盘空间不足时在这里等待，后面的视频也不会开始下载
+                reservation = await self.disk.admit(item["job"]["output_dir"], self._estimate_size(item), item["video"]["url"])
+                self.active += 1
+                try:
+                    await self._attempt(item, reservation)
+                finally:
+                    self.active -= 1
+            finally:
+                self.slots.release()
+
+    def _estimate_size(self, item: dict) -> int:
+        """按视频（或分P）时长和所选画质估算下载大小"""
+        video_info, part = item["info"], item.get("part")
+        duration = video_info.get('duration') or 0
+        if part:
+            for number, page in enumerate(video_info['pages'], 1):
+                if int(page.get('page') or number) == part['page']:
+                    duration = page.get('duration') or 0
+                    break
+        return estimate_size(duration, item["job"]["quality"])
+
+    async def _autotune(self):
+        """按 AIMD 调节同时下载数和 API 速率，每 autotune_interval 秒决策一次。
+
+        出现风控（下载或 API 请求返回 412 等）时两者都减半，下载失败率过高时下载数减半；
+        否则在有积压的视频、worker 都在忙且吞吐量仍在增长时下载数加一，API 请求需要排队时速率加 0.5/s。
+        """
+        workers = AIMD("workers", self.slots.limit, self.min_concurrency, self.max_concurrency)
+        api_rate = None
+        if api_limiter.rate > 0:
+            api_rate = AIMD(
+                "api_rate", api_limiter.rate,
+                float(self.arg_dict.get("api_rate_min") or 0.5),
+                float(self.arg_dict.get("api_rate_max") or max(api_limiter.rate, 8)),
+                step=0.5, integer=False, unit="/s"
+            )
+        last_total = throughput.total
+        last_api_errors = api_rate_limited_errors
+        last_api_calls, last_api_waited = api_limiter.calls, api_limiter.waited_calls
+        last_throughput = 0.0
+        increased = False
+        while True:
+            await asyncio.sleep(self.autotune_interval)
+            window, self.window = self.window, dict.fromkeys(self.window, 0)
+            rate = (throughput.total - last_total) / self.autotune_interval
+            api_errors = api_rate_limited_errors - last_api_errors
+            api_calls = api_limiter.calls - last_api_calls
+            api_waited = api_limiter.waited_calls - last_api_waited
+            last_total, last_api_errors = throughput.total, api_rate_limited_errors
+            last_api_calls, last_api_waited = api_limiter.calls, api_limiter.waited_calls
+            rate_limited = window["rate_limited"] + api_errors
+            error_rate = window["failures"] / window["attempts"] if window["attempts"] else 0.0
+            backlog = len(self.pending) + len(self.ready)
+            if not (window["attempts"] or backlog or rate_limited or self.active):
+                # 没有任何下载活动（例如常驻运行时等待新投稿），不做调整
+                continue
+            summary = (f"{rate / 1024 / 1024:.2f} MiB/s, {window['successes']} ok / {window['failures']} failed, "
+                       f"{rate_limited} rate-limited, backlog {backlog}, {self.active} busy")
+
+            if rate_limited:
+                workers.decrease(f"rate limited ({summary})")
+                increased = False
+            elif window["attempts"] >= 2 and error_rate > 0.5:
+                workers.decrease(f"error rate {error_rate:.0%} ({summary})")
+                increased = False
+            elif backlog == 0 or self.active < self.slots.limit:
+                workers.hold(f"workers not saturated ({summary})")
+                increased = False
+            elif increased and rate < last_throughput * 1.05:
+                workers.hold(f"throughput did not grow after the last increase ({summary})")
+                increased = False
+            else:
+                increased = workers.increase(f"room to grow ({summary})")
+            last_throughput = rate
+            self.slots.resize(workers.value)
+
+            if api_rate is not None:
+                if rate_limited:
+                    api_rate.decrease(f"{rate_limited} rate-limited responses")
+                elif api_waited:
+                    api_rate.increase(f"{api_waited}/{api_calls} API calls waited for the limiter")
+                else:
+                    api_rate.hold(f"{api_calls} API calls, none waited")
+                api_limiter.set_rate(api_rate.value)
+
+    def _put_ready(self, item: dict):
+        self.ready.put(item["job"]["uid"], item)
+
+    async def _requeue_later(self, item: dict, delay: float):
+        await asyncio.sleep(delay)
+        self._put_ready(item)
+
+    async def _resolve(self, item: dict):
+        return await resolve_video(item["job"], item["video"], item["index"])
+
+    async def _attempt(self, item: dict, reservation: tuple):
+        """下载单个视频的一次尝试；失败后按错误类别退避，放入延迟重试，不占用当前 worker
+
+        reservation 为下载前预留的磁盘空间，本次尝试结束后释放。
+        """
+        job, i, video, video_info = item["job"], item["index"], item["video"], item["info"]
+        part = item.get("part")
+        total_videos = len(job["video_urls"])
+        up_name = job["up_name"]
+        url = video['url']
+        label = f"video {i}/{total_videos}" + (f" P{part['page']}/{len(video_info['pages'])}" if part else "")
+        item["attempt"] += 1
+        attempt = item["attempt"]
+        if attempt == 1:
+            print(f"[{up_name}] Downloading {label}")
+            print(f"视频名称：{video_info['title']}，视频时长：{video['duration']}" + (f"，分P：{part['part']}" if part else ""))
+
+        def on_output(line: str, stream_name: str):
+            progress = parse_progress(line)
+            if progress:
+                self._job_event(JobBytes, item, downloaded=progress[0], size=progress[1], speed=progress[2])
+            elif re.search(r'INFO|WARN|ERROR', line, re.IGNORECASE):
+                self._job_event(JobLog, item, line=line.rstrip())
+
+        self.window["attempts"] += 1
+        download = None
+        try:
+            self._job_event(JobStarted, item, duration=video['duration'], attempt=attempt)
+            print(f"[{up_name}] Download attempt #{attempt} for {label}")
+            download = asyncio.ensure_future(download_video(
+                url, job["output_dir"], job["quality"], self.arg_dict["SESSDATA"],
+                video_info=video_info, stall_timeout=self.stall_timeout, on_output=on_output,
+                pages=[part['page']] if part else None
+            ))
+            self.running.add(download)
+            file_path = await download
+            if part:
+                self._finish_part(item, True)
+            else:
+                record_video_result(job, video, True, file_path)
+            self.window["successes"] += 1
+            self.downloaded += 1
+            self._job_event(JobMerged, item, duration=video['duration'], file_paths=[part['file_path']] if part else list(file_path))
+            self._finish_item()
+            return
+        except DownloadStalled as e:
+            error, message = e, f"Download stalled for {url}: {e}"
+        except subprocess.TimeoutExpired as e:
+            error, message = e, f"Timeout for {url}"
+        except subprocess.CalledProcessError as e:
+            error, message = e, f"Error downloading {url}: {e}"
+        except Exception as e:
+            error, message = e, f"Unexpected error downloading {url}: {e}"
+        except asyncio.CancelledError:
+            if download not in self.aborted:
+                if download is not None:
+                    # 等下载任务处理完取消（结束子进程树）后再退出
+                    download.cancel()
+                    await wait_all([download])
+                raise
+            error, message = None, f"Download of {url} aborted by user"
+        finally:
+            self.disk.release(reservation)
+            self.running.discard(download)
+
+        if download in self.aborted:
+            # 用户中止的尝试不计入重试次数，立即重新排队
+            self.aborted.discard(download)
+            item["attempt"] -= 1
+            print(f"{message}, {label} is queued again")
+            self._job_event(JobFailed, item, error=message, error_class=ERROR_TRANSIENT, attempt=attempt, retry_in=0)
+            self._put_ready(item)
+            return
+
+        error_class = classify_error(error)
+        if error_class == ERROR_LOCAL and self.disk.low_space(job["output_dir"]):
+            # 磁盘写满导致的失败不计入重试次数，重新排队，等空间足够后再下载
+            item["attempt"] -= 1
+            print(f"{message} [{error_class}], disk space is low, {label} is queued again")
+            self._job_event(JobFailed, item, error=f"{message}, disk space is low", error_class=error_class, attempt=attempt, retry_in=0)
+            self._put_ready(item)
+            return
+
+        self.window["failures"] += 1
+        if error_class == ERROR_RATE_LIMITED:
+            self.window["rate_limited"] += 1
+        max_attempts = RETRY_POLICIES[error_class]["max_attempts"]
+        if attempt < max_attempts:
+            delay = retry_delay(error_class, attempt)
+            print(f"{message} [{error_class}], will retry in {delay:.0f}s ({attempt}/{max_attempts})...")
+            self._job_event(JobFailed, item, error=message, error_class=error_class, attempt=attempt, retry_in=delay)
+            task = asyncio.ensure_future(self._requeue_later(item, delay))
+            self.retry_tasks.add(task)
+            task.add_done_callback(self.retry_tasks.discard)
+            return
+
+        if part:
+            self._finish_part(item, False)
+        else:
+            record_video_result(job, video, False)
+        print(f"{message} [{error_class}]")
+        self.failed += 1
+        self._job_event(JobFailed, item, error=message, error_class=error_class, attempt=attempt)
+        with open(self.log_file, "a", encoding="utf-8") as lf:
+            lf.write(f"Failed to download {url}" + (f" P{part['page']}" if part else "") + f" after {attempt} attempts ({error_class}): {error}\n")
+        self._finish_item()
+
+
+async def download_uploaders(uploaders: list, arg_dict: dict, bus: EventBus = None, interactive: bool = None, scheduler: "DownloadScheduler" = None):
+    """批量下载多个UP主的视频，所有UP主共用一个下载队列和全局并发上限。
+
+    uploaders 为 [{"uid": ...}, ...]，可单独指定 output_dir / video_quality。
+    UP主的视频列表依次获取，获取到一个就立即加入队列，不必等全部列表获取完。
+    只有一个UP主时保留“所有视频已下载，是否检查更新”的提示（interactive=False 时不提示，供 webui 使用）。
+    进度事件发布到 bus，全部结束后发布 RunFinished。scheduler 为调用方创建的调度器（默认新建）。
+    """
+    if interactive is None:
+        interactive = len(uploaders) == 1
+    scheduler = scheduler or DownloadScheduler(arg_dict, bus)
+    run_task = asyncio.ensure_future(scheduler.run())
+    jobs = []
+    try:
+        for uploader in uploaders:
+            try:
+                job = await prepare_uploader(uploader, arg_dict, scheduler.bus, interactive=interactive)
+            except Exception as e:
+                print(f"Error preparing UID {uploader.get('uid')}: {e}")
+                scheduler.bus.publish(Notice(uploader.get('uid'), "", f"Error preparing UID {uploader.get('uid')}: {e}"))
+                continue
+            jobs.append(job)
+            if not job["video_urls"]:
+                print(f"[{job['up_name']}] No videos found for this user.")
+                scheduler.bus.publish(Notice(job["uid"], job["up_name"], "No videos found for this user."))
+                continue
+            scheduler.add_uploader(job)
+        scheduler.close()
+        await run_task
+        print(rate_limit_report())
+        scheduler.bus.publish(RunFinished(0, "", scheduler.downloaded, scheduler.failed))
+    finally:
+        if not run_task.done():
+            run_task.cancel()
+        # 等待 worker 处理取消（结束 yutto 子进程树）后再关闭下载后端
+        await asyncio.gather(run_task, return_exceptions=True)
+        await close_download_backend()
+        for job in jobs:
+            finish_uploader(job)
+
+
+DEFAULT_WATCH_INTERVAL = 1800
+
+
+async def poll_uploader(job: dict) -> list:
+    """检查UP主是否有新投稿，返回新视频并写入状态库。
+
+    视频列表从新到旧排列，通常只需请求第一页：第一页出现已知视频即停止翻页。
+    """
+    new_videos = await fetch_new_videos(job["uid"], job["known_bvids"])
+    if new_videos:
+        job["video_urls"].extend(new_videos)
+        job["store"].upsert_many(new_videos)
+        job["store"].export_csv(Path(job["output_dir"]) / "video_urls.csv")
+    return new_videos
+
+
+async def watch_uploaders(uploaders: list, arg_dict: dict, bus: EventBus = None, scheduler: "DownloadScheduler" = None):
+    """常驻运行：下载所有UP主的现有视频后，每隔 watch_interval 秒检查一次新投稿，只把新视频加入队列。
+
+    配置读取、凭据和限速器初始化只在启动时进行一次，下载队列在整个运行期间保持不变，
+    检查新投稿时正在进行的下载不受影响。启动时获取视频列表失败的UP主在之后每次检查时重试。按 Ctrl+C 退出。
+    """
+    interval = max(10.0, float(arg_dict.get("watch_interval") or DEFAULT_WATCH_INTERVAL))
+    scheduler = scheduler or DownloadScheduler(arg_dict, bus)
+    run_task = asyncio.ensure_future(scheduler.run())
+    # 首次获取视频列表使用增量同步，不会询问用户
+    arg_dict = dict(arg_dict, sync=True)
+    jobs = []
+
+    async def prepare_all(uploaders: list) -> list:
+        """准备UP主并把现有视频加入队列，返回准备失败的UP主"""
+        failed = []
+        for uploader in uploaders:
+            try:
+                job = await prepare_uploader(uploader, arg_dict, scheduler.bus, interactive=False)
+            except Exception as e:
+                print(f"Error preparing UID {uploader.get('uid')}: {e}")
+                scheduler.bus.publish(Notice(uploader.get('uid'), "", f"Error preparing UID {uploader.get('uid')}: {e}"))
+                failed.append(uploader)
+                continue
+            job["known_bvids"] = {StateStore.bvid_of(v) for v in job["video_urls"]}
+            jobs.append(job)
+            scheduler.add_uploader(job)
+        return failed
+
+    try:
+        unprepared = await prepare_all(uploaders)
+        print(f"Watching {len(jobs)} uploader(s), checking for new videos every {interval:.0f}s"
+              + (f", {len(unprepared)} uploader(s) will be retried" if unprepared else ""))
+        while not run_task.done():
+            # 加一点随机抖动，避免长时间运行时总在同一时刻请求
+            sleep_task = asyncio.ensure_future(asyncio.sleep(interval * random.uniform(0.9, 1.1)))
+            await asyncio.wait([sleep_task, run_task], return_when=asyncio.FIRST_COMPLETED)
+            sleep_task.cancel()
+            if run_task.done():
+                break
+            polled = list(jobs)
+            if unprepared:
+                unprepared = await prepare_all(unprepared)
+            for job in polled:
+                try:
+                    new_videos = await poll_uploader(job)
+                except Exception as e:
+                    print(f"[{job['up_name']}] Error checking for new videos: {e}")
+                    continue
+                if new_videos:
+                    print(f"[{job['up_name']}] Found {len(new_videos)} new videos")
+                    scheduler.bus.publish(Notice(job["uid"], job["up_name"], f"Found {len(new_videos)} new videos"))
+                    scheduler.add_videos(job, new_videos, start=len(job["video_urls"]) - len(new_videos) + 1)
+            print(rate_limit_report())
+        # 调度器只会因异常结束
+        run_task.result()
+    finally:
+        if not run_task.done():
+            run_task.cancel()
+        # 等待 worker 处理取消（结束 yutto 子进程树）后再关闭下载后端
+        await asyncio.gather(run_task, return_exceptions=True)
+        await close_download_backend()
+        for job in jobs:
+            finish_uploader(job)
+
+
+async def download_all_videos(arg_dict: dict, bus: EventBus = None):
+    """下载 arg_dict["uid"] 指定的UP主的所有视频"""
+    await download_uploaders([{"uid": arg_dict["uid"]}], arg_dict, bus)
+
+
+# 默认设置，依次被 config.toml 的 [basic] 和命令行参数（或 webui 中的输入）覆盖
+DEFAULT_SETTINGS = {
+    "uid": 0,
+    "output_dir": "~/Downloads",
+    "video_quality": "",
+    "SESSDATA": "",
+    "BILI_JCT": "",
+    "BUVID3": "",
+    "concurrency": 1,
+    "prefetch": 4,
+    "list_concurrency": 4,
+    "sync": False,
+    "stall_timeout": DEFAULT_STALL_TIMEOUT,
+    "watch": False,
+    "watch_interval": DEFAULT_WATCH_INTERVAL,
+    "backend": "yutto",
+    "autotune": False,
+    "min_concurrency": 1,
+    "max_concurrency": 8,
+    "autotune_interval": 30,
+    "api_rate_min": 0.5,
+    "api_rate_max": 8,
+    "min_free_space": DEFAULT_MIN_FREE_SPACE,
+    "disk_check_interval": DEFAULT_DISK_CHECK_INTERVAL,
+}
+
+
+def load_settings(overrides: dict = None) -> tuple:
+    """合并设置：默认值 ← config.toml 的 [basic] ← overrides 中的非空值，返回 (设置, config.toml 内容)"""
+    toml_args = read_toml_config()
+    settings = dict(DEFAULT_SETTINGS)
+    for source in (toml_args["basic"], overrides or {}):
+        for key in settings:
+            if key in source and source[key] != "" and source[key] is not None:
+                settings[key] = source[key]
+    return settings, toml_args
+
+
+class DownloadEngine:
+    """命令行和各个 webui 共用的下载引擎。
+
+    获取视频列表和详情、调度、下载以及状态记录都由引擎完成，进度以事件（见 events.py）发布到 bus；
+    命令行和 webui 只订阅事件并显示，自己不做任何下载相关的 I/O。
+    """
+
+    def __init__(self, settings: dict, bus: EventBus = None):
+        self.settings = settings
+        self.bus = bus or EventBus()
+        self.config = {}
+        # 运行中的调度器及其事件循环，供 abort() 从其他线程调用
+        self.scheduler = None
+        self._loop = None
+
+    @classmethod
+    def from_config(cls, overrides: dict = None) -> "DownloadEngine":
+        """按 config.toml 和 overrides（如 webui 中的输入）创建引擎并初始化限速器、缓存和下载后端"""
+        settings, toml_args = load_settings(overrides)
+        engine = cls(settings)
+        engine.configure(toml_args["basic"])
+        return engine
+
+    def configure(self, config: dict):
+        """按 config（config.toml 的 [basic]）初始化限速器、缓存和下载后端，config 保存在 self.config 中供 webui 使用"""
+        self.config = config
+        configure_runtime(dict(config, backend=self.settings["backend"]))
+
+    async def run(self, uploaders: list, watch: bool = False, interactive: bool = None):
+        """下载 uploaders 的所有视频；watch 为 True 时常驻运行，定期检查新投稿"""
+        self.scheduler = DownloadScheduler(self.settings, self.bus)
+        self._loop = asyncio.get_running_loop()
+        try:
+            if watch:
+                await watch_uploaders(uploaders, self.settings, self.bus, scheduler=self.scheduler)
+            else:
+                await download_uploaders(uploaders, self.settings, self.bus, interactive=interactive, scheduler=self.scheduler)
+        finally:
+            self.scheduler = None
+
+    def abort(self):
+        """中止正在进行的下载尝试，被中止的视频立即重新排队；可以在其他线程中调用"""
+        scheduler, loop = self.scheduler, self._loop
+        if scheduler is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(scheduler.abort_running)
+
+    async def run_console(self, uploaders: list, watch: bool = False):
+        """命令行运行：过程信息由各模块直接打印，这里订阅事件并在结束时输出汇总"""
+        subscription = self.bus.subscribe()
+        reporter = asyncio.ensure_future(self._report(subscription))
+        try:
+            await self.run(uploaders, watch=watch)
+        finally:
+            self.bus.close()
+            await reporter
+
+    @staticmethod
+    async def _report(subscription):
+        failed = []
+        async for event in subscription:
+            if isinstance(event, JobFailed) and event.retry_in is None:
+                failed.append(f"[{event.up_name}] {event.label} {event.title}: {event.error_class}")
+            elif isinstance(event, RunFinished):
+                print(f"Finished: {event.downloaded} downloaded, {event.failed} failed")
+                for line in failed:
+                    print(f"  failed {line}")
+
+    async def events(self, uploaders: list):
+        """下载 uploaders 的所有视频并依次产出事件，供 webui 使用；不会在控制台询问用户。
+
+        下载在后台任务中进行，调用方关闭生成器（例如页面关闭）时取消下载，并等待子进程等资源清理完毕。
+        """
+        subscription = self.bus.subscribe()
+        task = asyncio.ensure_future(self.run(uploaders, interactive=False))
+        task.add_done_callback(lambda _: self.bus.close())
+        try:
+            async for event in subscription:
+                yield event
+            if not task.cancelled() and task.exception() is not None:
+                yield Notice(0, "", f"Download stopped: {task.exception()}")
+        finally:
+            subscription.close()
+            if not task.done():
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,181 @@
+import asyncio
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Event:
+    """下载引擎发布的事件，uid / up_name 标明所属的UP主"""
+    uid: int
+    up_name: str
+
+
+@dataclass
+class Notice(Event):
+    """一般性的提示信息"""
+    text: str = ""
+
+
+@dataclass
+class UploaderListed(Event):
+    """已获取UP主的视频列表"""
+    total: int = 0
+    output_dir: str = ""
+
+
+@dataclass
+class JobEvent(Event):
+    """单个下载任务（视频，多P视频为一个分P）的事件；index / total 为视频在UP主列表中的序号和总数"""
+    bvid: str = ""
+    index: int = 0
+    total: int = 0
+    title: str = ""
+    part: str = ""
+
+    @property
+    def label(self) -> str:
+        return f"video {self.index}/{self.total}" + (f" ({self.part})" if self.part else "")
+
+
+@dataclass
+class JobQueued(JobEvent):
+    pass
+
+
+@dataclass
+class JobStarted(JobEvent):
+    duration: str = ""
+    attempt: int = 1
+
+
+@dataclass
+class JobBytes(JobEvent):
+    """下载进度：已下载 / 总大小（字节）和当前速度（字节/秒），来自 yutto 或 native 后端的进度行"""
+    downloaded: int = 0
+    size: int = 0
+    speed: float = 0.0
+
+
+@dataclass
+class JobLog(JobEvent):
+    """下载器输出的 INFO / WARN / ERROR 行"""
+    line: str = ""
+
+
+@dataclass
+class JobMerged(JobEvent):
+    """下载并合并完成"""
+    duration: str = ""
+    file_paths: list = field(default_factory=list)
+
+
+@dataclass
+class JobFailed(JobEvent):
+    """一次下载尝试失败；retry_in 为 None 表示不再重试"""
+    error: str = ""
+    error_class: str = ""
+    attempt: int = 1
+    retry_in: float = None
+
+
+@dataclass
+class RunFinished(Event):
+    """所有任务都已结束"""
+    downloaded: int = 0
+    failed: int = 0
+
+
+class Subscription:
+    """EventBus 的一个订阅者，用 async for 依次读取事件，总线关闭后结束"""
+
+    def __init__(self, bus: "EventBus"):
+        self._bus = bus
+        self._queue = asyncio.Queue()
+        self.dropped = 0
+
+    def _put(self, event):
+        # 订阅者跟不上时丢弃进度事件（后面的进度会覆盖它），其他事件都保留
+        if isinstance(event, JobBytes) and self._queue.qsize() >= self._bus.max_pending:
+            self.dropped += 1
+            return
+        self._queue.put_nowait(event)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self._queue.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+
+class EventBus:
+    """进程内的异步事件总线：publish() 不阻塞，每个订阅者有自己的队列。
+
+    在同一个事件循环中使用；没有订阅者时 publish() 什么也不做。
+    """
+
+    def __init__(self, max_pending: int = 1000):
+        self.max_pending = max_pending
+        self._subscribers = []
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self)
+        self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription in self._subscribers:
+            self._subscribers.remove(subscription)
+
+    def publish(self, event: Event):
+        for subscription in self._subscribers:
+            subscription._put(event)
+
+    def close(self):
+        """通知所有订阅者不会再有新事件"""
+        for subscription in self._subscribers:
+            subscription._queue.put_nowait(None)
+        self._subscribers = []
+
+
+_MESSAGES = {
+    "en": {
+        "listed": "Found {total} videos",
+        "started": "Attempt {attempt} for {label}: {title}",
+        "merged": "Successfully downloaded {label}: {title}",
+        "retry": "{error} [{error_class}], retrying in {retry_in:.0f}s...",
+        "failed": "Failed to download {label} after {attempt} attempts ({error_class}): {error}",
+        "finished": "Download completed: {downloaded} downloaded, {failed} failed",
+    },
+    "zh": {
+        "listed": "找到 {total} 个视频",
+        "started": "第 {attempt} 次尝试下载 {label}: {title}",
+        "merged": "成功下载 {label}: {title}",
+        "retry": "{error} [{error_class}]，{retry_in:.0f} 秒后重试...",
+        "failed": "下载 {label} 在 {attempt} 次尝试后失败（{error_class}）: {error}",
+        "finished": "下载全部完成：成功 {downloaded} 个，失败 {failed} 个",
+    },
+}
+
+
+def describe(event: Event, lang: str = "en") -> str:
+    """事件的一行可读描述，供各个 webui 显示；进度和下载器输出事件返回空字符串"""
+    messages = _MESSAGES[lang]
+    fields = dict(vars(event), label=getattr(event, "label", ""))
+    if isinstance(event, Notice):
+        return event.text
+    if isinstance(event, UploaderListed):
+        return messages["listed"].format(**fields)
+    if isinstance(event, JobStarted):
+        return messages["started"].format(**fields)
+    if isinstance(event, JobMerged):
+        return messages["merged"].format(**fields)
+    if isinstance(event, JobFailed):
+        return messages["failed" if event.retry_in is None else "retry"].format(**fields)
+    if isinstance(event, RunFinished):
+        return messages["finished"].format(**fields)
+    return ""
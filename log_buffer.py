@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+from collections import OrderedDict, deque
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+DEFAULT_LOG_LINES = 1000
+DEFAULT_SPILL_SIZE = 10  # MiB
+DEFAULT_SPILL_BACKUPS = 3
+DEFAULT_LOG_DIR = Path(__file__).parent / "logs"
+
+
+class LogBuffer:
+    """webui 共用的有界日志：内存中只保留最近 max_lines 行（全局一份，每个任务各一份）。
+
+    超出上限被挤出的行写入按大小轮转的磁盘文件（spill_path），可以用 page() 按页往回翻；
+    内存中最多保留 max_jobs 个任务的日志，长时间运行时内存占用保持不变。多线程可以同时使用。
+    """
+
+    def __init__(self, max_lines: int = DEFAULT_LOG_LINES, spill_path=None, spill_size: float = DEFAULT_SPILL_SIZE,
+                 spill_backups: int = DEFAULT_SPILL_BACKUPS, max_jobs: int = 100):
+        self.max_lines = max(1, int(max_lines))
+        self.max_jobs = max_jobs
+        self._lines = deque(maxlen=self.max_lines)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.spill_path = Path(spill_path) if spill_path else None
+        self._spill = None
+        if self.spill_path:
+            self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+            self._spill = RotatingFileHandler(
+                self.spill_path, maxBytes=int(spill_size * 1024 * 1024), backupCount=spill_backups,
+                encoding="utf-8", delay=True
+            )
+
+    def append(self, text: str, job: str = ""):
+        """追加一行或多行日志，job 为所属任务（如视频标题），为空表示只属于全局日志"""
+        job = job.replace("\t", " ")
+        with self._lock:
+            for line in text.splitlines():
+                if len(self._lines) == self.max_lines and self._spill:
+                    self._spill.emit(logging.makeLogRecord({"msg": "\t".join(self._lines[0])}))
+                self._lines.append((job, line))
+                if job:
+                    view = self._jobs.pop(job, None) or deque(maxlen=self.max_lines)
+                    view.append(line)
+                    self._jobs[job] = view
+                    if len(self._jobs) > self.max_jobs:
+                        self._jobs.popitem(last=False)
+
+    def lines(self, job: str = None) -> list:
+        """内存中的日志行；指定 job 时只返回该任务的日志"""
+        with self._lock:
+            if job is None:
+                return [line for _, line in self._lines]
+            return list(self._jobs.get(job, ()))
+
+    def text(self, job: str = None) -> str:
+        lines = self.lines(job)
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def page(self, page: int = 1, page_size: int = 200, job: str = None) -> list:
+        """已写入磁盘的较早日志，page=1 为最近的一页，每页按时间顺序排列；指定 job 时只返回该任务的日志
+
+        从最新的文件末尾往前读，凑够 page 页后停止，不会读入整个磁盘日志。
+        """
+        if not self._spill:
+            return []
+        wanted = max(1, page) * page_size
+        newest_first = []
+        with self._lock:
+            self._spill.flush()
+            files = [self.spill_path] + [Path(f"{self.spill_path}.{n}") for n in range(1, self._spill.backupCount + 1)]
+            for path in files:
+                if len(newest_first) >= wanted:
+                    break
+                if not path.exists():
+                    continue
+                for record in _reverse_lines(path):
+                    record_job, _, line = record.partition("\t")
+                    if job is None or record_job == job:
+                        newest_first.append(line)
+                        if len(newest_first) >= wanted:
+                            break
+        return newest_first[(max(1, page) - 1) * page_size:wanted][::-1]
+
+    def close(self):
+        if self._spill:
+            self._spill.close()
+
+
+def _reverse_lines(path: Path, block_size: int = 64 * 1024):
+    """从文件末尾往前逐行读取（不含换行符），每次只读入 block_size 字节"""
+    with open(path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        rest = b""
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + rest).split(b"\n")
+            # 第一行可能不完整，与前一块拼接后再处理
+            rest = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line.decode("utf-8", errors="replace").rstrip("\r")
+        if rest:
+            yield rest.decode("utf-8", errors="replace").rstrip("\r")
+
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def webui_log(name: str, config: dict = None) -> LogBuffer:
+    """名为 name 的 webui 共用的日志，第一次使用时按 config（config.toml 的 [basic]）创建。
+
+    log_lines 为内存中保留的行数，log_spill_size 为磁盘文件轮转的大小（MiB），
+    磁盘文件位于 log_dir（默认脚本目录下的 logs）中的 <name>.log。
+    """
+    with _buffers_lock:
+        if name not in _buffers:
+            config = config or {}
+            _buffers[name] = LogBuffer(
+                max_lines=config.get("log_lines") or DEFAULT_LOG_LINES,
+                spill_path=Path(config.get("log_dir") or DEFAULT_LOG_DIR).expanduser() / f"{name}.log",
+                spill_size=config.get("log_spill_size") or DEFAULT_SPILL_SIZE,
+            )
+        return _buffers[name]
@@ -0,0 +1,99 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+class MetadataCache:
+    """以 bvid 为键的视频详情缓存，保存为紧凑的 JSON 文件。
+
+    条目超过 ttl 秒后失效；条目数超过 max_entries 时按最近最少使用淘汰。
+    写入会合并，最多每 flush_interval 秒落盘一次，进程退出时再写入一次。
+    put() 只更新内存并返回是否到了落盘时间，在事件循环中使用时由调用方在线程中 flush()，
+    重写整个文件不会阻塞事件循环。
+    """
+
+    def __init__(self, path, ttl: float = 7 * 24 * 3600, max_entries: int = 50000, flush_interval: float = 5.0):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # 串行化落盘，较早的快照不会覆盖较新的快照
+        self._flush_lock = threading.Lock()
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        self._load()
+        atexit.register(self.flush)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable metadata cache {self.path}: {e}")
+            return
+        now = time.time()
+        for bvid, (fetched_at, info) in data.items():
+            if now - fetched_at < self.ttl:
+                self._entries[bvid] = (fetched_at, info)
+        self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._dirty = True
+
+    def get(self, bvid: str):
+        """返回缓存的视频详情，不存在或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(bvid)
+            if entry is None:
+                return None
+            fetched_at, info = entry
+            if time.time() - fetched_at >= self.ttl:
+                del self._entries[bvid]
+                self._dirty = True
+                return None
+            self._entries.move_to_end(bvid)
+            return info
+
+    def put(self, bvid: str, info: dict) -> bool:
+        """缓存视频详情，返回是否应该调用 flush() 落盘"""
+        with self._lock:
+            self._entries[bvid] = (time.time(), info)
+            self._entries.move_to_end(bvid)
+            self._evict()
+            self._dirty = True
+            return time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush(self):
+        """将缓存写入磁盘（先写临时文件再替换，避免写到一半的文件），可以在线程中调用"""
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = dict(self._entries)
+            self._dirty = False
+            self._last_flush = time.monotonic()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".json.tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            Path(temp_path).unlink(missing_ok=True)
+            with self._lock:
+                self._dirty = True
+            print(f"Error writing metadata cache {self.path}: {e}")
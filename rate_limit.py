@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+class TokenBucket:
+    """令牌桶限速器，进程内共享。
+
+    以 rate 个/秒的速度补充令牌，最多积攒 burst 个；rate <= 0 表示不限速。
+    令牌不足时按请求顺序预约，等待补足所需的时间，因此先到的请求先通过。
+    不依赖某个事件循环，CLI 和各个 webui（各自在线程中运行事件循环）可以共用同一个实例。
+    """
+
+    def __init__(self, rate: float, burst: float = 1, name: str = "", unit: str = "", scale: float = 1):
+        self.name = name
+        # 显示速率时的单位，例如按字节计数时 unit="MiB", scale=1024*1024
+        self.unit = unit
+        self.scale = scale
+        self._lock = threading.Lock()
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self.calls = 0
+        self.waited_calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.schedule = None
+        self._schedule_checked = 0.0
+
+    def set_schedule(self, schedule):
+        """按 schedule.rate_at() 随时间调整速率（每秒检查一次），None 表示取消；突发上限为一秒的量"""
+        with self._lock:
+            self.schedule = schedule
+            self._schedule_checked = 0.0
+
+    def _apply_schedule(self):
+        now = time.monotonic()
+        if self.schedule is None or now - self._schedule_checked < 1.0:
+            return
+        self._schedule_checked = now
+        rate = float(self.schedule.rate_at())
+        if rate == self.rate:
+            return
+        self._refill()
+        if self.rate <= 0:
+            # 从不限速切换为限速时从满桶开始
+            self._tokens = max(1.0, rate)
+        self.rate = rate
+        self.burst = max(1.0, rate)
+        self._tokens = min(self._tokens, self.burst)
+        print(f"[{self.name}] rate changed to {self.format_rate(rate)}")
+
+    def set_rate(self, rate: float, burst: float = None):
+        """修改速率，正在等待的请求不受影响，之后的请求按新速率计算"""
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+            if burst is not None:
+                self.burst = max(1.0, float(burst))
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens: float = 1) -> float:
+        """预约令牌，返回需要等待的秒数"""
+        with self._lock:
+            self.calls += 1
+            self._apply_schedule()
+            if self.rate <= 0:
+                return 0.0
+            self._refill()
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if wait > 0:
+                self.waited_calls += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            return wait
+
+    async def acquire(self, tokens: float = 1) -> float:
+        """等待直到获得令牌，返回实际等待的秒数"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def format_rate(self, rate: float) -> str:
+        if rate <= 0:
+            return "unlimited"
+        return f"{rate / self.scale:.2f} {self.unit}/s" if self.unit else f"{rate:g}/s"
+
+    def report(self) -> str:
+        """等待情况统计"""
+        average = self.total_wait / self.calls if self.calls else 0.0
+        limit = f"{self.format_rate(self.rate)}, burst {self.burst / self.scale:g}" if self.rate > 0 else "unlimited"
+        return (
+            f"[{self.name}] {limit}: {self.calls} calls, {self.waited_calls} waited, "
+            f"total wait {self.total_wait:.1f}s, avg {average:.2f}s, max {self.max_wait:.2f}s"
+        )
+
+
+def parse_clock(text: str) -> int:
+    """将 "09:30" 转换为当天的分钟数"""
+    hours, _, minutes = str(text).strip().partition(":")
+    value = int(hours) * 60 + int(minutes or 0)
+    if not 0 <= value <= 24 * 60:
+        raise ValueError(f"Invalid time of day: {text!r}")
+    return value
+
+
+class BandwidthSchedule:
+    """按一天中的时间段切换带宽上限（字节/秒，0 表示不限速）。
+
+    periods 为 [(开始分钟, 结束分钟, 速率)]，结束早于开始表示跨越午夜（如 22:00 到 06:00），
+    不在任何时间段内时使用 default。
+    """
+
+    def __init__(self, default: float = 0, periods: list = ()):
+        self.default = float(default)
+        self.periods = list(periods)
+
+    @classmethod
+    def from_config(cls, limit=0, schedule=()) -> "BandwidthSchedule":
+        """根据配置创建：limit 和 schedule 中的 limit 单位为 MiB/s"""
+        periods = [
+            (parse_clock(period["start"]), parse_clock(period["end"]), float(period.get("limit") or 0) * 1024 * 1024)
+            for period in schedule or ()
+        ]
+        return cls(float(limit or 0) * 1024 * 1024, periods)
+
+    def rate_at(self, when: datetime = None) -> float:
+        when = when or datetime.now()
+        minute = when.hour * 60 + when.minute
+        for start, end, rate in self.periods:
+            if start <= minute < end or (end < start and (minute >= start or minute < end)):
+                return rate
+        return self.default
+
+
+class ThroughputMeter:
+    """统计所有下载最近 window 秒内的实际速度（字节/秒）"""
+
+    def __init__(self, window: float = 5.0):
+        self.window = window
+        self.total = 0
+        self._samples = deque()
+        self._lock = threading.Lock()
+        self._started = None
+
+    def add(self, size: int):
+        now = time.monotonic()
+        with self._lock:
+            if self._started is None:
+                self._started = now
+            self.total += size
+            self._samples.append((now, size))
+            self._prune(now)
+
+    def _prune(self, now: float):
+        while self._samples and now - self._samples[0][0] > self.window:
+            self._samples.popleft()
+
+    def rate(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            if not self._samples:
+                return 0.0
+            # 刚开始下载时按实际经过的时间计算，避免速度偏低
+            span = min(self.window, max(now - self._started, 1.0))
+            return sum(size for _, size in self._samples) / span
@@ -0,0 +1,177 @@
+import csv
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+class StateStore:
+    """基于 SQLite (WAL 模式) 的下载状态存储，每个视频一行，以 bvid 为主键。
+
+    行数据与原 video_urls.csv 的格式一致（所有字段均为字符串），
+    每次状态变化只更新对应的一行，而不是重写整个文件。
+    下载成功的记录另外追加到 history 表，供 webui 分页显示下载历史。
+    webui 中事件循环的每一步可能在不同的线程中运行，连接允许跨线程使用，所有访问都由一把锁串行化。
+    """
+
+    # aid / created / cover 来自视频列表接口，避免为这些字段单独请求视频详情
+    FIELDS = ['url', 'title', 'duration', 'downloaded', 'file_path', 'info', 'aid', 'created', 'cover']
+    # 多P视频每个分P一行，单独记录下载状态
+    PART_FIELDS = ['cid', 'part', 'file_path', 'downloaded']
+    HISTORY_FIELDS = ['position', 'title', 'file_path', 'duration', 'downloaded_at']
+    # 下载历史可用的排序方式（time 为下载完成的先后顺序，position 为视频在列表中的序号）
+    HISTORY_SORTS = {"time": "id", "position": "position", "title": "title"}
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ", ".join(f"{field} TEXT NOT NULL DEFAULT ''" for field in self.FIELDS)
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS videos (bvid TEXT PRIMARY KEY, position INTEGER NOT NULL, {columns})"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS videos_position ON videos (position)")
+        # 旧版本创建的数据库缺少新增的列时自动补上
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(videos)")}
+        for field in self.FIELDS:
+            if field not in existing:
+                self.conn.execute(f"ALTER TABLE videos ADD COLUMN {field} TEXT NOT NULL DEFAULT ''")
+        part_columns = ", ".join(f"{field} TEXT NOT NULL DEFAULT ''" for field in self.PART_FIELDS)
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS parts (bvid TEXT NOT NULL, page INTEGER NOT NULL, {part_columns}, PRIMARY KEY (bvid, page))"
+        )
+        # 只追加的下载历史，按自增 id 排列；排序用的列另建索引，分页时不需要排序整张表
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY AUTOINCREMENT, bvid TEXT NOT NULL, "
+            "position INTEGER NOT NULL, title TEXT NOT NULL, file_path TEXT NOT NULL, duration TEXT NOT NULL, downloaded_at TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS history_position ON history (position)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS history_title ON history (title)")
+        self.conn.commit()
+
+    @staticmethod
+    def bvid_of(video: dict) -> str:
+        return video['url'].rstrip("/").split("/")[-1]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+
+    def load(self) -> list:
+        """按列表顺序读取全部视频"""
+        with self._lock:
+            rows = self.conn.execute(f"SELECT {', '.join(self.FIELDS)} FROM videos ORDER BY position").fetchall()
+        return [dict(zip(self.FIELDS, row)) for row in rows]
+
+    def upsert(self, video: dict):
+        """插入或更新单个视频"""
+        self.upsert_many([video])
+
+    def upsert_many(self, videos: list):
+        """批量插入或更新视频，新视频追加到列表末尾，已有视频保持原位置"""
+        placeholders = ", ".join("?" for _ in self.FIELDS)
+        updates = ", ".join(f"{field}=excluded.{field}" for field in self.FIELDS)
+        sql = (
+            f"INSERT INTO videos (bvid, position, {', '.join(self.FIELDS)}) "
+            f"VALUES (?, ?, {placeholders}) "
+            f"ON CONFLICT(bvid) DO UPDATE SET {updates}"
+        )
+        with self._lock, self.conn:
+            # 每批只查询一次末尾位置，已有视频更新时不修改 position（序号留空不影响排序）
+            position = self.conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM videos").fetchone()[0]
+            for offset, video in enumerate(videos):
+                values = ['' if video.get(field) is None else str(video.get(field)) for field in self.FIELDS]
+                self.conn.execute(sql, [self.bvid_of(video), position + offset, *values])
+
+    def load_parts(self, bvid: str) -> list:
+        """按分P顺序读取视频的分P记录，page 为整数"""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT page, {', '.join(self.PART_FIELDS)} FROM parts WHERE bvid = ? ORDER BY page", (bvid,)
+            ).fetchall()
+        return [dict(zip(['page', *self.PART_FIELDS], row)) for row in rows]
+
+    def upsert_parts(self, bvid: str, parts: list):
+        """插入或更新分P记录，已有记录保留原来的下载状态"""
+        fields = [field for field in self.PART_FIELDS if field != 'downloaded']
+        updates = ", ".join(f"{field}=excluded.{field}" for field in fields)
+        sql = (
+            f"INSERT INTO parts (bvid, page, {', '.join(self.PART_FIELDS)}) VALUES (?, ?, {', '.join('?' for _ in self.PART_FIELDS)}) "
+            f"ON CONFLICT(bvid, page) DO UPDATE SET {updates}"
+        )
+        with self._lock, self.conn:
+            for part in parts:
+                values = ['' if part.get(field) is None else str(part.get(field)) for field in self.PART_FIELDS]
+                self.conn.execute(sql, [bvid, int(part['page']), *values])
+
+    def set_part_downloaded(self, bvid: str, page: int, downloaded: bool):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE parts SET downloaded = ? WHERE bvid = ? AND page = ?",
+                (str(bool(downloaded)), bvid, int(page))
+            )
+
+    def add_history(self, video: dict, file_path: str):
+        """追加一条下载成功的记录，position 为视频在列表中的序号（从1开始）"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO history (bvid, position, title, file_path, duration, downloaded_at) "
+                "VALUES (?, COALESCE((SELECT position + 1 FROM videos WHERE bvid = ?), 0), ?, ?, ?, ?)",
+                (self.bvid_of(video), self.bvid_of(video), str(video.get('title') or ''), str(file_path),
+                 str(video.get('duration') or ''), time.strftime("%Y-%m-%d %H:%M:%S"))
+            )
+
+    def history_count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def history(self, offset: int = 0, limit: int = 50, sort: str = "time", descending: bool = True) -> list:
+        """按 sort（见 HISTORY_SORTS）排序后读取下载历史中的一页"""
+        order = f"{self.HISTORY_SORTS[sort]} {'DESC' if descending else 'ASC'}, id {'DESC' if descending else 'ASC'}"
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(self.HISTORY_FIELDS)} FROM history ORDER BY {order} LIMIT ? OFFSET ?",
+                (int(limit), int(offset))
+            ).fetchall()
+        return [dict(zip(self.HISTORY_FIELDS, row)) for row in rows]
+
+    def import_csv(self, csv_path) -> int:
+        """导入旧版本的 video_urls.csv，返回导入的视频数"""
+        with open(csv_path, 'r', encoding='utf-8') as f:
+            videos = list(csv.DictReader(f))
+        self.upsert_many(videos)
+        return len(videos)
+
+    def export_csv(self, csv_path):
+        """导出为与旧版本兼容的 video_urls.csv"""
+        csv_path = Path(csv_path)
+        fd, temp_path = tempfile.mkstemp(dir=csv_path.parent, suffix=".csv.tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(self.FIELDS)
+                with self._lock:
+                    rows = self.conn.execute(f"SELECT {', '.join(self.FIELDS)} FROM videos ORDER BY position").fetchall()
+                writer.writerows(rows)
+            os.replace(temp_path, csv_path)
+        except Exception:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def open_state_store(output_dir) -> StateStore:
+    """打开 output_dir 下的状态数据库，首次打开时自动导入已有的 video_urls.csv"""
+    store = StateStore(Path(output_dir) / "video_urls.db")
+    csv_path = Path(output_dir) / "video_urls.csv"
+    if len(store) == 0 and csv_path.exists():
+        count = store.import_csv(csv_path)
+        print(f"Imported {count} videos from {csv_path} into {store.db_path}")
+    return store
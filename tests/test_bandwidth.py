@@ -0,0 +1,19 @@
+import download_engine
+from download_engine import configure_runtime
+
+
+def test_bandwidth_limit_warns_without_native_backend(monkeypatch, capsys):
+    monkeypatch.setattr(download_engine, "configure_info_cache", lambda config: None)
+    configure_runtime({"backend": "yutto", "bandwidth_limit": 2})
+    assert "only apply to the native backend" in capsys.readouterr().out
+    configure_runtime({"backend": "yutto", "bandwidth_schedule": [{"start": "09:00", "end": "19:00", "limit": 2}]})
+    assert "only apply to the native backend" in capsys.readouterr().out
+    configure_runtime({"backend": "yutto", "bandwidth_limit": 0})
+    assert "Warning" not in capsys.readouterr().out
+
+
+def test_bandwidth_limit_does_not_warn_with_native_backend(monkeypatch, capsys):
+    monkeypatch.setattr(download_engine, "configure_info_cache", lambda config: None)
+    configure_runtime({"backend": "native", "bandwidth_limit": 2})
+    assert "Warning" not in capsys.readouterr().out
+    configure_runtime({"backend": "yutto", "bandwidth_limit": 0})
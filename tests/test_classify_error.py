@@ -0,0 +1,43 @@
+import errno
+import subprocess
+
+import pytest
+
+from download_engine import (
+    ERROR_LOCAL, ERROR_PERMANENT, ERROR_RATE_LIMITED, ERROR_TRANSIENT, DownloadStalled, classify_error
+)
+
+YUTTO = ["yutto", "--sessdata", "x", "-d", "/mnt/nas/archive/429/up", "-q", "127", "https://www.bilibili.com/video/BV1x0001"]
+
+
+def yutto_failed(output):
+    return subprocess.CalledProcessError(1, YUTTO, output=output)
+
+
+@pytest.mark.parametrize("error, expected", [
+    # 速率限制
+    (yutto_failed("ERROR HTTP 412 Precondition Failed"), ERROR_RATE_LIMITED),
+    (yutto_failed("ERROR HTTP Error 429: Too Many Requests"), ERROR_RATE_LIMITED),
+    (yutto_failed("ERROR status code: 412"), ERROR_RATE_LIMITED),
+    (Exception("接口返回错误代码：-412，信息：请求被拦截。"), ERROR_RATE_LIMITED),
+    (Exception('{"code": -799, "message": "请求过于频繁，请稍后再试"}'), ERROR_RATE_LIMITED),
+    (Exception("code: -509"), ERROR_RATE_LIMITED),
+    # 不可恢复
+    (yutto_failed("ERROR 稿件不可见"), ERROR_PERMANENT),
+    (Exception("接口返回错误代码：-404，信息：啥都木有"), ERROR_PERMANENT),
+    # 本地错误
+    (OSError(errno.ENOSPC, "No space left on device"), ERROR_LOCAL),
+    (yutto_failed("ERROR ffmpeg exited with code 1"), ERROR_LOCAL),
+    (yutto_failed("ERROR 合并失败"), ERROR_LOCAL),
+    # 数字出现在文件大小、路径或命令行参数中时不是状态码
+    (yutto_failed("INFO 文件大小 412.50 MiB\nERROR connection reset"), ERROR_TRANSIENT),
+    (yutto_failed("INFO 保存到 /mnt/nas/archive/429/up/视频.mp4\nERROR timed out"), ERROR_TRANSIENT),
+    (yutto_failed("INFO 下载进度 -412.5"), ERROR_TRANSIENT),
+    (yutto_failed(""), ERROR_TRANSIENT),
+    # 只是提到 ffmpeg 的输出行不是本地错误
+    (yutto_failed("INFO 使用 ffmpeg 合并音视频\nERROR connection reset"), ERROR_TRANSIENT),
+    (DownloadStalled(YUTTO, 180), ERROR_TRANSIENT),
+    (Exception("Server disconnected"), ERROR_TRANSIENT),
+])
+def test_classify_error(error, expected):
+    assert classify_error(error) == expected
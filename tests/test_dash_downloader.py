@@ -0,0 +1,189 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from aiohttp import web
+
+import dash_downloader
+from benchmarks.bench_backend import make_app
+from dash_downloader import DashDownloader, Progress, load_partial, select_streams, stream_identity
+
+KIB = 1024
+SIZE = 40 * KIB
+SEGMENT = 8 * KIB
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    sleep = asyncio.sleep
+    monkeypatch.setattr(dash_downloader.asyncio, "sleep", lambda delay: sleep(0))
+
+
+class Server:
+    """bench_backend 的替身服务，记录每个请求的 Range；reject(request) 为真时返回 500，hang(request) 为真时到服务关闭前都不响应"""
+
+    def __init__(self, size: int = SIZE, reject=None, hang=None):
+        self.app = make_app(size, 0)
+        self.requests = []
+        self.reject = reject
+        self.hang = hang
+        self.released = asyncio.Event()
+
+        @web.middleware
+        async def record(request, handler):
+            self.requests.append((request.path, request.headers.get("Range")))
+            if self.reject and self.reject(request):
+                raise web.HTTPInternalServerError()
+            if self.hang and self.hang(request):
+                await self.released.wait()
+            return await handler(request)
+
+        self.app.middlewares.append(record)
+
+    async def __aenter__(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.base = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        return self
+
+    async def __aexit__(self, *exc):
+        # 放行一直没有响应的请求，服务可以立即关闭
+        self.released.set()
+        await self.runner.cleanup()
+
+    def ranges(self, path: str) -> list:
+        """path 的分段请求（不包括探测用的 bytes=0-0），按起始偏移排序"""
+        ranges = []
+        for request_path, header in self.requests:
+            if request_path == path and header and header != "bytes=0-0":
+                start, end = header.removeprefix("bytes=").split("-")
+                ranges.append((int(start), int(end)))
+        return sorted(ranges)
+
+
+def range_start(request) -> int:
+    header = request.headers.get("Range", "")
+    return int(header.removeprefix("bytes=").split("-")[0]) if header and header != "bytes=0-0" else -1
+
+
+def downloader(**options) -> DashDownloader:
+    return DashDownloader(chunk_size=KIB, segment_size=SEGMENT, segment_connections=2, **options)
+
+
+def test_select_streams():
+    playurl = {"dash": {
+        "video": [
+            {"id": 120, "codecid": 7, "bandwidth": 9, "baseUrl": "v120"},
+            {"id": 80, "codecid": 12, "bandwidth": 5, "baseUrl": "v80-hevc"},
+            {"id": 80, "codecid": 7, "bandwidth": 4, "baseUrl": "v80-avc", "backupUrl": ["v80-avc-backup"]},
+        ],
+        "audio": [{"id": 30280, "bandwidth": 320, "baseUrl": "a320"}],
+        "flac": {"audio": {"id": 30251, "bandwidth": 900, "baseUrl": "flac"}},
+    }}
+    # 不超过所选画质的最高画质，同画质优先 avc；音频取码率最高的一路
+    assert select_streams(playurl, 80) == (["v80-avc", "v80-avc-backup"], ["flac"])
+    assert select_streams(playurl, 127)[0] == ["v120"]
+    # 所选画质低于所有视频流时取最低的那些中最好的
+    assert select_streams({"dash": {"video": playurl["dash"]["video"]}}, 16) == (["v120"], [])
+    with pytest.raises(RuntimeError):
+        select_streams({"quality": 80}, 80)
+
+
+def test_ranged_download(tmp_path):
+    path = tmp_path / "video.m4s"
+
+    async def run():
+        async with Server() as server:
+            d = downloader()
+            progress = Progress()
+            try:
+                await d.fetch([f"{server.base}/video/1"], path, progress)
+            finally:
+                await d.close()
+            return server, progress
+
+    server, progress = asyncio.run(run())
+    assert path.stat().st_size == SIZE
+    assert progress.done == progress.total == SIZE
+    assert server.ranges("/video/1") == [(start, start + SEGMENT - 1) for start in range(0, SIZE, SEGMENT)]
+    # 下载完成后记录保留到合并成功为止
+    assert load_partial(Path(f"{path}.json"), stream_identity(f"{server.base}/video/1", SIZE)) == [
+        [start, start + SEGMENT - 1, SEGMENT] for start in range(0, SIZE, SEGMENT)
+    ]
+
+
+def test_cancel_then_resume_requests_only_missing_ranges(tmp_path):
+    path = tmp_path / "video.m4s"
+    hung = 3 * SEGMENT
+
+    async def first_run():
+        # 从 hung 开始的分段一直没有响应，其余分段完成后取消下载
+        async with Server(hang=lambda request: range_start(request) >= hung) as server:
+            d = downloader()
+            progress = Progress()
+            task = asyncio.ensure_future(d.fetch([f"{server.base}/video/1"], path, progress))
+            while progress.done < hung:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await d.close()
+
+    async def second_run():
+        async with Server() as server:
+            d = downloader()
+            progress = Progress()
+            try:
+                await d.fetch([f"{server.base}/video/1"], path, progress)
+            finally:
+                await d.close()
+            return server, progress
+
+    asyncio.run(first_run())
+    server, progress = asyncio.run(second_run())
+    assert progress.resumed == hung
+    assert progress.done == SIZE
+    assert server.ranges("/video/1") == [(start, start + SEGMENT - 1) for start in range(hung, SIZE, SEGMENT)]
+
+
+def test_identity_mismatch_restarts_from_zero(tmp_path):
+    path = tmp_path / "video.m4s"
+    path.write_bytes(b"\0" * SIZE)
+
+    async def run():
+        async with Server() as server:
+            # 记录属于另一个视频流（路径不同），不能续传
+            dash_downloader.save_partial(Path(f"{path}.json"), stream_identity(f"{server.base}/video/2", SIZE),
+                                         [[start, start + SEGMENT - 1, SEGMENT] for start in range(0, SIZE, SEGMENT)])
+            d = downloader()
+            progress = Progress()
+            try:
+                await d.fetch([f"{server.base}/video/1"], path, progress)
+            finally:
+                await d.close()
+            return server, progress
+
+    server, progress = asyncio.run(run())
+    assert progress.resumed == 0
+    assert server.ranges("/video/1") == [(start, start + SEGMENT - 1) for start in range(0, SIZE, SEGMENT)]
+
+
+def test_segment_failure_rotates_to_backup_url(tmp_path):
+    path = tmp_path / "video.m4s"
+
+    async def run():
+        # 主地址能探测到大小，但分段请求都失败
+        async with Server(reject=lambda request: request.path == "/video/1" and range_start(request) >= 0) as server:
+            d = downloader(segment_retries=3)
+            progress = Progress()
+            try:
+                await d.fetch([f"{server.base}/video/1", f"{server.base}/video/2"], path, progress)
+            finally:
+                await d.close()
+            return server, progress
+
+    server, progress = asyncio.run(run())
+    assert progress.done == SIZE
+    assert len(server.ranges("/video/1")) == SIZE // SEGMENT
+    assert server.ranges("/video/2") == [(start, start + SEGMENT - 1) for start in range(0, SIZE, SEGMENT)]
@@ -0,0 +1,53 @@
+import asyncio
+from collections import namedtuple
+
+import disk_space
+from disk_space import DiskSpaceGuard
+
+Usage = namedtuple("Usage", "total used free")
+
+
+def test_second_waiter_admitted_while_first_is_paused(monkeypatch, tmp_path):
+    state = {"free": 0}
+    monkeypatch.setattr(disk_space.shutil, "disk_usage", lambda path: Usage(0, 0, state["free"]))
+    guard = DiskSpaceGuard(min_free=100, check_interval=0.05)
+
+    async def run():
+        first = asyncio.ensure_future(guard.admit(str(tmp_path), 10, "first"))
+        await asyncio.sleep(0.01)
+        assert guard.paused()
+        # 空间恢复后，第二个下载在第一次检查时就能通过，第一个仍在等待下一次检查
+        state["free"] = 1000
+        second = await guard.admit(str(tmp_path), 10, "second")
+        assert not guard.paused()
+        return await first, second
+
+    first, second = asyncio.run(run())
+    assert first[1] == 10 and second[1] == 10
+    assert guard.free(str(tmp_path)) == 980
+    guard.release(first)
+    guard.release(second)
+    assert guard.free(str(tmp_path)) == 1000
+
+
+def test_oversized_estimate_is_admitted_on_a_healthy_disk(monkeypatch, tmp_path):
+    gib = 1024 ** 3
+    monkeypatch.setattr(disk_space.shutil, "disk_usage", lambda path: Usage(0, 0, 20 * gib))
+    guard = DiskSpaceGuard(min_free=5 * gib, check_interval=0.05)
+    # 3 小时的 8K 视频估算为 50 GiB，磁盘上没有其他下载时不应该等待
+    size = disk_space.estimate_size(3 * 3600, 127)
+    assert size > 20 * gib
+
+    async def run():
+        first = await asyncio.wait_for(guard.admit(str(tmp_path), size, "long video"), 1)
+        assert not guard.paused()
+        # 已有预留时，后面的下载仍按估算等待
+        second = asyncio.ensure_future(guard.admit(str(tmp_path), gib, "next video"))
+        await asyncio.sleep(0.1)
+        assert guard.paused() and not second.done()
+        guard.release(first)
+        return first, await asyncio.wait_for(second, 1)
+
+    first, second = asyncio.run(run())
+    assert first[1] == 15 * gib
+    assert second[1] == gib
@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+from download_engine import part_records, repair_filename
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("普通标题", "普通标题"),
+    ("A/B: C?", "A／B： C？"),
+    ('<a>|"b"*\\c', '＜a＞｜＂b＂＊＼c'),
+    ("多个   空格\t和\n换行", "多个 空格 和 换行"),
+    ("Tom &amp; Jerry", "Tom & Jerry"),
+    ("  ", "未命名文件"),
+])
+def test_repair_filename(name, expected):
+    assert repair_filename(name) == expected
+
+
+def test_part_records_stay_inside_output_dir(tmp_path):
+    video_info = {"title": "../合集: 第1/2季", "pages": [{"page": 1, "part": "P1/上"}, {"page": 2, "part": "P2?"}]}
+    records = part_records(str(tmp_path), video_info)
+    assert [os.path.relpath(r["file_path"], tmp_path) for r in records] == [
+        os.path.join("..／合集： 第1／2季", "P1／上.mp4"),
+        os.path.join("..／合集： 第1／2季", "P2？.mp4"),
+    ]
+    # 记录中保留原始的分P名称，只有路径经过清理
+    assert records[0]["part"] == "P1/上"
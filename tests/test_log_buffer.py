@@ -0,0 +1,58 @@
+import log_buffer
+from log_buffer import LogBuffer, _reverse_lines
+
+
+def spilled_buffer(tmp_path, count=3000):
+    """内存只保留 10 行，其余写入磁盘并轮转成多个文件"""
+    log = LogBuffer(max_lines=10, spill_path=tmp_path / "webui.log", spill_size=0.02, spill_backups=3)
+    for n in range(count):
+        log.append(f"第 {n} 行", "video-a" if n % 3 == 0 else "video-b")
+    return log
+
+
+def all_spilled(log, job=None):
+    """按时间顺序读取所有磁盘日志，用来对照"""
+    files = [log.spill_path.with_name(f"{log.spill_path.name}.{n}") for n in range(log._spill.backupCount, 0, -1)]
+    lines = []
+    for path in files + [log.spill_path]:
+        if path.exists():
+            for record in path.read_text(encoding="utf-8").splitlines():
+                record_job, _, line = record.partition("\t")
+                if job is None or record_job == job:
+                    lines.append(line)
+    return lines
+
+
+def test_page_matches_the_spilled_lines(tmp_path):
+    log = spilled_buffer(tmp_path)
+    for job in (None, "video-a"):
+        lines = all_spilled(log, job)
+        assert len(lines) > 400
+        for page in (1, 2, 3):
+            end = len(lines) - (page - 1) * 200
+            assert log.page(page, 200, job) == lines[end - 200:end]
+        assert log.page(1000, 200, job) == []
+    log.close()
+
+
+def test_page_reads_only_what_it_needs(tmp_path, monkeypatch):
+    log = spilled_buffer(tmp_path)
+    read = []
+    reverse_lines = log_buffer._reverse_lines
+
+    def counting(path, *args):
+        for line in reverse_lines(path, *args):
+            read.append(line)
+            yield line
+
+    monkeypatch.setattr(log_buffer, "_reverse_lines", counting)
+    assert len(log.page(1, 20)) == 20
+    assert len(read) == 20
+    log.close()
+
+
+def test_reverse_lines_across_blocks(tmp_path):
+    path = tmp_path / "log"
+    lines = [f"行 {n} " + "x" * (n % 17) for n in range(500)]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    assert list(_reverse_lines(path, block_size=7)) == lines[::-1]
@@ -0,0 +1,33 @@
+import json
+import threading
+
+from metadata_cache import MetadataCache
+
+
+def test_put_does_not_write_until_flushed(tmp_path):
+    path = tmp_path / "cache.json"
+    cache = MetadataCache(path, flush_interval=0)
+    assert cache.put("BV1x0001", {"title": "a"})
+    # put() 只更新内存，由调用方决定在哪里落盘
+    assert not path.exists()
+    cache.flush()
+    assert json.loads(path.read_text(encoding="utf-8"))["BV1x0001"][1] == {"title": "a"}
+    assert MetadataCache(path).get("BV1x0001") == {"title": "a"}
+
+
+def test_concurrent_flushes_keep_the_latest_entries(tmp_path):
+    path = tmp_path / "cache.json"
+    cache = MetadataCache(path, flush_interval=0)
+
+    def writer(n):
+        for i in range(50):
+            cache.put(f"BV{n}x{i}", {"n": i})
+            cache.flush()
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cache.flush()
+    assert len(json.loads(path.read_text(encoding="utf-8"))) == 200
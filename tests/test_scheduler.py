@@ -0,0 +1,40 @@
+import asyncio
+
+from download_engine import DownloadScheduler
+
+
+def test_parts_of_one_video_do_not_starve_other_uploaders(monkeypatch):
+    scheduler = DownloadScheduler({"prefetch": 2})
+
+    async def resolve(item):
+        return {"pages": [{}] * item["video"]["parts"]}
+
+    def expand_parts(item):
+        return [dict(item, part={"page": page}) for page in range(1, item["video"]["parts"] + 1)]
+
+    monkeypatch.setattr(scheduler, "_resolve", resolve)
+    monkeypatch.setattr(scheduler, "_expand_parts", expand_parts)
+
+    def job(uid, parts):
+        return {"uid": uid, "up_name": uid, "video_urls": [
+            {"url": f"https://www.bilibili.com/video/{uid}{n}", "title": "", "downloaded": "False", "parts": parts}
+            for n in range(2)
+        ]}
+
+    async def run():
+        scheduler.add_uploader(job("A", 20))
+        scheduler.add_uploader(job("B", 1))
+        scheduler.close()
+        prefetch = asyncio.ensure_future(scheduler._run_prefetch())
+        order = []
+        while len(order) < 4:
+            item = await scheduler.ready.get()
+            if item.pop("prefetched", False):
+                scheduler.lookahead.release()
+            order.append(item["job"]["uid"])
+            await asyncio.sleep(0)
+        prefetch.cancel()
+        return order
+
+    # A 的第一个视频有 20 个分P，B 的视频不需要等这些分P都下载完
+    assert asyncio.run(run()) == ["A", "B", "A", "B"]
@@ -0,0 +1,51 @@
+import threading
+import time
+
+from state_store import StateStore
+
+
+def video(n, **fields):
+    return dict({"url": f"https://www.bilibili.com/video/BV{n:08d}", "title": f"t{n}", "downloaded": "False"}, **fields)
+
+
+def test_upsert_keeps_order_and_position(tmp_path):
+    store = StateStore(tmp_path / "video_urls.db")
+    store.upsert_many([video(1), video(2)])
+    store.upsert_many([video(3), video(1, downloaded="True")])
+    assert [(v["title"], v["downloaded"]) for v in store.load()] == [
+        ("t1", "True"), ("t2", "False"), ("t3", "False")
+    ]
+    store.close()
+
+
+def test_bulk_upsert_is_not_quadratic(tmp_path):
+    store = StateStore(tmp_path / "video_urls.db")
+    start = time.monotonic()
+    for n in range(5000):
+        store.upsert(video(n))
+    store.upsert_many([video(n, downloaded="True") for n in range(20000)])
+    assert time.monotonic() - start < 10
+    assert len(store) == 20000
+    store.close()
+
+
+def test_store_can_be_used_from_other_threads(tmp_path):
+    store = StateStore(tmp_path / "video_urls.db")
+    errors = []
+
+    def worker(offset):
+        try:
+            for n in range(offset, offset + 50):
+                store.upsert(video(n))
+                store.load_parts(StateStore.bvid_of(video(n)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i * 50,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(store) == 200
+    store.close()
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import download_engine
+from download_engine import VideoListIncomplete, fetch_new_videos, fetch_video_list
+
+
+def fake_user(pages, failing=()):
+    """每页 2 个视频的假视频列表，failing 中的页码总是请求失败"""
+
+    class User:
+        def __init__(self, uid):
+            pass
+
+        async def get_videos(self, pn):
+            if pn in failing:
+                raise ConnectionError(f"page {pn} failed")
+            vlist = [{"bvid": f"BV{n}", "title": f"v{n}", "created": 0, "length": "1:00"}
+                     for n in ((pn - 1) * 2, (pn - 1) * 2 + 1)] if pn <= pages else []
+            return {"list": {"vlist": vlist}, "page": {"count": pages * 2, "ps": 2}}
+
+    return User
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    sleep = asyncio.sleep
+    monkeypatch.setattr(download_engine.asyncio, "sleep", lambda delay: sleep(0))
+
+
+def test_fetch_video_list(monkeypatch):
+    monkeypatch.setattr(download_engine.user, "User", fake_user(3))
+    videos = asyncio.run(fetch_video_list(1))
+    assert [v["url"].split("/")[-1] for v in videos] == [f"BV{n}" for n in range(6)]
+
+
+def test_fetch_video_list_raises_when_a_page_keeps_failing(monkeypatch):
+    monkeypatch.setattr(download_engine.user, "User", fake_user(3, failing={2}))
+    with pytest.raises(VideoListIncomplete, match="pages 2"):
+        asyncio.run(fetch_video_list(1))
+
+
+def test_fetch_new_videos_keeps_known_bvids_when_a_page_fails(monkeypatch):
+    known = {"BV4", "BV5"}
+    monkeypatch.setattr(download_engine.user, "User", fake_user(3, failing={2}))
+    with pytest.raises(ConnectionError):
+        asyncio.run(fetch_new_videos(1, known))
+    assert known == {"BV4", "BV5"}
+    monkeypatch.setattr(download_engine.user, "User", fake_user(3))
+    assert [v["url"].split("/")[-1] for v in asyncio.run(fetch_new_videos(1, known))] == ["BV0", "BV1", "BV2", "BV3"]
+
+
+def test_prepare_uploader_closes_the_store_when_listing_fails(monkeypatch, tmp_path):
+    closed = []
+
+    class Store:
+        def close(self):
+            closed.append(True)
+
+    async def get_user_name(uid):
+        return "up"
+
+    async def get_user_video_urls(*args, **kwargs):
+        raise download_engine.VideoListIncomplete("page 2 failed")
+
+    monkeypatch.setattr(download_engine, "get_user_name", get_user_name)
+    monkeypatch.setattr(download_engine, "open_state_store", lambda output_dir: Store())
+    monkeypatch.setattr(download_engine, "get_user_video_urls", get_user_video_urls)
+    with pytest.raises(VideoListIncomplete):
+        asyncio.run(download_engine.prepare_uploader({"uid": 1}, {"output_dir": str(tmp_path)}))
+    assert closed == [True]
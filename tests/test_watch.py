@@ -0,0 +1,46 @@
+import asyncio
+
+import download_engine
+from download_engine import DownloadScheduler, watch_uploaders
+
+
+class FakeStore:
+    def export_csv(self, path):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_uploader_that_failed_to_prepare_is_retried(monkeypatch, tmp_path):
+    calls = []
+    polled = []
+
+    async def prepare_uploader(uploader, arg_dict, bus, interactive):
+        calls.append(uploader["uid"])
+        if uploader["uid"] == 2 and calls.count(2) == 1:
+            raise ConnectionError("list unavailable")
+        return {"uid": uploader["uid"], "up_name": str(uploader["uid"]), "output_dir": str(tmp_path),
+                "video_urls": [], "store": FakeStore()}
+
+    async def poll_uploader(job):
+        polled.append(job["uid"])
+        return []
+
+    monkeypatch.setattr(download_engine, "prepare_uploader", prepare_uploader)
+    monkeypatch.setattr(download_engine, "poll_uploader", poll_uploader)
+    monkeypatch.setattr(download_engine.random, "uniform", lambda a, b: 0)
+    monkeypatch.setattr(download_engine, "rate_limit_report", lambda: "")
+    scheduler = DownloadScheduler({})
+
+    async def run():
+        watch = asyncio.ensure_future(watch_uploaders([{"uid": 1}, {"uid": 2}], {"output_dir": str(tmp_path)}, scheduler=scheduler))
+        while len(polled) < 3:
+            await asyncio.sleep(0.01)
+        watch.cancel()
+        await asyncio.gather(watch, return_exceptions=True)
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+    # 第一次检查时重试 UID 2，之后 UID 2 和 UID 1 一样检查新投稿
+    assert calls[:3] == [1, 2, 2]
+    assert polled[:3] == [1, 1, 2]
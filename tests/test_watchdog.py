@@ -0,0 +1,40 @@
+import asyncio
+import sys
+
+import pytest
+
+from download_engine import DownloadStalled, probe_download_bytes, run_command
+
+
+def test_probe_counts_only_this_videos_files(tmp_path):
+    (tmp_path / "视频A_video.m4s").write_bytes(b"x" * 100)
+    (tmp_path / "视频A_audio.m4s").write_bytes(b"x" * 10)
+    (tmp_path / "视频B_video.m4s").write_bytes(b"x" * 1000)
+    (tmp_path / "视频B.mp4").write_bytes(b"x" * 1000)
+    assert probe_download_bytes([str(tmp_path / "视频A.mp4")]) == 110
+
+    (tmp_path / "视频A.mp4").write_bytes(b"x" * 5)
+    assert probe_download_bytes([str(tmp_path / "视频A.mp4")]) == 115
+
+
+def test_stall_detected_while_sibling_downloads_progress(tmp_path):
+    sibling = tmp_path / "其他视频_video.m4s"
+
+    async def grow_sibling():
+        while True:
+            with open(sibling, "ab") as f:
+                f.write(b"x" * 1024)
+            await asyncio.sleep(0.1)
+
+    async def run():
+        writer = asyncio.ensure_future(grow_sibling())
+        try:
+            await run_command(
+                [sys.executable, "-c", "import time; time.sleep(30)"],
+                stall_timeout=1, progress_paths=[str(tmp_path / "卡住的视频.mp4")]
+            )
+        finally:
+            writer.cancel()
+
+    with pytest.raises(DownloadStalled):
+        asyncio.run(asyncio.wait_for(run(), 10))
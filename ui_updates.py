@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+from log_buffer import LogBuffer
+
+DEFAULT_UI_FPS = 4
+
+
+class UpdateCoalescer:
+    """合并 webui 的增量更新，按帧率限制发送给页面的频率。
+
+    产出方每次只给出变化的字段；"log" 字段是追加到日志 log（LogBuffer）末尾的文本，"job" 为其所属任务。
+    每帧只发送与上次发送相比发生变化的字段，日志在有新内容时才重新发送。
+    """
+
+    def __init__(self, fps: float = DEFAULT_UI_FPS, log: LogBuffer = None):
+        self.interval = 1 / fps if fps and fps > 0 else 0
+        self.log = log or LogBuffer()
+        self.state = {}
+        self._pending = {}
+        self._log_changed = False
+
+    def push(self, delta: dict):
+        for key, value in delta.items():
+            if key == "log":
+                if value:
+                    self.log.append(value, delta.get("job", ""))
+                    self._log_changed = True
+            elif key == "job":
+                continue
+            elif self.state.get(key) != value:
+                self.state[key] = value
+                self._pending[key] = value
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._pending) or self._log_changed
+
+    def flush(self) -> dict:
+        """返回自上次 flush 以来变化的字段（日志为完整文本）"""
+        changed, self._pending = self._pending, {}
+        if self._log_changed:
+            changed["log"] = self.log.text()
+            self._log_changed = False
+        return changed
+
+    async def stream(self, updates):
+        """消费增量更新的异步生成器 updates，每 1/fps 秒最多产出一次合并后的变化字段。
+
+        结束或被关闭（aclose）时取消读取 updates 的任务并等待其结束，再关闭 updates。
+        """
+        queue = asyncio.Queue()
+
+        async def pump():
+            try:
+                async for delta in updates:
+                    queue.put_nowait(delta)
+            finally:
+                queue.put_nowait(None)
+
+        task = asyncio.ensure_future(pump())
+        last_sent = 0.0
+        try:
+            while True:
+                wait = last_sent + self.interval - time.monotonic()
+                if self.dirty and wait <= 0:
+                    last_sent = time.monotonic()
+                    yield self.flush()
+                    continue
+                try:
+                    # 有待发送的变化时最多等到下一帧，否则一直等到有新的更新
+                    delta = await asyncio.wait_for(queue.get(), wait if self.dirty else None)
+                except asyncio.TimeoutError:
+                    continue
+                if delta is None:
+                    break
+                self.push(delta)
+            if self.dirty:
+                yield self.flush()
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+        finally:
+            if not task.done():
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await updates.aclose()
@@ -3,26 +3,17 @@ import asyncio
 import subprocess
 import os
 import pandas as pd
-from bilibili_upper_download import read_toml_config, get_user_name, get_user_video_urls, get_video_info, download_video, save_to_csv, extract_and_convert_time, get_file_names
+from download_engine import DownloadEngine, throughput_text, read_toml_config
+from events import describe, JobEvent, UploaderListed, JobStarted, JobBytes, JobLog, JobMerged, RunFinished
+from ui_updates import UpdateCoalescer, DEFAULT_UI_FPS
+from log_buffer import webui_log
+from state_store import StateStore
 from pathlib import Path
 import platform
 import time
 import json
-import tempfile
-import re
+import math
 
-import psutil
-
-def kill_process_and_children(process):
-    """终止进程及其所有子进程"""
-    try:
-        parent = psutil.Process(process.pid)
-        children = parent.children(recursive=True)  # 获取所有子进程，包括 yutto 和 tee
-        for child in children:
-            child.kill()  # 发送 SIGKILL
-        parent.kill()  # 终止 shell
-    except psutil.NoSuchProcess:
-        pass  # 进程可能已结束
 # Define the config file path
 CONFIG_FILE = Path(__file__).parent / "config.json"
 
@@ -31,7 +22,8 @@ def load_config():
     default_config = {
         "uid": "",
         "output_dir": "~/Downloads",
-        "video_quality": "127 (8K)"
+        "video_quality": "127 (8K)",
+        "state_db": ""
     }
     if CONFIG_FILE.exists():
         try:
@@ -46,12 +38,14 @@ def load_config():
             return default_config
     return default_config
 
-def save_config(uid, output_dir, video_quality):
+def save_config(uid, output_dir, video_quality, state_db=None):
+    """保存页面中填写的设置；state_db 为最近一次下载的状态库路径，用于重启后显示下载历史"""
     print(f"Start saving current configuration to the JSON file: {CONFIG_FILE}.")
     config = {
         "uid": uid,
         "output_dir": output_dir,
-        "video_quality": video_quality
+        "video_quality": video_quality,
+        "state_db": state_db if state_db is not None else load_config()["state_db"]
     }
     try:
         with open(CONFIG_FILE, "w", encoding="utf-8") as f:
@@ -93,7 +87,18 @@ TEXTS = {
         "download_speed_label": "Download Speed",
         "download_size_label": "Download size",
         "file_size_label": "File size",
-        "abort_button": "Abort Current Attempt"
+        "abort_button": "Abort Current Attempt",
+        "earlier_log_label": "Earlier Log",
+        "log_page_label": "Page (1 = most recent)",
+        "log_video_label": "Video (optional)",
+        "log_video_placeholder": "Only show the log of this video",
+        "load_log_button": "Load",
+        "no_earlier_log": "No earlier log.\n",
+        "history_page_label": "Page",
+        "history_sort_label": "Sort by",
+        "history_sort_choices": [("Download time", "time"), ("Index", "position"), ("Video name", "title")],
+        "history_desc_label": "Descending",
+        "history_info": "{total} videos, page {page}/{pages}"
     },
     "zh": {
         "title": "Bilibili视频下载器",
@@ -127,12 +132,63 @@ TEXTS = {
         "download_speed_label": "下载速度",
         "download_size_label": "已下载大小",
         "file_size_label": "文件大小",
-        "abort_button": "中止当前尝试"
+        "abort_button": "中止当前尝试",
+        "earlier_log_label": "更早的日志",
+        "log_page_label": "页码（1 为最近一页）",
+        "log_video_label": "视频（可选）",
+        "log_video_placeholder": "只显示该视频的日志",
+        "load_log_button": "加载",
+        "no_earlier_log": "没有更早的日志。\n",
+        "history_page_label": "页码",
+        "history_sort_label": "排序",
+        "history_sort_choices": [("下载时间", "time"), ("序号", "position"), ("视频名称", "title")],
+        "history_desc_label": "倒序",
+        "history_info": "共 {total} 个视频，第 {page}/{pages} 页"
     }
 }
 
+# 下载历史中当前显示的一页，完整的历史保存在状态库中
 download_df = pd.DataFrame(columns=["Index", "Video Name", "Path", "Duration"])
-abort_current = False
+HISTORY_PAGE_SIZE = 50
+# 正在运行的下载引擎，用于从其他线程中止当前的下载尝试
+current_engine = {}
+
+def read_basic_config():
+    """config.toml 的 [basic]，读取失败时返回空字典（错误由 run_download 显示）"""
+    try:
+        return read_toml_config()["basic"]
+    except Exception:
+        return {}
+
+def dataframe_log():
+    """本页面的日志：内存中只保留最近的若干行，更早的写入磁盘（默认 logs/webui_dataframe.log）"""
+    return webui_log("webui_dataframe", read_basic_config())
+
+def load_history(page=1, sort="time", descending=True, lang="zh"):
+    """从最近一次下载的状态库中分页读取下载历史，返回 (表格, 页码, 页数说明)"""
+    global download_df
+    rows, total = [], 0
+    state_db = load_config()["state_db"]
+    if state_db and Path(state_db).exists():
+        # 每次读取单独打开连接，不与下载中使用的连接共用线程
+        store = StateStore(state_db)
+        try:
+            total = store.history_count()
+            pages = max(1, math.ceil(total / HISTORY_PAGE_SIZE))
+            page = min(max(1, int(page or 1)), pages)
+            rows = store.history((page - 1) * HISTORY_PAGE_SIZE, HISTORY_PAGE_SIZE, sort or "time", descending)
+        finally:
+            store.close()
+    pages = max(1, math.ceil(total / HISTORY_PAGE_SIZE))
+    page = min(max(1, int(page or 1)), pages)
+    download_df = pd.DataFrame({
+        "Index": [row["position"] for row in rows],
+        "Video Name": [row["title"] for row in rows],
+        "Path": [row["file_path"] for row in rows],
+        "Duration": [row["duration"] for row in rows]
+    }, columns=["Index", "Video Name", "Path", "Duration"])
+    info = TEXTS[lang]["history_info"].format(total=total, page=page, pages=pages)
+    return download_df[["Index", "Video Name", "Duration"]], page, info
 
 def format_time(seconds):
     """将秒数转换为 hh:mm:ss 格式"""
@@ -141,359 +197,75 @@ def format_time(seconds):
     secs = int(seconds % 60)
     return f"{hours:02d}:{minutes:02d}:{secs:02d}"
 
-def parse_download_speed(line):
-    # print()
-    # print('*'*20)
-    # print(f"Line: {line}")
-    """解析下载速度，基于第二个 '/' 前面的数字和单位"""
-    parts = line.split('/')
-    file_size = 0
-    download_size = 0
-    speed_num = 0
-    if len(parts) >= 3:  # 确保有至少两个 '/'（如 "18.82 GiB/ 24.19 GiB 766.48 KiB/s"）
-        download_size_part = parts[0].strip().split()  # 取第一个 '/' 前面的部分，例如 "18.82 GiB"
-        if len(re.findall(r'\d+\.?\d*',parts[0])) > 0:
-            download_size=re.findall(r'\d+\.?\d*', parts[0])[-1]
-            download_size = str(download_size) +' '+ download_size_part[-1] 
-        else:
-            download_size = '0 KiB'   
-        
-        file_size_part = parts[1].strip().split()  # 取第二个 '/' 前面的部分，例如 "24.19 GiB" 
-        if len(re.findall(r'\d+\.?\d*',file_size_part[0])) > 0:
-            file_size=re.findall(r'\d+\.?\d*', file_size_part[0])[-1]
-            file_size = str(file_size) +' '+ file_size_part[1] 
-        else:
-            file_size = '0 KiB'   
-        
-        speed_part = parts[-2].strip()  # 取第二个 '/' 后面的部分，例如 "766.48 KiB/s"
-        speed_components = speed_part.split()  # 按空格分割，例如 ["766.48", "KiB/s"]
-        if len(speed_components) >= 2:
-            # print(f"Speed components: {speed_components}")
-            # print(f"speed_components[-2]: {speed_components[-2]}")
-            if len(re.findall(r'\d+\.?\d*', speed_components[-2])) > 0:
-                speed_num=re.findall(r'\d+\.?\d*', speed_components[-2])[-1]
-            else:
-                speed_num = 0
-            # print(f"Speed: {speed_num} {speed_components[-1]}/s")
-            # print('#'*20)
-            # print()
-            return download_size, file_size ,f"{speed_num} {speed_components[-1]}/s" 
-    return "0 KiB","0 KiB","0 KiB/s" 
+def format_bytes(size):
+    """将字节数转换为 "18.82 GiB" 格式"""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.2f} {unit}"
+        size /= 1024
 
 
 async def run_download(uid, output_dir, video_quality, sessdata, bili_jct, buvid3):
-    global download_df, abort_current
+    """通过下载引擎下载UP主的所有视频，把引擎发布的事件转换为变化的字段；"log" 为追加到日志末尾的文本，
+    "history" 变化表示下载历史有新记录"""
     quality_value = video_quality.split(" ")[0]
     
-    arg_dict = {
-        "uid": int(uid),
-        "output_dir": str(output_dir if output_dir else "~/Downloads"),
-        "video_quality": str(quality_value),
-        "SESSDATA": sessdata,
-        "BILI_JCT": bili_jct,
-        "BUVID3": buvid3,
-    }
-
     try:
-        toml_args = read_toml_config()
-        for key in arg_dict:
-            if key in toml_args["basic"] and toml_args["basic"][key] and (arg_dict[key] is None or arg_dict[key] == ""):
-                arg_dict[key] = toml_args["basic"][key]
+        engine = DownloadEngine.from_config({
+            "output_dir": output_dir,
+            "video_quality": quality_value,
+            "SESSDATA": sessdata,
+            "BILI_JCT": bili_jct,
+            "BUVID3": buvid3,
+        })
     except Exception as e:
-        yield {"log": f"Error loading TOML config: {e}\n", "up_name": "", "download_progress": "", "current_video": "", "duration": "", "download_time": "00:00:00", "download_speed": "0 KiB/s","download_size": "0 KiB", "file_size": "0 KiB", "progress": 0}
-        return
-
-    up_name = await get_user_name(int(uid))
-    yield {
-        "log": f"Fetching video list for UID: {uid} (UP: {up_name})\n",
-        "up_name": up_name,
-        "download_progress": "",
-        "current_video": "",
-        "duration": "",
-        "download_time": "00:00:00",
-        "download_speed": "0 KiB/s",
-        "download_size": "0 KiB",
-        "file_size": "0 KiB",
-        "progress": 0
-    }
-
-    output_dir = os.path.expanduser(os.path.join(arg_dict["output_dir"], up_name))
-    os.makedirs(output_dir, exist_ok=True)
-    csv_path = Path(output_dir) / "video_urls.csv"
-    
-    video_urls = await get_user_video_urls(int(uid), output_dir)
-    total_videos = len(video_urls)
-
-    yield {
-        "log": f"Fetching video list for UID: {uid} (UP: {up_name})\nFound {total_videos} videos to download\n",
-        "up_name": up_name,
-        "download_progress": f"0/{total_videos}",
-        "current_video": "",
-        "duration": "",
-        "download_time": "00:00:00",
-        "download_speed": "0 KiB/s",
-        "download_size": "0 KiB",
-        "file_size": "0 KiB",
-        "progress": 0
-    }
-
-    if not video_urls:
-        yield {
-            "log": "No videos found for this user.\n",
-            "up_name": up_name,
-            "download_progress": "",
-            "current_video": "",
-            "duration": "",
-            "download_time": "00:00:00",
-            "download_speed": "0 KiB/s",
-            "download_size": "0 KiB",
-            "file_size": "0 KiB",
-            "progress": 0
-        }
+        yield {"log": f"Error loading TOML config: {e}\n"}
         return
 
-    log_file = os.path.join(os.path.dirname(__file__), "download_errors.log")
-    for i, video in enumerate(video_urls, 1):
-        url = video['url']
-        if video['downloaded'] == 'True':
-            print(f"Skipping already downloaded video {i}/{total_videos}: {video['title']}")
-            continue
-
-        print(f"Downloading video {i}/{len(video_urls)}")
-        bvid = url.split("/")[-1]
-        video_info = await get_video_info(bvid, arg_dict["SESSDATA"], arg_dict["BILI_JCT"], arg_dict["BUVID3"])
-        
-        if len(video_info['pages']) < 1:
-            print(f"Skipping disappeared video {i}/{total_videos}: {video['url']}")
-            continue
-
-        video['title'] = video_info['title']
-        video['duration'] = extract_and_convert_time(str(video_info['duration']))
-        video['info'] = str(video_info)
-        save_to_csv(video_urls, csv_path)
-        print("updated video info to csv")
-
-        current_video = video_info["title"]
-        duration = f"{video['duration']}"
-        progress = round((i / total_videos) * 100, 2)
-
-        yield {
-            "log": f"Starting download {i}/{total_videos}: {current_video}\n",
-            "up_name": up_name,
-            "download_progress": f"{i}/{total_videos}",
-            "current_video": current_video,
-            "duration": duration,
-            "download_time": "00:00:00",
-            "download_speed": "0 KiB/s",
-            "download_size": "0 KiB",
-            "file_size": "0 KiB",
-            "progress": progress
-        }
-
-        max_attempts = 5
-        success = False
-        is_completed = False
-        attempt = 0
-
-        while attempt < max_attempts and not success:
-            attempt += 1
-            abort_current = False
-            start_time = time.time()
-            process = None
-            logcontent = f"Attempt {attempt}/{max_attempts} downloading {current_video}\n"
-            
-            # 创建临时文件用于捕获输出
-            with tempfile.NamedTemporaryFile(mode='w+', delete=False) as temp_file:
-                temp_file_path = temp_file.name
-
-                try:
-                    if len(video_info['pages']) > 1:
-                        command = [
-                            "yutto",
-                            "--sessdata", str(arg_dict["SESSDATA"]),
-                            "-d", str(output_dir),
-                            "-q", str(arg_dict["video_quality"]),
-                            "-b",
-                            "-p", "1~-1",
-                            "--download-interval", "2",
-                            "--save-cover",
-                            url
-                        ]
-                    else:
-                        command = [
-                            "yutto",
-                            "--sessdata", str(arg_dict["SESSDATA"]),
-                            "-d", str(output_dir),
-                            "-q", str(arg_dict["video_quality"]),
-                            "--download-interval", "2",
-                            "--save-cover",
-                            url
-                        ]
-                    
-                    # 使用 tee 将输出同时显示在终端并写入临时文件
-                    tee_command = command + ["|", "tee", temp_file_path] if platform.system() != "Windows" else command
-                    process = subprocess.Popen(
-                        " ".join(tee_command) if platform.system() != "Windows" else command,
-                        shell=True  # 需要 shell=True 来支持 tee
+    # 同时下载多个视频时，速度以外的字段显示最近开始的那个
+    current = {"key": None, "start": time.time()}
+    merged = 0
+    current_engine["engine"] = engine
+    events = engine.events([{"uid": int(uid)}])
+    try:
+        async for event in events:
+            message = describe(event)
+            delta = {"log": message + "\n"} if message else {}
+            if isinstance(event, JobEvent):
+                delta["job"] = event.title
+            if isinstance(event, UploaderListed):
+                # 下载历史显示这个UP主的状态库中的记录
+                save_config(uid, output_dir, video_quality, str(Path(event.output_dir) / "video_urls.db"))
+                delta.update(up_name=event.up_name, download_progress=f"0/{event.total}")
+            elif isinstance(event, JobStarted):
+                current.update(key=(event.bvid, event.part), start=time.time())
+                delta.update(
+                    current_video=event.title, duration=event.duration,
+                    download_progress=f"{event.index}/{event.total}",
+                    progress=round(event.index / event.total * 100, 2) if event.total else 0,
+                    download_time="00:00:00", download_size="0 KiB", file_size="0 KiB",
+                )
+            elif isinstance(event, JobBytes):
+                # 显示所有下载的实际总速度（及当前的带宽上限）
+                delta["download_speed"] = throughput_text()
+                if (event.bvid, event.part) == current["key"]:
+                    delta.update(
+                        download_time=format_time(time.time() - current["start"]),
+                        download_size=format_bytes(event.downloaded), file_size=format_bytes(event.size),
                     )
-                    
-                    download_speed = "0 KiB/s"
-                    download_size= "0 KiB"
-                    file_size= "0 KiB"
-                    
-                    # 读取临时文件并解析速度
-                    last_pos = 0
-                    while process.poll() is None:
-                        if abort_current:
-                            # process.terminate()
-                            kill_process_and_children(process)
-                            raise Exception("Download aborted by user")
-                        elapsed_time = time.time() - start_time
-                        
-                        with open(temp_file_path, 'r', encoding='utf-8', errors='replace') as f:
-                            f.seek(last_pos)
-                            new_lines = f.readlines()
-                            last_pos = f.tell()
-                            
-                            for line in new_lines:
-                                if 'INFO' in line.upper() or 'ERROR' in line.upper() or 'WARN' in line.upper():
-                                    if '合并' in line:
-                                        print(line)
-                                    logcontent += line 
-                                    yield {
-                                        "log": logcontent,
-                                        "up_name": up_name,
-                                        "download_progress": f"{i}/{total_videos}",
-                                        "current_video": current_video,
-                                        "duration": duration,
-                                        "download_time": format_time(elapsed_time),
-
-                                        "download_speed": download_speed,
-                                        "download_size": download_size,
-                                        "file_size": file_size,
-                                        "progress": progress
-                                    }
-                                if '/' in line:
-                                    download_size, file_size ,download_speed = parse_download_speed(line)
-                                    yield {
-                                        "log": logcontent,
-                                        "up_name": up_name,
-                                        "download_progress": f"{i}/{total_videos}",
-                                        "current_video": current_video,
-                                        "duration": duration,
-                                        "download_time": format_time(elapsed_time),
-
-                                        "download_speed": download_speed,
-                                        "download_size": download_size,
-                                        "file_size": file_size,
-                                        "progress": progress
-                                    }
-                        
-                        yield {
-                            "log": logcontent,
-                            "up_name": up_name,
-                            "download_progress": f"{i}/{total_videos}",
-                            "current_video": current_video,
-                            "duration": duration,
-                            "download_time": format_time(elapsed_time),
-                            "download_speed": download_speed,
-                            "download_size": download_size,
-                            "file_size": file_size,
-                            "progress": progress
-                        }
-                        await asyncio.sleep(0.1)
-                    
-                    # 进程结束后，检查是否包含“合并完成”
-                    with open(temp_file_path, 'r', encoding='utf-8', errors='replace') as f:
-                        full_output = f.read()
-                        if "合并完成" in full_output:
-                            is_completed = True
-
-                    if is_completed:
-                    # if process.returncode == 0:
-                        video_path = get_file_names(output_dir, video_info)
-                        success = True
-                        
-                        new_row = pd.DataFrame({
-                            "Index": [i],
-                            "Video Name": [current_video],
-                            "Path": [video_path[0]],
-                            "Duration": [duration]
-                        })
-                        download_df = pd.concat([new_row, download_df], ignore_index=True)
-                        yield {
-                            "log": f"Successfully downloaded {i}/{total_videos}: {current_video}\nVideo saved at: {video_path}\n",
-                            "up_name": up_name,
-                            "download_progress": f"{i}/{total_videos}",
-                            "current_video": current_video,
-                            "duration": duration,
-                            "download_time": format_time(time.time() - start_time),
-                            "download_speed": download_speed,
-                            "download_size": download_size,
-                            "file_size": file_size,
-                            "progress": progress
-                        }
-
-                        video['downloaded'] = 'True'
-                        video['file_path'] = str(video_path)
-                        save_to_csv(video_urls, csv_path)
-                        print("updated download success status to csv")
-                    else:
-                        print("Yutto is not completed")
-
-                except Exception as e:
-                    if process:
-                        process.terminate()
-                    elapsed_time = time.time() - start_time
-                    yield {
-                        "log": f"Attempt {attempt}/{max_attempts} failed for {current_video}: {e}\n",
-                        "up_name": up_name,
-                        "download_progress": f"{i}/{total_videos}",
-                        "current_video": current_video,
-                        "duration": duration,
-                        "download_time": format_time(elapsed_time),
-                        "download_speed": download_speed,
-                        "download_size": download_size,
-                        "file_size": file_size,
-                        "progress": progress
-                    }
-                    print(f"Attempt {attempt}/{max_attempts} failed for {current_video}: {e}\n")
-                
-                finally:
-                    os.unlink(temp_file_path)  # 删除临时文件
-
-        if not success:
-            video['downloaded'] = 'False'
-            save_to_csv(video_urls, csv_path)
-            print("updated download failed status to csv")
-            error_msg = f"Failed to download {url} after {max_attempts} attempts.\n"
-            with open(log_file, "a", encoding="utf-8") as lf:
-                lf.write(error_msg)
-            yield {
-                "log": error_msg,
-                "up_name": up_name,
-                "download_progress": f"{i}/{total_videos}",
-                "current_video": current_video,
-                "duration": duration,
-                "download_time": "00:00:00",
-                "download_speed": "0 KiB/s",
-                "download_size": "0 KiB",
-                "file_size": "0 KiB",
-                "progress": progress
-            }
-
-    yield {
-        "log": "Download completed successfully!\n",
-        "up_name": up_name,
-        "download_progress": f"{total_videos}/{total_videos}",
-        "current_video": "",
-        "duration": "",
-        "download_time": "00:00:00",
-        "download_speed": "0 KiB/s",
-        "download_size": "0 KiB",
-        "file_size": "0 KiB",
-        "progress": 100
-    }
+            elif isinstance(event, JobLog):
+                print(event.line)
+                delta["log"] = event.line + "\n"
+            elif isinstance(event, JobMerged):
+                merged += 1
+                delta["history"] = merged
+            elif isinstance(event, RunFinished):
+                delta.update(current_video="", duration="", progress=100)
+            if delta:
+                yield delta
+    finally:
+        current_engine.pop("engine", None)
+        await events.aclose()
 
 def play_video(evt: gr.SelectData, lang):
     global download_df
@@ -538,25 +310,41 @@ def handle_playback_choice(choice, video_path):
             print(f"Error opening video file {video_path}: {e}")
     return None, gr.update(visible=False)
 
-def download_wrapper(uid, output_dir, video_quality, sessdata, bili_jct, buvid3):
-    global download_df, abort_current
+def download_wrapper(uid, output_dir, video_quality, sessdata, bili_jct, buvid3, history_page=1, history_sort="time", history_desc=True, lang="zh"):
     save_config(uid, output_dir, video_quality)
-    
+    config = read_basic_config()
+    coalescer = UpdateCoalescer(float(config.get("ui_fps", DEFAULT_UI_FPS)), dataframe_log())
+
     async def run_generator():
-        async for result in run_download(uid, output_dir, video_quality, sessdata, bili_jct, buvid3):
-            yield (
-                result["log"],
-                gr.update(value=result["up_name"], visible=bool(result["up_name"])),
-                gr.update(value=result["download_progress"], visible=bool(result["download_progress"])),
-                result["current_video"],
-                result["duration"],
-                result["download_time"],
-                result["download_speed"],
-                result["download_size"],
-                result["file_size"],
-                gr.update(value=result["progress"], visible=True if result["progress"] > 0 else False),
-                download_df[["Index", "Video Name", "Duration"]]
-            )
+        # 按帧率合并更新
+        stream = coalescer.stream(run_download(uid, output_dir, video_quality, sessdata, bili_jct, buvid3))
+        try:
+            async for changed in stream:
+                yield frame(changed)
+        finally:
+            # 逐层关闭：stream 取消读取任务并关闭 run_download，run_download 关闭引擎的事件流并等待下载取消
+            await stream.aclose()
+
+    def frame(changed):
+        """页面各组件的新值：只更新变化的字段，其余组件用 gr.update() 保持不变"""
+        def field(key, **kwargs):
+            return gr.update(value=changed[key], **kwargs) if key in changed else gr.update()
+        # 下载历史有新记录时才重新读取当前页
+        history = load_history(history_page, history_sort, history_desc, lang) if "history" in changed else (gr.update(),) * 3
+        return (
+            field("log"),
+            field("up_name", visible=bool(changed.get("up_name"))),
+            field("download_progress", visible=bool(changed.get("download_progress"))),
+            field("current_video"),
+            field("duration"),
+            field("download_time"),
+            field("download_speed"),
+            field("download_size"),
+            field("file_size"),
+            field("progress", visible=bool(changed.get("progress"))),
+            *history
+        )
+
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     gen = run_generator()
@@ -566,12 +354,23 @@ def download_wrapper(uid, output_dir, video_quality, sessdata, bili_jct, buvid3)
     except StopAsyncIteration:
         pass
     finally:
+        # 页面停止接收时结束生成器，取消正在进行的下载，等所有任务结束后再关闭事件循环
+        loop.run_until_complete(gen.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
         loop.close()
 
 def abort_download():
-    global abort_current
-    abort_current = True
-    return "Aborting current download attempt...\n"
+    engine = current_engine.get("engine")
+    if engine:
+        engine.abort()
+    log = dataframe_log()
+    log.append("Aborting current download attempt...")
+    return log.text()
+
+def load_earlier_log(page, video, lang):
+    """从磁盘按页读取已移出内存的日志，video 不为空时只读取该视频的日志"""
+    lines = dataframe_log().page(max(1, int(page or 1)), job=video.strip() or None)
+    return "\n".join(lines) + "\n" if lines else TEXTS[lang]["no_earlier_log"]
 
 def create_webui():
     config = load_config()
@@ -607,6 +406,13 @@ def create_webui():
             gr.update(label=texts['download_size_label']),
             gr.update(label=texts['file_size_label']),
             gr.update(value=texts['abort_button']),
+            gr.update(label=texts['earlier_log_label']),
+            gr.update(label=texts['log_page_label']),
+            gr.update(label=texts['log_video_label'], placeholder=texts['log_video_placeholder']),
+            gr.update(value=texts['load_log_button']),
+            gr.update(label=texts['history_page_label']),
+            gr.update(label=texts['history_sort_label'], choices=texts['history_sort_choices']),
+            gr.update(label=texts['history_desc_label']),
             new_lang
         ]
 
@@ -673,12 +479,26 @@ def create_webui():
                             download_speed_display = gr.Textbox(label=TEXTS["zh"]["download_speed_label"], interactive=False, value="0 KiB/s")
                         abort_button = gr.Button(TEXTS["zh"]["abort_button"], variant="stop")
                         output_log = gr.Textbox(label=TEXTS["zh"]["log_label"], lines=10, interactive=False)
+                        earlier_log_accordion = gr.Accordion(TEXTS["zh"]["earlier_log_label"], open=False)
+                        with earlier_log_accordion:
+                            with gr.Row():
+                                log_page_input = gr.Number(label=TEXTS["zh"]["log_page_label"], value=1, precision=0, minimum=1)
+                                log_video_input = gr.Textbox(label=TEXTS["zh"]["log_video_label"], placeholder=TEXTS["zh"]["log_video_placeholder"])
+                            load_log_btn = gr.Button(TEXTS["zh"]["load_log_button"])
+                            earlier_log = gr.Textbox(show_label=False, lines=10, interactive=False)
                     with gr.Column(scale=2):
+                        history_table, history_page, history_text = load_history()
                         downloaded_videos_df = gr.Dataframe(
+                            value=history_table,
                             label=TEXTS["zh"]["downloaded_videos_label"],
                             interactive=True,
                             height=200
                         )
+                        with gr.Row():
+                            history_page_input = gr.Number(label=TEXTS["zh"]["history_page_label"], value=history_page, precision=0, minimum=1)
+                            history_sort_dropdown = gr.Dropdown(label=TEXTS["zh"]["history_sort_label"], choices=TEXTS["zh"]["history_sort_choices"], value="time")
+                            history_desc_checkbox = gr.Checkbox(label=TEXTS["zh"]["history_desc_label"], value=True)
+                        history_info = gr.Markdown(history_text)
                         with gr.Group(visible=False) as dialog_group:
                             dialog_text = gr.Markdown(value="", elem_classes="dialog-text")
                             with gr.Row():
@@ -743,26 +563,46 @@ def create_webui():
                 toggle_btn, credentials_accordion, downloaded_videos_df, video_player,
                 download_btn, web_play_btn, local_play_btn,
                 download_time_display, download_speed_display, download_size_display, file_size_display, abort_button,
+                earlier_log_accordion, log_page_input, log_video_input, load_log_btn,
+                history_page_input, history_sort_dropdown, history_desc_checkbox,
                 lang_state
             ]
         )
 
         download_btn.click(
             fn=download_wrapper,
-            inputs=[uid_input, output_dir_input, quality_dropdown, sessdata_input, bili_jct_input, buvid3_input],
+            inputs=[
+                uid_input, output_dir_input, quality_dropdown, sessdata_input, bili_jct_input, buvid3_input,
+                history_page_input, history_sort_dropdown, history_desc_checkbox, lang_state
+            ],
             outputs=[
                 output_log, up_name_display, download_progress_display,
                 current_video_display, duration_display, download_time_display,
-                download_speed_display, download_size_display, file_size_display, progress_bar, downloaded_videos_df
+                download_speed_display, download_size_display, file_size_display, progress_bar,
+                downloaded_videos_df, history_page_input, history_info
             ]
         )
 
+        # 翻页和排序都由状态库完成，页面只接收当前一页
+        for history_control in (history_page_input, history_sort_dropdown, history_desc_checkbox):
+            history_control.change(
+                fn=load_history,
+                inputs=[history_page_input, history_sort_dropdown, history_desc_checkbox, lang_state],
+                outputs=[downloaded_videos_df, history_page_input, history_info]
+            )
+
         abort_button.click(
             fn=abort_download,
             inputs=None,
             outputs=[output_log]
         )
 
+        load_log_btn.click(
+            fn=load_earlier_log,
+            inputs=[log_page_input, log_video_input, lang_state],
+            outputs=[earlier_log]
+        )
+
         def update_selected_path(evt: gr.SelectData):
             global download_df
             if evt.index and len(evt.index) > 0:
@@ -1,10 +1,10 @@
 import gradio as gr
 import asyncio
-import subprocess
 import os
 import ffmpeg
-from bilibili_upper_download import read_toml_config, get_user_name, get_user_video_urls, get_video_info, download_video
-import time
+from download_engine import DownloadEngine
+from log_buffer import webui_log
+from events import describe, UploaderListed, JobStarted, JobMerged, RunFinished
 # 语言字典（未更改）
 TEXTS = {
     "en": {
@@ -90,181 +90,75 @@ def generate_thumbnail(video_path, output_dir):
         return video_path
 
 async def run_download(uid, output_dir, video_quality, sessdata, bili_jct, buvid3):
+    """通过下载引擎下载UP主的所有视频，把引擎发布的事件转换为界面上各个字段的值"""
     quality_value = video_quality.split(" ")[0]
-    
-    arg_dict = {
-        "uid": int(uid),
-        "output_dir": str(output_dir if output_dir else "~/Downloads"),
-        "video_quality": str(quality_value),
-        "SESSDATA": sessdata,
-        "BILI_JCT": bili_jct,
-        "BUVID3": buvid3,
-    }
 
     try:
-        toml_args = read_toml_config()
-        for key in arg_dict:
-            if key in toml_args["basic"] and toml_args["basic"][key] != "" and toml_args["basic"][key] is not None:
-                arg_dict[key] = toml_args["basic"][key]
+        engine = DownloadEngine.from_config({
+            "output_dir": output_dir,
+            "video_quality": quality_value,
+            "SESSDATA": sessdata,
+            "BILI_JCT": bili_jct,
+            "BUVID3": buvid3,
+        })
     except Exception as e:
         yield {"log": f"加载 TOML 配置失败: {e}\n", "up_name": "", "total_videos": "", "current_video": "", "duration": "", "progress": 0, "downloaded_videos": []}
         return
 
-    up_name = await get_user_name(int(uid))
-    video_urls = await get_user_video_urls(int(uid))
-    total_videos = len(video_urls)
-
-    output_dir = os.path.expanduser(os.path.join(arg_dict["output_dir"], up_name))
-    os.makedirs(output_dir, exist_ok=True)
-    downloaded_videos = []
-
-    yield {
-        "log": f"获取 UID {uid} 的视频列表 (UP: {up_name})\n找到 {total_videos} 个视频待下载\n",
-        "up_name": up_name,
-        "total_videos": str(total_videos),
-        "current_video": "",
-        "duration": "",
-        "progress": 0,
-        "downloaded_videos": downloaded_videos
-    }
-
-    if not video_urls:
-        yield {
-            "log": "该用户没有找到视频。\n",
-            "up_name": up_name,
-            "total_videos": "0",
-            "current_video": "",
-            "duration": "",
-            "progress": 0,
-            "downloaded_videos": downloaded_videos
-        }
-        return
-
-    log_file = os.path.join(os.path.dirname(__file__), "download_errors.log")
-    for i, url in enumerate(video_urls, 1):
-        print(f"正在下载视频 {i}/{len(video_urls)}")
-        bvid = url.split("/")[-1]
-        video_info = await get_video_info(bvid, arg_dict["SESSDATA"], arg_dict["BILI_JCT"], arg_dict["BUVID3"])
-        current_video = video_info["title"]
-        duration = str(video_info["duration"]) + "s"
-        progress = round((i / total_videos) * 100, 2)
-        
-        yield {
-            "log": f"开始下载 {i}/{total_videos}: {current_video}\n",
-            "up_name": up_name,
-            "total_videos": str(total_videos),
-            "current_video": current_video,
-            "duration": duration,
-            "progress": progress,
-            "downloaded_videos": downloaded_videos
-        }
-
-        estimated_time = 5 + video_info["duration"] * 2
-        max_attempts = 5
-        success = False
-        attempt = 0
-
-        while attempt < max_attempts and not success:
-            attempt += 1
-            try:
-                yield {
-                    "log": f"尝试 {attempt}/{max_attempts} 下载视频 {i}/{total_videos}: {current_video}\n",
-                    "up_name": up_name,
-                    "total_videos": str(total_videos),
-                    "current_video": current_video,
-                    "duration": duration,
-                    "progress": progress,
-                    "downloaded_videos": downloaded_videos
-                }
-                download_video(url, output_dir, arg_dict["video_quality"], arg_dict["SESSDATA"], title=current_video, timeout=estimated_time)
-                success = True
-                video_path = os.path.abspath(os.path.join(output_dir, f"{current_video}.mp4"))
-                downloaded_videos.append(video_path)
-                time.sleep(1)  # 等待文件写入
-                thumbnail_path = generate_thumbnail(video_path, output_dir)
-                progress = round((i / total_videos) * 100, 2)
-                yield {
-                    "log": f"成功下载 {i}/{total_videos}: {current_video}\n视频保存至: {video_path}\n缩略图: {thumbnail_path}\n",
-                    "up_name": up_name,
-                    "total_videos": str(total_videos),
-                    "current_video": current_video,
-                    "duration": duration,
-                    "progress": progress,
-                    "downloaded_videos": downloaded_videos
-                }
-            except subprocess.TimeoutExpired:
-                yield {
-                    "log": f"尝试 {attempt}/{max_attempts} 下载 {url} 超时，正在重试...\n",
-                    "up_name": up_name,
-                    "total_videos": str(total_videos),
-                    "current_video": current_video,
-                    "duration": duration,
-                    "progress": progress,
-                    "downloaded_videos": downloaded_videos
-                }
-            except subprocess.CalledProcessError as e:
-                yield {
-                    "log": f"尝试 {attempt}/{max_attempts} 下载 {url} 出错: {e}，正在重试...\n",
-                    "up_name": up_name,
-                    "total_videos": str(total_videos),
-                    "current_video": current_video,
-                    "duration": duration,
-                    "progress": progress,
-                    "downloaded_videos": downloaded_videos
-                }
-            except Exception as e:
-                yield {
-                    "log": f"尝试 {attempt}/{max_attempts} 下载 {url} 遇到未知错误: {e}，正在重试...\n",
-                    "up_name": up_name,
-                    "total_videos": str(total_videos),
-                    "current_video": current_video,
-                    "duration": duration,
-                    "progress": progress,
-                    "downloaded_videos": downloaded_videos
-                }
-
-        if not success:
-            error_msg = f"下载 {url} 在 {max_attempts} 次尝试后失败。\n"
-            with open(log_file, "a", encoding="utf-8") as lf:
-                lf.write(error_msg)
-            yield {
-                "log": error_msg,
-                "up_name": up_name,
-                "total_videos": str(total_videos),
-                "current_video": current_video,
-                "duration": duration,
-                "progress": progress,
-                "downloaded_videos": downloaded_videos
-            }
-
-    yield {
-        "log": "下载全部完成！\n",
-        "up_name": up_name,
-        "total_videos": str(total_videos),
-        "current_video": "",
-        "duration": "",
-        "progress": 100,
-        "downloaded_videos": downloaded_videos
-    }
+    # 日志只保留最近的若干行，更早的写入磁盘（默认 logs/webui_gallery.log）
+    log = webui_log("webui_gallery", engine.config)
+    downloaded_videos = []  # 存储视频路径
+    state = {"log": "", "up_name": "", "total_videos": "", "current_video": "", "duration": "", "progress": 0, "downloaded_videos": downloaded_videos}
+    events = engine.events([{"uid": int(uid)}])
+    try:
+        async for event in events:
+            message = describe(event, "zh")
+            if not message:
+                continue
+            log.append(message, getattr(event, "title", ""))
+            state["log"] = log.text()
+            if isinstance(event, UploaderListed):
+                state.update(up_name=event.up_name, total_videos=str(event.total))
+            elif isinstance(event, JobStarted):
+                state.update(
+                    current_video=event.title, duration=event.duration,
+                    progress=round(event.index / event.total * 100, 2) if event.total else 0
+                )
+            elif isinstance(event, JobMerged):
+                for video_path in event.file_paths:
+                    # 下载器已保存封面时直接使用，否则从视频第一帧生成缩略图
+                    await asyncio.to_thread(generate_thumbnail, video_path, os.path.dirname(video_path))
+                downloaded_videos.extend(os.path.abspath(path) for path in event.file_paths)
+            elif isinstance(event, RunFinished):
+                state.update(current_video="", duration="", progress=100)
+            yield dict(state)
+    finally:
+        # 关闭引擎的事件流：取消并等待下载结束（结束 yutto 子进程）
+        await events.aclose()
 
 def download_wrapper(uid, output_dir, video_quality, sessdata, bili_jct, buvid3):
     async def run_generator():
-        async for result in run_download(uid, output_dir, video_quality, sessdata, bili_jct, buvid3):
-            gallery_videos = []
-            for video_path in result["downloaded_videos"][-50:]:
-                base_name = os.path.splitext(os.path.basename(video_path))[0]
-                thumbnail_path = os.path.join(os.path.dirname(video_path), f"{base_name}-poster.jpg")
-                gallery_videos.append(thumbnail_path if os.path.exists(thumbnail_path) else video_path)
-            yield (
-                result["log"],
-                result["up_name"],
-                result["total_videos"],
-                result["current_video"],
-                result["duration"],
-                result["progress"],
-                gallery_videos,
-                result["downloaded_videos"]
-            )
+        updates = run_download(uid, output_dir, video_quality, sessdata, bili_jct, buvid3)
+        try:
+            async for result in updates:
+                gallery_videos = []
+                for video_path in result["downloaded_videos"][-50:]:
+                    base_name = os.path.splitext(os.path.basename(video_path))[0]
+                    thumbnail_path = os.path.join(os.path.dirname(video_path), f"{base_name}-poster.jpg")
+                    gallery_videos.append(thumbnail_path if os.path.exists(thumbnail_path) else video_path)
+                yield (
+                    result["log"],
+                    result["up_name"],
+                    result["total_videos"],
+                    result["current_video"],
+                    result["duration"],
+                    result["progress"],
+                    gallery_videos,
+                    result["downloaded_videos"]
+                )
+        finally:
+            await updates.aclose()
+
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     gen = run_generator()
@@ -276,6 +170,9 @@ def download_wrapper(uid, output_dir, video_quality, sessdata, bili_jct, buvid3)
     except StopAsyncIteration:
         pass
     finally:
+        # 页面停止接收时结束生成器，取消正在进行的下载，等所有任务结束后再关闭事件循环
+        loop.run_until_complete(gen.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
         loop.close()
 
 async def load_video_with_timeout(video_path, timeout=5):